@@ -3,28 +3,37 @@ import os
 import sys
 from typing import Tuple, List, Dict
 
+import numpy as np
 import torch
 import torch.nn as nn
 import torch.optim as optim
 from torch.utils.data import Dataset, DataLoader
-from sklearn.model_selection import train_test_split
-from sklearn.metrics import accuracy_score, f1_score
-import matplotlib.pyplot as plt
 
 try:
     from . import data as data_mod  # type: ignore
+    from . import shards as shards_mod  # type: ignore
+    from .tensor_loader import TensorBatchLoader  # type: ignore
+    from .checkpoint import read_checkpoint  # type: ignore
+    from .training import Checkpointer, EarlyStopping, resume_state  # type: ignore
+    from .crossval import report as report_kfold, run_kfold  # type: ignore
 except ImportError:  # pragma: no cover
     current_dir = os.path.dirname(os.path.abspath(__file__))
     parent_dir = os.path.dirname(current_dir)
     if parent_dir not in sys.path:
         sys.path.append(parent_dir)
     import ml.data as data_mod  # type: ignore
+    import ml.shards as shards_mod  # type: ignore
+    from ml.tensor_loader import TensorBatchLoader  # type: ignore
+    from ml.checkpoint import read_checkpoint  # type: ignore
+    from ml.training import Checkpointer, EarlyStopping, resume_state  # type: ignore
+    from ml.crossval import report as report_kfold, run_kfold  # type: ignore
 
 
 class GradesDataset(Dataset):
-    def __init__(self, X_df, y_series):
-        self.X = torch.tensor(X_df.values, dtype=torch.float32)
-        self.y = torch.tensor(y_series.values, dtype=torch.long)
+    def __init__(self, X, y):
+        # Accepts DataFrame/Series or the numpy arrays from data.build_features(return_type='numpy')
+        self.X = torch.as_tensor(np.asarray(X, dtype=np.float32))
+        self.y = torch.as_tensor(np.asarray(y, dtype=np.int64))
     def __len__(self):
         return len(self.y)
     def __getitem__(self, idx):
@@ -57,36 +66,80 @@ class ConvClassifier(nn.Module):
         return self.classifier(feats)
 
 
-def build_loaders(X, y, batch_size: int, test_size: float, seed: int = 42) -> Tuple[DataLoader, DataLoader]:
-    X_train, X_val, y_train, y_val = train_test_split(X, y, test_size=test_size, random_state=seed, stratify=y)
+class ShardClassifierLoader:
+    """Streams (features, bucket) batches from a memory-mapped ``shards.ShardedDataset``."""
+    def __init__(self, dataset, batch_size: int, shuffle: bool, scale_grades: bool, add_difficulty: bool, ten_class: bool, bucket_5: bool, seed: int = 42):
+        self.dataset = dataset
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.feature_kwargs = dict(scale_grades=scale_grades, add_difficulty=add_difficulty, ten_class=ten_class, bucket_5=bucket_5)
+        self.seed = seed
+        self.epoch = 0
+
+    def __iter__(self):
+        self.epoch += 1
+        for batch in self.dataset.iter_batches(self.batch_size, shuffle=self.shuffle, seed=self.seed + self.epoch):
+            X, y = data_mod.build_feature_arrays(batch['past_grades'], batch['difficulty'], batch['current_grade'], **self.feature_kwargs)
+            yield torch.from_numpy(X), torch.from_numpy(y)
+
+
+def build_loaders(X, y, batch_size: int, test_size: float, seed: int = 42, loader: str = 'tensor', pin_memory: bool = False,
+                  split: Tuple[np.ndarray, np.ndarray] | None = None):
+    """Train/val loaders; ``loader='tensor'`` slices whole batches, ``'torch'`` uses the per-item DataLoader.
+
+    ``split`` gives explicit (train, val) row indices (e.g. a cross-validation fold) instead of a stratified ``test_size`` split.
+    """
+    from sklearn.model_selection import train_test_split
+    if split is not None:
+        X_train, X_val, y_train, y_val = X[split[0]], X[split[1]], y[split[0]], y[split[1]]
+    else:
+        X_train, X_val, y_train, y_val = train_test_split(X, y, test_size=test_size, random_state=seed, stratify=y)
+    train_ds, val_ds = GradesDataset(X_train, y_train), GradesDataset(X_val, y_val)
+    if loader == 'torch':
+        return (
+            DataLoader(train_ds, batch_size=batch_size, shuffle=True, pin_memory=pin_memory),
+            DataLoader(val_ds, batch_size=batch_size, shuffle=False, pin_memory=pin_memory)
+        )
     return (
-        DataLoader(GradesDataset(X_train, y_train), batch_size=batch_size, shuffle=True),
-        DataLoader(GradesDataset(X_val, y_val), batch_size=batch_size, shuffle=False)
+        TensorBatchLoader(train_ds.X, train_ds.y, batch_size=batch_size, shuffle=True, pin_memory=pin_memory, seed=seed),
+        TensorBatchLoader(val_ds.X, val_ds.y, batch_size=batch_size, shuffle=False, pin_memory=pin_memory)
     )
 
 
-def train(model, train_loader, val_loader, device, epochs: int, lr: float):
+def train(model, train_loader, val_loader, device, epochs: int, lr: float, optimizer=None, verbose: bool = True,
+          patience: int = 0, min_delta: float = 0.0, checkpointer=None, resume: Dict | None = None):
+    """Train up to ``epochs`` epochs; returns (best val accuracy, per-epoch history).
+
+    The model ends up holding the weights of the best validation epoch; see
+    ``lstm_regression.train`` for ``patience`` / ``checkpointer`` / ``resume``.
+    Pass ``optimizer`` to continue a previous run with its optimizer state; ``lr`` is then unused.
+    """
+    from sklearn.metrics import accuracy_score, f1_score
     criterion = nn.CrossEntropyLoss()
-    optimiz = optim.Adam(model.parameters(), lr=lr)
     model.to(device)
+    optimiz = optimizer if optimizer is not None else optim.Adam(model.parameters(), lr=lr)
     history: Dict[str, List[float]] = {k: [] for k in ['train_loss','val_loss','val_acc','val_f1']}
-    best_acc = 0.0
-    for ep in range(1, epochs+1):
+    stopper = EarlyStopping(patience=patience, min_delta=min_delta, maximize=True)
+    start = resume_state(resume, optimiz, stopper, history) if resume is not None else 1
+    for ep in range(start, epochs+1):
         model.train()
         total_loss = 0.0
+        n_train = 0
         for xb, yb in train_loader:
-            xb, yb = xb.to(device), yb.to(device)
+            xb, yb = xb.to(device, non_blocking=True), yb.to(device, non_blocking=True)
             optimiz.zero_grad()
             logits = model(xb)
             loss = criterion(logits, yb)
             loss.backward()
             optimiz.step()
             total_loss += loss.item() * xb.size(0)
-        train_loss = total_loss / len(train_loader.dataset)
+            n_train += xb.size(0)
+        train_loss = total_loss / max(1, n_train)
 
         # Validation pass with loss
         model.eval()
         val_loss_sum = 0.0
+        n_val = 0
         preds_collect = []
         true_collect = []
         with torch.no_grad():
@@ -95,9 +148,10 @@ def train(model, train_loader, val_loader, device, epochs: int, lr: float):
                 logits = model(xb)
                 loss = criterion(logits, yb)
                 val_loss_sum += loss.item() * xb.size(0)
+                n_val += xb.size(0)
                 preds_collect.append(logits.argmax(dim=1).cpu())
                 true_collect.append(yb.cpu())
-        val_loss = val_loss_sum / len(val_loader.dataset)
+        val_loss = val_loss_sum / max(1, n_val)
         preds_cat = torch.cat(preds_collect)
         true_cat = torch.cat(true_collect)
         acc = accuracy_score(true_cat.numpy(), preds_cat.numpy())
@@ -108,12 +162,32 @@ def train(model, train_loader, val_loader, device, epochs: int, lr: float):
         history['val_acc'].append(acc)
         history['val_f1'].append(f1m)
 
-        print(f'Epoch {ep:03d} | TrainLoss {train_loss:.4f} | ValLoss {val_loss:.4f} | ValAcc {acc*100:.2f}% | F1_macro {f1m:.3f}')
-        if acc > best_acc:
-            best_acc = acc
+        mark = ' | *' if stopper.update(acc, model, ep) else ''
+        if verbose:
+            print(f'Epoch {ep:03d} | TrainLoss {train_loss:.4f} | ValLoss {val_loss:.4f} | ValAcc {acc*100:.2f}% | F1_macro {f1m:.3f}{mark}')
+        stop = stopper.should_stop
+        if checkpointer is not None:
+            checkpointer.maybe_save(ep, model, optimiz, stopper, history, final=stop or ep == epochs)
+        if stop:
+            if verbose:
+                print(f'Early stopping: no improvement for {patience} epochs (best epoch {stopper.best_epoch})')
+            break
+    stopper.restore(model)
+    best_acc = stopper.best if stopper.best is not None else 0.0
     return best_acc, history
 
 
+def train_fold(data, train_idx: np.ndarray, val_idx: np.ndarray, opts: Dict) -> Dict[str, float]:
+    """Train one cross-validation fold (see ``ml.crossval``); returns metrics of its best epoch."""
+    X, y = data['X'], data['y']
+    train_loader, val_loader = build_loaders(X, y, batch_size=opts['batch_size'], test_size=0.0, seed=opts['seed'], split=(train_idx, val_idx))
+    model = ConvClassifier(total_dim=X.shape[1], seq_len=opts['seq_len'], num_classes=opts['num_classes'])
+    best_acc, history = train(model, train_loader, val_loader, 'cpu', epochs=opts['epochs'], lr=opts['lr'], verbose=False,
+                              patience=opts['patience'], min_delta=opts['min_delta'])
+    best = history['val_acc'].index(best_acc)
+    return {'accuracy': history['val_acc'][best], 'macro_f1': history['val_f1'][best], 'best_epoch': best + 1}
+
+
 def main():
     parser = argparse.ArgumentParser(description='Grade bucket classifier (MLP or Conv1D)')
     parser.add_argument('--limit', type=int, default=0)
@@ -129,14 +203,23 @@ def main():
     parser.add_argument('--test-size', type=float, default=0.2)
     parser.add_argument('--device', type=str, default='auto')
     parser.add_argument('--save-path', type=str, default='')
+    parser.add_argument('--loader', type=str, default='tensor', choices=['tensor', 'torch'], help='Batch-slicing tensor loader or per-item torch DataLoader')
+    parser.add_argument('--pin-memory', action='store_true', help='Page-locked batch buffers for faster host-to-GPU copies')
+    parser.add_argument('--shards', type=str, default='', help='Shard directory to stream training data from (generated from --limit/--seed/--seq-len if missing; an existing one must match them)')
+    parser.add_argument('--shard-size', type=int, default=1_000_000, help='Rows per shard when generating --shards')
+    parser.add_argument('--patience', type=int, default=0, help='Stop after this many epochs without val accuracy improvement (0 = run all epochs)')
+    parser.add_argument('--min-delta', type=float, default=0.0, help='Minimum val accuracy increase (fraction) that counts as an improvement')
+    parser.add_argument('--checkpoint-path', type=str, default='', help='Write a resumable training checkpoint here')
+    parser.add_argument('--checkpoint-every', type=int, default=1, help='Epochs between training checkpoints')
+    parser.add_argument('--resume', type=str, default='', help='Continue from a training checkpoint written via --checkpoint-path')
+    parser.add_argument('--kfold', type=int, default=0, help='Evaluate with stratified K-fold cross-validation (folds trained in parallel) instead of training one model')
+    parser.add_argument('--kfold-workers', type=int, default=0, help='Parallel fold processes (0 -> min(K, CPUs))')
+    parser.add_argument('--seed', type=int, default=42, help='Data generation and train/val split seed')
     args = parser.parse_args()
 
     device = 'cuda' if (args.device=='auto' and torch.cuda.is_available()) else ('cpu' if args.device=='auto' else args.device)
     print(f'Using device: {device}')
 
-    raw = data_mod.fetch_raw(args.limit)
-    X_df, y_series = data_mod.build_features(raw, scale_grades=args.scale_grades, add_difficulty=args.add_difficulty, ten_class=args.ten_class, bucket_5=args.bucket_5)
-
     if args.bucket_5:
         num_classes = 5
     elif args.ten_class:
@@ -144,26 +227,61 @@ def main():
     else:
         raise SystemExit('Specify --ten-class or --bucket-5')
 
-    train_loader, val_loader = build_loaders(X_df, y_series, batch_size=args.batch_size, test_size=args.test_size)
-    model = ConvClassifier(total_dim=X_df.shape[1], seq_len=args.seq_len, num_classes=num_classes)
+    if args.kfold:
+        if args.shards:
+            raise SystemExit('--kfold works on in-memory data; drop --shards')
+        raw = data_mod.fetch_raw_arrays(args.limit, seed=args.seed)
+        X, y = data_mod.build_features(raw, scale_grades=args.scale_grades, add_difficulty=args.add_difficulty, ten_class=args.ten_class, bucket_5=args.bucket_5, return_type='numpy')
+        opts = dict(vars(args), num_classes=num_classes)
+        result = run_kfold('Model', {'X': X, 'y': y}, opts, k=args.kfold, workers=args.kfold_workers, seed=args.seed, stratify=y)
+        report_kfold(result, scale={'accuracy': 100.0})
+        return
 
-    best_acc, history = train(model, train_loader, val_loader, device, epochs=args.epochs, lr=args.lr)
-    print(f'Best validation accuracy: {best_acc*100:.2f}%')
+    if args.shards:
+        try:
+            shards_mod.ensure_shards(args.shards, args.limit if args.limit and args.limit > 0 else None, shard_size=args.shard_size, seed=args.seed, seq_len=args.seq_len)
+        except ValueError as e:
+            raise SystemExit(str(e))
+        train_ds, val_ds = shards_mod.ShardedDataset(args.shards).split(args.test_size)
+        feature_kwargs = dict(scale_grades=args.scale_grades, add_difficulty=args.add_difficulty, ten_class=args.ten_class, bucket_5=args.bucket_5)
+        train_loader = ShardClassifierLoader(train_ds, args.batch_size, shuffle=True, seed=args.seed, **feature_kwargs)
+        val_loader = ShardClassifierLoader(val_ds, args.batch_size, shuffle=False, seed=args.seed, **feature_kwargs)
+        feature_columns = data_mod.feature_columns(train_ds.seq_len, args.add_difficulty)
+    else:
+        raw = data_mod.fetch_raw_arrays(args.limit, seed=args.seed)
+        X, y = data_mod.build_features(raw, scale_grades=args.scale_grades, add_difficulty=args.add_difficulty, ten_class=args.ten_class, bucket_5=args.bucket_5, return_type='numpy')
+        train_loader, val_loader = build_loaders(X, y, batch_size=args.batch_size, test_size=args.test_size, seed=args.seed, loader=args.loader, pin_memory=args.pin_memory)
+        feature_columns = data_mod.feature_columns(raw['past_grades'].shape[1], args.add_difficulty)
+    model = ConvClassifier(total_dim=len(feature_columns), seq_len=args.seq_len, num_classes=num_classes)
+    resume = None
+    if args.resume:
+        resume = read_checkpoint(args.resume)
+        model.load_state_dict(resume['model_state'])
+        print(f"Resuming from {args.resume} after epoch {resume.get('epoch')}")
 
-    if args.save_path:
-        ckpt = {
-            'model_state': model.state_dict(),
-            'input_dim': X_df.shape[1],
+    def checkpoint_meta():
+        return {
+            'input_dim': len(feature_columns),
             'num_classes': num_classes,
             'seq_len': args.seq_len,
-            'feature_columns': list(X_df.columns),
+            'feature_columns': feature_columns,
             'args': vars(args)
         }
+    checkpointer = Checkpointer(args.checkpoint_path, checkpoint_meta, every=args.checkpoint_every) if args.checkpoint_path else None
+
+    best_acc, history = train(model, train_loader, val_loader, device, epochs=args.epochs, lr=args.lr,
+                              patience=args.patience, min_delta=args.min_delta, checkpointer=checkpointer, resume=resume)
+    print(f'Best validation accuracy: {best_acc*100:.2f}%')
+
+    if args.save_path:
+        # train() restored the best epoch's weights
+        ckpt = dict(checkpoint_meta(), model_state=model.state_dict(), best_val_acc=best_acc)
         torch.save(ckpt, args.save_path)
         print(f'Saved model to {args.save_path}')
 
-    # Plot if matplotlib available (already imported) and interactive/CLI use-case
+    # Plot if matplotlib available and interactive/CLI use-case
     try:
+        import matplotlib.pyplot as plt
         plt.figure(figsize=(8,4))
         plt.subplot(1,2,1)
         plt.plot(history['train_loss'], label='train')
@@ -181,13 +299,17 @@ def main():
         pass
 
 
-def load_model(path: str):
-    ckpt = torch.load(path, map_location='cpu')
+def model_from_checkpoint(ckpt: Dict):
+    """Build the eval-mode classifier from an already-read checkpoint dict."""
     model = ConvClassifier(total_dim=ckpt['input_dim'], seq_len=ckpt.get('seq_len',10), num_classes=ckpt['num_classes'])
     model.load_state_dict(ckpt['model_state'])
     model.eval()
     return model, ckpt
 
 
+def load_model(path: str):
+    return model_from_checkpoint(read_checkpoint(path))
+
+
 if __name__ == '__main__':
     main()
@@ -1,15 +1,26 @@
 """ml package public API.
 
-The training data utilities require pandas. For minimal inference images where
-only model loading and serving are needed, pandas (and transitive heavy deps)
-are omitted. We therefore guard the import of data so the package still loads.
+The training data utilities require pandas, and the model classes pull in torch
+and sklearn. For minimal inference images where only model loading and serving
+are needed those are omitted, so the public names are resolved lazily on first
+access and importing the package itself stays cheap.
 """
+import importlib
 
-try:  # Optional heavy dependency path
-	from . import data  # type: ignore  # noqa: F401
-except Exception:  # pragma: no cover - acceptable in minimal image
-	data = None  # type: ignore
+__all__ = ["data", "load_model", "ConvClassifier"]
 
-from .model import load_model, ConvClassifier  # noqa: F401
 
-__all__ = [name for name in ["data", "load_model", "ConvClassifier"] if name]
+def __getattr__(name):
+	if name == "data":
+		try:  # Optional heavy dependency path
+			# import_module, not "from . import data": that would re-enter this hook
+			data = importlib.import_module(f"{__name__}.data")
+		except Exception:  # pragma: no cover - acceptable in minimal image
+			data = None  # type: ignore
+		globals()["data"] = data
+		return data
+	if name in ("load_model", "ConvClassifier"):
+		value = getattr(importlib.import_module(f"{__name__}.Model"), name)
+		globals()[name] = value
+		return value
+	raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,171 @@
+"""Asyncio micro-batching for the inference endpoints.
+
+Concurrent requests are queued and flushed as one batch as soon as either
+``max_batch_size`` items are waiting or ``max_wait_ms`` has elapsed since the
+first item of the batch was picked up. The batch function receives the list of
+queued items and must return one result per item, in order. When an executor
+is given the batch function runs there, so the event loop stays free while the
+model computes.
+"""
+import asyncio
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+
+class BatchStats:
+    """Running counters used to tune batch size / wait time against latency."""
+
+    def __init__(self):
+        self.requests = 0
+        self.batches = 0
+        self.errors = 0
+        self.cancelled = 0
+        self.max_queue_depth = 0
+        self.max_batch_seen = 0
+        self.batch_size_counts: Dict[int, int] = {}
+        self.total_wait_s = 0.0
+        self.max_wait_s = 0.0
+        self.total_run_s = 0.0
+
+    def record_batch(self, size: int, waits: List[float], run_s: float):
+        self.batches += 1
+        self.requests += size
+        self.max_batch_seen = max(self.max_batch_seen, size)
+        self.batch_size_counts[size] = self.batch_size_counts.get(size, 0) + 1
+        if waits:
+            self.total_wait_s += sum(waits)
+            self.max_wait_s = max(self.max_wait_s, max(waits))
+        self.total_run_s += run_s
+
+    def snapshot(self, queue_depth: int) -> Dict[str, Any]:
+        return {
+            'queue_depth': queue_depth,
+            'max_queue_depth': self.max_queue_depth,
+            'requests': self.requests,
+            'batches': self.batches,
+            'errors': self.errors,
+            'cancelled': self.cancelled,
+            'mean_batch_size': (self.requests / self.batches) if self.batches else 0.0,
+            'max_batch_size_seen': self.max_batch_seen,
+            'batch_size_counts': {str(k): v for k, v in sorted(self.batch_size_counts.items())},
+            'mean_queue_wait_ms': (self.total_wait_s / self.requests * 1000.0) if self.requests else 0.0,
+            'max_queue_wait_ms': self.max_wait_s * 1000.0,
+            'mean_batch_run_ms': (self.total_run_s / self.batches * 1000.0) if self.batches else 0.0,
+        }
+
+
+class MicroBatcher:
+    """Collects concurrent ``submit`` calls into batches for ``batch_fn``.
+
+    The worker task is started lazily on the first ``submit`` so the batcher
+    binds to whichever event loop is serving requests.
+    """
+
+    def __init__(self, batch_fn: Callable[[List[Any]], List[Any]], max_batch_size: int = 32, max_wait_ms: float = 2.0, executor=None,
+                 on_batch: Optional[Callable[[int, List[float], float], None]] = None):
+        if max_batch_size < 1:
+            raise ValueError('max_batch_size must be >= 1')
+        self.batch_fn = batch_fn
+        self.on_batch = on_batch  # called with (batch size, per-item queue waits in s, run time in s)
+        self.executor = executor  # anything with submit(fn, *args) -> concurrent.futures.Future
+        self.max_batch_size = int(max_batch_size)
+        self.max_wait_s = max(0.0, float(max_wait_ms)) / 1000.0
+        self.stats = BatchStats()
+        self._queue: Optional[asyncio.Queue] = None
+        self._full: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._busy = False
+
+    def _ensure_started(self):
+        loop = asyncio.get_running_loop()
+        if self._task is None or self._task.done() or self._loop is not loop:
+            self._loop = loop
+            self._queue = asyncio.Queue()
+            self._full = asyncio.Event()
+            self._task = loop.create_task(self._worker())
+
+    @property
+    def queue_depth(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    async def submit(self, item: Any) -> Any:
+        self._ensure_started()
+        fut = self._loop.create_future()
+        self._queue.put_nowait((item, fut, time.perf_counter()))
+        depth = self._queue.qsize()
+        if depth > self.stats.max_queue_depth:
+            self.stats.max_queue_depth = depth
+        # The worker already holds the first item of the batch it is filling
+        if depth >= self.max_batch_size - 1:
+            self._full.set()
+        return await fut
+
+    async def close(self):
+        """Stop once every queued request has been answered."""
+        while self._queue is not None and (self._busy or not self._queue.empty()):
+            await asyncio.sleep(max(self.max_wait_s, 0.001))
+        await self.stop()
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _worker(self):
+        queue = self._queue
+        while True:
+            batch = [await queue.get()]
+            self._busy = True
+            if self.max_wait_s > 0 and queue.qsize() + 1 < self.max_batch_size:
+                self._full.clear()
+                try:
+                    await asyncio.wait_for(self._full.wait(), timeout=self.max_wait_s)
+                except asyncio.TimeoutError:
+                    pass
+            while len(batch) < self.max_batch_size and not queue.empty():
+                batch.append(queue.get_nowait())
+            try:
+                await self._run(batch)
+            finally:
+                self._busy = False
+
+    async def _run(self, batch):
+        live = [entry for entry in batch if not entry[1].done()]
+        self.stats.cancelled += len(batch) - len(live)
+        if not live:
+            return
+        started = time.perf_counter()
+        waits = [started - enqueued for _, _, enqueued in live]
+        try:
+            items = [item for item, _, _ in live]
+            if self.executor is not None:
+                results = await asyncio.wrap_future(self.executor.submit(self.batch_fn, items))
+            else:
+                results = self.batch_fn(items)
+            if len(results) != len(live):
+                raise RuntimeError(f'batch function returned {len(results)} results for {len(live)} items')
+        except Exception as e:
+            self.stats.errors += 1
+            for _, fut, _ in live:
+                if not fut.done():
+                    fut.set_exception(e)
+            return
+        finally:
+            run_s = time.perf_counter() - started
+            self.stats.record_batch(len(live), waits, run_s)
+            if self.on_batch is not None:
+                self.on_batch(len(live), waits, run_s)
+        for (_, fut, _), res in zip(live, results):
+            if not fut.done():
+                fut.set_result(res)
+
+    def snapshot(self) -> Dict[str, Any]:
+        snap = self.stats.snapshot(self.queue_depth)
+        snap['max_batch_size'] = self.max_batch_size
+        snap['max_wait_ms'] = self.max_wait_s * 1000.0
+        return snap
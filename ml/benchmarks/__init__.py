@@ -0,0 +1 @@
+"""Benchmarks for the ml package; run each module with ``python -m ml.benchmarks.<name>``."""
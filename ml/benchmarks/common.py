@@ -0,0 +1,46 @@
+"""Small helpers shared by the benchmark modules."""
+import json
+import os
+import platform
+import subprocess
+import time
+from typing import Dict, List, Sequence
+
+
+def percentiles(latencies_s: Sequence[float], points=(50, 95, 99)) -> Dict[str, float]:
+    """Latency percentiles in milliseconds (nearest-rank)."""
+    if not latencies_s:
+        return {f'p{p}_ms': 0.0 for p in points}
+    ordered = sorted(latencies_s)
+    out = {}
+    for p in points:
+        rank = max(0, min(len(ordered) - 1, int(round(p / 100.0 * len(ordered) + 0.5)) - 1))
+        out[f'p{p}_ms'] = ordered[rank] * 1000.0
+    out['mean_ms'] = sum(ordered) / len(ordered) * 1000.0
+    return out
+
+
+def environment() -> Dict[str, object]:
+    """Context recorded next to results so runs from different commits/boxes can be compared."""
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, timeout=5).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        commit = ''
+    try:
+        import torch
+        torch_version = torch.__version__
+    except ImportError:
+        torch_version = None
+    return {
+        'commit': commit,
+        'python': platform.python_version(),
+        'torch': torch_version,
+        'cpu_count': os.cpu_count(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    }
+
+
+def write_json(path: str, benchmark: str, config: Dict, results: List[Dict]):
+    with open(path, 'w') as f:
+        json.dump({'benchmark': benchmark, 'environment': environment(), 'config': config, 'results': results}, f, indent=2)
+    print(f'Wrote {path}')
@@ -0,0 +1,89 @@
+"""Epoch timing: per-item torch DataLoader vs the batch-slicing TensorBatchLoader.
+
+Measures (a) one pass over the training split with no model and (b) one full
+training epoch of the LSTM regressor, for each batch size.
+
+Usage:
+    python -m ml.benchmarks.loader --samples 200000 --batch-sizes 32,128,512
+"""
+import argparse
+import json
+import time
+
+import torch
+import torch.nn as nn
+from torch.utils.data import DataLoader, TensorDataset
+
+from ml import data as data_mod
+from ml.lstm_regression import StudentPerformanceModel
+from ml.tensor_loader import TensorBatchLoader
+
+
+def _iterate(loader) -> float:
+    started = time.perf_counter()
+    for _ in loader:
+        pass
+    return time.perf_counter() - started
+
+
+def _train_epoch(loader, model, optimiz, criterion) -> float:
+    model.train()
+    started = time.perf_counter()
+    for past, diff, y in loader:
+        optimiz.zero_grad()
+        loss = criterion(model(past, diff), y)
+        loss.backward()
+        optimiz.step()
+    return time.perf_counter() - started
+
+
+def run(samples: int, batch_sizes, repeats: int, train_epoch: bool):
+    raw = data_mod.generate_student_arrays(samples)
+    past = torch.from_numpy(raw['past_grades'] / 100.0)
+    diff = torch.from_numpy((raw['difficulty'].astype('float32') - 1) / 9.0)
+    y = torch.from_numpy(raw['current_grade'] / 100.0)
+    results = []
+    for bs in batch_sizes:
+        loaders = {
+            'torch_dataloader': DataLoader(TensorDataset(past, diff, y), batch_size=bs, shuffle=True),
+            'tensor_batch_loader': TensorBatchLoader(past, diff, y, batch_size=bs, shuffle=True, seed=0),
+        }
+        row = {'batch_size': bs}
+        for name, loader in loaders.items():
+            row[f'{name}_iter_s'] = min(_iterate(loader) for _ in range(repeats))
+            if train_epoch:
+                torch.manual_seed(0)
+                model = StudentPerformanceModel()
+                optimiz = torch.optim.Adam(model.parameters(), lr=1e-3)
+                row[f'{name}_train_s'] = min(_train_epoch(loader, model, optimiz, nn.SmoothL1Loss()) for _ in range(repeats))
+        row['iter_speedup'] = row['torch_dataloader_iter_s'] / row['tensor_batch_loader_iter_s']
+        if train_epoch:
+            row['train_speedup'] = row['torch_dataloader_train_s'] / row['tensor_batch_loader_train_s']
+        results.append(row)
+        msg = f"bs={bs:5d} | iterate: DataLoader {row['torch_dataloader_iter_s']:.3f}s vs TensorBatchLoader {row['tensor_batch_loader_iter_s']:.3f}s (x{row['iter_speedup']:.1f})"
+        if train_epoch:
+            msg += f" | train epoch: {row['torch_dataloader_train_s']:.3f}s vs {row['tensor_batch_loader_train_s']:.3f}s (x{row['train_speedup']:.2f})"
+        print(msg)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare DataLoader and TensorBatchLoader epoch times')
+    parser.add_argument('--samples', type=int, default=200_000)
+    parser.add_argument('--batch-sizes', type=str, default='32,128,512')
+    parser.add_argument('--repeats', type=int, default=3, help='Report the best of N epochs')
+    parser.add_argument('--no-train', action='store_true', help='Only time iteration, skip the training-epoch comparison')
+    parser.add_argument('--threads', type=int, default=0, help='torch.set_num_threads (0 -> torch default)')
+    parser.add_argument('--json', type=str, default='', help='Write results to this JSON file')
+    args = parser.parse_args()
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    batch_sizes = [int(b) for b in args.batch_sizes.split(',') if b.strip()]
+    results = run(args.samples, batch_sizes, args.repeats, train_epoch=not args.no_train)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'benchmark': 'loader', 'samples': args.samples, 'threads': torch.get_num_threads(), 'results': results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,140 @@
+"""Throughput of variable-length regression batches: padded vs packed vs length-bucketed.
+
+Rows get random history lengths in ``--min-length``..seq_len and are scored
+four ways:
+
+* ``padded``: every row padded to seq_len by repeating its oldest grade (what
+  clients of fixed-length checkpoints do) and run as one dense forward pass;
+  it pays for seq_len steps on every row and changes the predictions.
+* ``packed``: one forward pass over a packed sequence (masked steps on the
+  NumPy backend); exact, but the LSTM still steps to the longest row.
+* ``bucketed``: ``preprocess.length_buckets`` with width 1, i.e. one unpadded
+  forward pass per distinct length.
+* ``bucketed_wN``: buckets of ``--bucket-width`` lengths, each run packed.
+
+Reading the results: padding wastes ``padding_frac`` of the LSTM steps and
+gives wrong predictions for short histories (``padded error``, model units).
+Packing is exact but still steps every row to the batch's longest one, and
+torch's pack/unpack adds overhead of its own. Bucketing skips the padded steps
+but pays one forward call per bucket, which dominates until buckets hold a few
+hundred rows. ml/serve.py therefore runs one packed pass below
+LENGTH_BUCKET_MIN_ROWS and buckets above it. Tune both knobs (and
+LENGTH_BUCKET_WIDTH) from the batch sizes the service actually sees.
+
+Usage:
+    python -m ml.benchmarks.packed --checkpoint lstm_reg.pt --batch-sizes 1,8,32,256,2048
+"""
+import argparse
+import time
+
+import numpy as np
+import torch
+
+from ml.lstm_regression import StudentPerformanceModel, load_regression_model
+from ml.numpy_runtime import NumpyRegressionModel
+from ml.preprocess import length_buckets
+
+
+def _rows(n: int, seq_len: int, min_length: int, rng):
+    lengths = rng.integers(min_length, seq_len + 1, n)
+    grades = rng.uniform(0.4, 1.0, (n, seq_len)).astype(np.float32)
+    packed = np.where(np.arange(seq_len)[None, :] < lengths[:, None], grades, 0.0).astype(np.float32)
+    # Left padding with the oldest real grade, as the frontend's buildTenGrades does
+    padded = np.empty_like(packed)
+    for i, length in enumerate(lengths):
+        padded[i, :seq_len - length] = packed[i, 0]
+        padded[i, seq_len - length:] = packed[i, :length]
+    diff = rng.uniform(0, 1, (n, 1)).astype(np.float32)
+    return padded, packed, lengths, diff
+
+
+def _forwards(backend: str, model):
+    if backend == 'numpy':
+        def forward(past, diff, lengths=None):
+            return model(past, diff, lengths)
+    else:
+        def forward(past, diff, lengths=None):
+            with torch.no_grad():
+                lens = torch.from_numpy(lengths) if lengths is not None else None
+                return model(torch.from_numpy(past), torch.from_numpy(diff) if model.use_difficulty else None, lens).numpy()
+
+    def bucketed(width):
+        def run(padded, packed, lengths, diff):
+            out = np.empty(len(packed), dtype=np.float32)
+            for rows in length_buckets(lengths, width):
+                sub = lengths[rows]
+                longest = int(sub.max())
+                out[rows] = forward(np.ascontiguousarray(packed[rows, :longest]), diff[rows], None if (sub == longest).all() else sub)
+            return out
+        return run
+
+    return {
+        'padded': lambda padded, packed, lengths, diff: forward(padded, diff),
+        'packed': lambda padded, packed, lengths, diff: forward(packed, diff, lengths),
+        'bucketed': bucketed(1),
+    }, bucketed
+
+
+def _time(fn, inputs, duration: float) -> float:
+    fn(*inputs)
+    calls = 0
+    started = time.perf_counter()
+    while True:
+        fn(*inputs)
+        calls += 1
+        elapsed = time.perf_counter() - started
+        if elapsed >= duration:
+            return calls / elapsed
+
+
+def run(model, backend: str, batch_sizes, min_length: int, bucket_width: int, duration: float, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    if backend == 'numpy':
+        state = {k: v.detach().numpy() for k, v in model.state_dict().items()}
+        model = NumpyRegressionModel(state, {'seq_len': model.seq_len, 'use_difficulty': model.use_difficulty, 'quantiles': model.quantiles})
+    modes, bucketed = _forwards(backend, model)
+    if bucket_width > 1:
+        modes[f'bucketed_w{bucket_width}'] = bucketed(bucket_width)
+    results = []
+    for bs in batch_sizes:
+        inputs = _rows(bs, model.seq_len, min_length, rng)
+        lengths = inputs[2]
+        exact = modes['bucketed'](*inputs)
+        row = {'backend': backend, 'batch_size': bs, 'padding_frac': 1.0 - lengths.sum() / (bs * model.seq_len),
+               'buckets': len(length_buckets(lengths, 1))}
+        for name, fn in modes.items():
+            row[f'{name}_rows_per_s'] = _time(fn, inputs, duration) * bs
+            row[f'{name}_max_abs_diff'] = float(np.abs(fn(*inputs) - exact).max())
+        results.append(row)
+        print(f"{backend:>5} bs={bs:5d} pad={row['padding_frac']:.2f} | " +
+              ' | '.join(f"{name} {row[f'{name}_rows_per_s']:10.0f} rows/s" for name in modes) +
+              f" | padded error {row['padded_max_abs_diff']:.4f}")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare padded, packed and length-bucketed variable-length forward passes')
+    parser.add_argument('--checkpoint', type=str, default='', help='Regression checkpoint (random weights if omitted)')
+    parser.add_argument('--backends', type=str, default='torch,numpy')
+    parser.add_argument('--batch-sizes', type=str, default='1,8,32,256,2048')
+    parser.add_argument('--min-length', type=int, default=1)
+    parser.add_argument('--bucket-width', type=int, default=4, help='Also time buckets of this many lengths run packed (1 disables)')
+    parser.add_argument('--duration', type=float, default=1.0, help='Seconds per mode and batch size')
+    parser.add_argument('--threads', type=int, default=0, help='torch.set_num_threads (0 -> torch default)')
+    parser.add_argument('--json', type=str, default='', help='Write results to this JSON file')
+    args = parser.parse_args()
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    torch.manual_seed(0)
+    model = load_regression_model(args.checkpoint)[0] if args.checkpoint else StudentPerformanceModel().eval()
+    batch_sizes = [int(b) for b in args.batch_sizes.split(',') if b.strip()]
+    results = []
+    for backend in [b.strip() for b in args.backends.split(',') if b.strip()]:
+        results += run(model, backend, batch_sizes, args.min_length, args.bucket_width, args.duration)
+    if args.json:
+        from ml.benchmarks.common import write_json
+        write_json(args.json, 'packed', vars(args), results)
+
+
+if __name__ == '__main__':
+    main()
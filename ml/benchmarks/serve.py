@@ -0,0 +1,220 @@
+"""Load test for ml.serve: throughput and latency percentiles per endpoint.
+
+Two targets:
+    --target asgi      drives ``ml.serve.app`` in-process over httpx's ASGI
+                       transport (no sockets; isolates the app itself)
+    --target uvicorn   launches ``uvicorn ml.serve:app`` on a local port and
+                       drives it over HTTP (adds the server and the network stack)
+
+Request bodies are drawn from the synthetic student generator (ml.data), so
+inputs have realistic grade/difficulty distributions and rarely repeat; the
+prediction cache is disabled unless ``--cache`` is given. For every endpoint
+the benchmark sweeps ``--concurrency`` closed-loop clients and, for the batch
+endpoints, ``--batch-sizes`` rows per request (grid points for ``sweep``).
+
+Usage:
+    python -m ml.benchmarks.serve --regression lstm_reg.pt --classifier clf.pt \\
+        --concurrency 1,8,32 --batch-sizes 16,256 --duration 5 --json serve.json
+"""
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import time
+from typing import Callable, Dict, List
+
+ENDPOINTS = {
+    # name: (path, model kind, rows per request come from --batch-sizes)
+    'predict': ('/predict', 'classifier', False),
+    'predict_regression': ('/predict_regression', 'regression', False),
+    'exceedance': ('/predict_regression/exceedance', 'regression', False),
+    'ensemble': ('/predict_regression/ensemble', 'regression', False),
+    'predict_batch': ('/predict/batch', 'classifier', True),
+    'predict_regression_batch': ('/predict_regression/batch', 'regression', True),
+    # batch size = grid points: difficulties 1..10 x (batch size / 10) appended-grade scenarios
+    'sweep': ('/predict_regression/sweep', 'regression', True),
+}
+THRESHOLDS = [50.0, 60.0, 70.0, 80.0, 90.0]
+# Endpoints that need more than a plain checkpoint: name -> (/health model field, why it is skipped)
+REQUIRES = {
+    'exceedance': ('quantiles', 'has no quantile heads'),
+    'ensemble': ('ensemble_size', 'is not an ensemble checkpoint'),
+}
+
+
+def unsupported(name: str, info: Dict) -> str:
+    """Why the model described by ``info`` (one of /health's ``models``) cannot serve endpoint ``name``; '' if it can."""
+    field, reason = REQUIRES.get(name, ('', ''))
+    return reason if field and not info.get(field) else ''
+
+
+def _rows(n: int, seq_len: int, seed: int) -> List[Dict]:
+    from ml.data import generate_student_arrays
+    raw = generate_student_arrays(n_samples=n, seed=seed, seq_len=seq_len)
+    return [{'past_grades': [round(float(g), 2) for g in grades], 'difficulty': int(d)}
+            for grades, d in zip(raw['past_grades'], raw['difficulty'])]
+
+
+def _body_factory(name: str, rows: List[Dict], batch_size: int) -> Callable[[int], Dict]:
+    n = len(rows)
+    if name == 'sweep':
+        scenarios = [[round(100.0 * k / max(1, batch_size // 10), 1)] for k in range(max(1, batch_size // 10))]
+        return lambda i: {'past_grades': rows[i % n]['past_grades'], 'scenarios': scenarios}
+    if ENDPOINTS[name][2]:
+        return lambda i: {'rows': [rows[(i * batch_size + j) % n] for j in range(batch_size)]}
+    if name in ('exceedance', 'ensemble'):
+        return lambda i: dict(rows[i % n], thresholds=THRESHOLDS)
+    return lambda i: rows[i % n]
+
+
+async def _drive(client, path: str, params: Dict, make_body, concurrency: int, duration: float, warmup: int) -> Dict:
+    from ml.benchmarks.common import percentiles
+
+    for i in range(warmup):
+        await client.post(path, json=make_body(i), params=params)
+    latencies: List[float] = []
+    errors: Dict[str, int] = {}
+    counter = [warmup]
+    deadline = time.perf_counter() + duration
+
+    async def worker():
+        while time.perf_counter() < deadline:
+            counter[0] += 1
+            body = make_body(counter[0])
+            t0 = time.perf_counter()
+            try:
+                resp = await client.post(path, json=body, params=params)
+                status = str(resp.status_code)
+            except Exception as e:  # connection errors under overload
+                status = type(e).__name__
+            if status == '200':
+                latencies.append(time.perf_counter() - t0)
+            else:
+                errors[status] = errors.get(status, 0) + 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    elapsed = time.perf_counter() - started
+    row = {'requests': len(latencies), 'errors': errors, 'elapsed_s': elapsed, 'requests_per_s': len(latencies) / elapsed}
+    row.update(percentiles(latencies))
+    return row
+
+
+async def _sweep(client, args, models: Dict[str, str], infos: Dict[str, Dict]) -> List[Dict]:
+    results = []
+    endpoints = [e.strip() for e in args.endpoints.split(',') if e.strip()]
+    concurrency = [int(c) for c in args.concurrency.split(',') if c.strip()]
+    batch_sizes = [int(b) for b in args.batch_sizes.split(',') if b.strip()]
+    for name in endpoints:
+        path, kind, is_batch = ENDPOINTS[name]
+        if kind not in models:
+            print(f'skipping {name}: no {kind} checkpoint given')
+            continue
+        reason = unsupported(name, infos[kind])
+        if reason:
+            print(f'skipping {name}: {models[kind]} {reason}')
+            continue
+        rows = _rows(args.rows, infos[kind]['seq_len'], args.seed)
+        for bs in (batch_sizes if is_batch else [1]):
+            make_body = _body_factory(name, rows, bs)
+            for c in concurrency:
+                row = await _drive(client, path, {'model': kind}, make_body, c, args.duration, args.warmup)
+                row.update(endpoint=name, path=path, concurrency=c, batch_size=bs, rows_per_s=row['requests_per_s'] * bs, target=args.target)
+                results.append(row)
+                errs = sum(row['errors'].values())
+                print(f"{name:>25} c={c:<4} bs={bs:<5} | {row['requests_per_s']:8.1f} req/s | {row['rows_per_s']:9.0f} rows/s | "
+                      f"p50 {row['p50_ms']:7.2f} | p95 {row['p95_ms']:7.2f} | p99 {row['p99_ms']:7.2f} ms | errors {errs}")
+    return results
+
+
+def _server_env(args, models: Dict[str, str]) -> Dict[str, str]:
+    env = dict(os.environ)
+    env['MODEL_REGISTRY'] = ','.join(f'{kind}={path}' for kind, path in models.items())
+    env.pop('MODEL_CKPT', None)
+    env['DEFAULT_MODEL'] = 'regression' if 'regression' in models else 'classifier'
+    if not args.cache:
+        env['PRED_CACHE_MAX_ENTRIES'] = '0'
+    return env
+
+
+def _model_infos(client_health: Dict) -> Dict[str, Dict]:
+    return {m['name']: m for m in client_health['models']}
+
+
+async def _run_asgi(args, models: Dict[str, str]) -> List[Dict]:
+    import httpx
+    # ml.serve reads its configuration at import time
+    os.environ.update(_server_env(args, models))
+    os.environ.pop('MODEL_CKPT', None)
+    from ml import serve
+
+    await serve.startup_event()
+    try:
+        transport = httpx.ASGITransport(app=serve.app)
+        async with httpx.AsyncClient(transport=transport, base_url='http://bench', timeout=60.0) as client:
+            health = (await client.get('/health')).json()
+            return await _sweep(client, args, models, _model_infos(health))
+    finally:
+        await serve.shutdown_event()
+
+
+async def _run_uvicorn(args, models: Dict[str, str]) -> List[Dict]:
+    import httpx
+    cmd = [sys.executable, '-m', 'uvicorn', 'ml.serve:app', '--host', '127.0.0.1', '--port', str(args.port),
+           '--log-level', 'warning', '--no-access-log']
+    proc = subprocess.Popen(cmd, env=_server_env(args, models))
+    base = f'http://127.0.0.1:{args.port}'
+    try:
+        limits = httpx.Limits(max_connections=max(int(c) for c in args.concurrency.split(',')) + 4)
+        async with httpx.AsyncClient(base_url=base, timeout=60.0, limits=limits) as client:
+            deadline = time.perf_counter() + args.startup_timeout
+            while True:
+                if proc.poll() is not None:
+                    raise RuntimeError(f'uvicorn exited with code {proc.returncode}')
+                try:
+                    resp = await client.get('/health')
+                    if resp.status_code == 200:
+                        break
+                except httpx.TransportError:
+                    pass
+                if time.perf_counter() > deadline:
+                    raise RuntimeError('uvicorn did not become ready in time')
+                await asyncio.sleep(0.1)
+            return await _sweep(client, args, models, _model_infos(resp.json()))
+    finally:
+        proc.terminate()
+        proc.wait(timeout=10)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load-test ml.serve in-process or behind uvicorn')
+    parser.add_argument('--regression', type=str, default='lstm_reg.pt', help='Regression model file ("" to skip)')
+    parser.add_argument('--classifier', type=str, default='', help='Classifier model file ("" to skip)')
+    parser.add_argument('--target', choices=['asgi', 'uvicorn'], default='asgi')
+    parser.add_argument('--endpoints', type=str, default=','.join(ENDPOINTS),
+                        help='Endpoints to load-test; those the loaded models do not support are skipped')
+    parser.add_argument('--concurrency', type=str, default='1,8,32')
+    parser.add_argument('--batch-sizes', type=str, default='16,256', help='Rows per request for the batch endpoints')
+    parser.add_argument('--duration', type=float, default=5.0, help='Seconds per configuration')
+    parser.add_argument('--warmup', type=int, default=10, help='Untimed requests before each configuration')
+    parser.add_argument('--rows', type=int, default=20000, help='Distinct synthetic students to draw requests from')
+    parser.add_argument('--seed', type=int, default=7)
+    parser.add_argument('--cache', action='store_true', help='Keep the prediction cache enabled')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--startup-timeout', type=float, default=60.0)
+    parser.add_argument('--json', type=str, default='')
+    args = parser.parse_args()
+
+    models = {kind: path for kind, path in (('regression', args.regression), ('classifier', args.classifier)) if path}
+    if not models:
+        parser.error('give at least one of --regression / --classifier')
+    runner = _run_asgi if args.target == 'asgi' else _run_uvicorn
+    results = asyncio.run(runner(args, models))
+    if args.json:
+        from ml.benchmarks.common import write_json
+        write_json(args.json, 'serve', vars(args), results)
+
+
+if __name__ == '__main__':
+    main()
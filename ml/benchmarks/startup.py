@@ -0,0 +1,89 @@
+"""Cold-start latency of the serving process, per checkpoint format.
+
+Each run is a fresh interpreter (so nothing is cached in-process) that imports
+ml.serve, runs the same startup path as uvicorn (load, warm-up, ready) and
+answers one request. Reported per run:
+
+    import_s      importing ml.serve (fastapi, numpy, torch unless absent, ...)
+    models_s      reading checkpoints, building models, warm-up forwards
+    ready_s       interpreter start to "ready" (what a readiness probe waits for)
+    first_req_ms  first request after ready, through the ASGI app
+
+The first run also pays for a cold OS page cache; use ``--runs`` > 1 and read
+the median for autoscaling budgets.
+
+Usage:
+    python -m ml.benchmarks.startup --checkpoints lstm_reg.pt,lstm_reg.ts,lstm_reg.npz --runs 5
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+
+def _child():
+    started = time.perf_counter()
+    import asyncio
+    import httpx
+    from ml import serve
+
+    serve._load_on_start()
+    ready = time.perf_counter()
+    entry = serve._REGISTRY.get()
+    seq_len = entry.meta.get('seq_len', 10) or 10
+    path = '/predict_regression' if entry.is_regression else '/predict'
+
+    async def first_request():
+        transport = httpx.ASGITransport(app=serve.app)
+        async with httpx.AsyncClient(transport=transport, base_url='http://bench') as client:
+            t0 = time.perf_counter()
+            resp = await client.post(path, json={'past_grades': [75.0] * seq_len, 'difficulty': 5})
+            resp.raise_for_status()
+            return time.perf_counter() - t0
+
+    first = asyncio.run(first_request())
+    row = dict(serve._STARTUP)
+    row.update(process_ready_s=ready - started, first_req_ms=first * 1000.0, backend=entry.backend,
+               warmup_s=entry.timings.get('warmup_s', 0.0), torch_imported='torch' in sys.modules)
+    print(json.dumps(row))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure serving cold-start time per checkpoint')
+    parser.add_argument('--checkpoints', type=str, default='lstm_reg.pt', help='Comma-separated model files (.pt, .ts, .npz)')
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--json', type=str, default='')
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        _child()
+        return
+
+    results = []
+    for ckpt in [c.strip() for c in args.checkpoints.split(',') if c.strip()]:
+        env = dict(os.environ, MODEL_CKPT=ckpt)
+        env.pop('MODEL_REGISTRY', None)
+        runs = []
+        for _ in range(args.runs):
+            t0 = time.perf_counter()
+            out = subprocess.run([sys.executable, '-m', 'ml.benchmarks.startup', '--child'], env=env,
+                                 capture_output=True, text=True, check=True).stdout.strip().splitlines()[-1]
+            row = json.loads(out)
+            row['wall_s'] = time.perf_counter() - t0
+            runs.append(row)
+        summary = {'checkpoint': ckpt, 'backend': runs[0]['backend'], 'torch_imported': runs[0]['torch_imported'], 'runs': runs}
+        for key in ('import_s', 'models_s', 'ready_s', 'warmup_s', 'first_req_ms', 'wall_s'):
+            summary[f'median_{key}'] = statistics.median(r[key] for r in runs)
+        results.append(summary)
+        print(f"{os.path.basename(ckpt):>16} [{summary['backend']:>5}] | import {summary['median_import_s']:6.3f}s | models {summary['median_models_s']:6.3f}s "
+              f"(warm-up {summary['median_warmup_s']:6.3f}s) | ready {summary['median_ready_s']:6.3f}s | first req {summary['median_first_req_ms']:7.2f} ms | process {summary['median_wall_s']:6.3f}s")
+    if args.json:
+        from ml.benchmarks.common import write_json
+        write_json(args.json, 'startup', vars(args), results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+"""Throughput / latency of the serving forward pass across thread configurations.
+
+Each configuration (executor workers x intra-op threads) runs in a fresh
+subprocess, because torch's inter-op pool can only be sized once per process.
+Inside it, ``--clients`` closed-loop clients submit forward passes of
+``--batch-size`` rows to a ``BoundedExecutor`` exactly like ml/serve.py does.
+
+Reading the results: with one executor worker, raising intra-op threads lowers
+the latency of each forward pass but only helps throughput for large batches;
+for batch sizes around 1-32 the LSTM is too small to parallelise well and
+several single-threaded workers usually give more requests per second at a
+higher p99. Pick the row that meets the p99 target with the best throughput,
+then set INFER_EXECUTOR_WORKERS / TORCH_INTRA_OP_THREADS (and the pod CPU
+request to workers x threads).
+
+Usage:
+    python -m ml.benchmarks.threads --checkpoint lstm_reg.pt --batch-size 32 --configs 1x1,1x2,2x1,4x1
+"""
+import argparse
+import json
+import subprocess
+import sys
+import threading
+import time
+
+
+def _child(args):
+    import numpy as np
+    import torch
+    from ml.benchmarks.common import percentiles
+    from ml.lstm_regression import StudentPerformanceModel, load_regression_model
+    from ml.runtime import BoundedExecutor, configure_torch_threads
+
+    workers, intra = (int(v) for v in args.child.split('x'))
+    configure_torch_threads(intra, 1)
+    model = load_regression_model(args.checkpoint)[0] if args.checkpoint else StudentPerformanceModel().eval()
+    rng = np.random.default_rng(0)
+    past = torch.from_numpy(rng.uniform(0.4, 1.0, (args.batch_size, model.seq_len)).astype(np.float32))
+    diff = torch.from_numpy(rng.uniform(0, 1, (args.batch_size, 1)).astype(np.float32))
+
+    def forward():
+        with torch.no_grad():
+            return model(past, diff if model.use_difficulty else None)
+
+    executor = BoundedExecutor(workers, max_pending=args.clients * 2)
+    for _ in range(20):
+        executor.submit(forward).result()
+    latencies = []
+    lock = threading.Lock()
+    deadline = time.perf_counter() + args.duration
+
+    def client():
+        local = []
+        while time.perf_counter() < deadline:
+            t0 = time.perf_counter()
+            executor.submit(forward).result()
+            local.append(time.perf_counter() - t0)
+        with lock:
+            latencies.extend(local)
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=client) for _ in range(args.clients)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - started
+    executor.shutdown()
+    row = {'executor_workers': workers, 'intra_op_threads': intra, 'batch_size': args.batch_size, 'clients': args.clients,
+           'forwards_per_s': len(latencies) / elapsed, 'rows_per_s': len(latencies) * args.batch_size / elapsed}
+    row.update(percentiles(latencies))
+    print(json.dumps(row))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Sweep executor workers x torch intra-op threads')
+    parser.add_argument('--checkpoint', type=str, default='', help='Regression checkpoint (random weights if omitted)')
+    parser.add_argument('--configs', type=str, default='1x1,1x2,1x4,2x1,2x2,4x1', help='Comma-separated WORKERSxTHREADS pairs')
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--clients', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=5.0, help='Seconds per configuration')
+    parser.add_argument('--json', type=str, default='')
+    parser.add_argument('--child', type=str, default='', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        _child(args)
+        return
+
+    results = []
+    for cfg in [c.strip() for c in args.configs.split(',') if c.strip()]:
+        cmd = [sys.executable, '-m', 'ml.benchmarks.threads', '--child', cfg, '--batch-size', str(args.batch_size),
+               '--clients', str(args.clients), '--duration', str(args.duration)]
+        if args.checkpoint:
+            cmd += ['--checkpoint', args.checkpoint]
+        out = subprocess.run(cmd, capture_output=True, text=True, check=True).stdout.strip().splitlines()[-1]
+        row = json.loads(out)
+        results.append(row)
+        print(f"{cfg:>6} | {row['forwards_per_s']:9.1f} fwd/s | {row['rows_per_s']:10.0f} rows/s | p50 {row['p50_ms']:7.2f} ms | p99 {row['p99_ms']:7.2f} ms")
+    if args.json:
+        from ml.benchmarks.common import write_json
+        write_json(args.json, 'threads', vars(args), results)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,166 @@
+"""Memory per worker and total throughput: one process vs several workers.
+
+Three server setups, each started on a local port and load-tested over HTTP:
+    single     ``uvicorn ml.serve:app`` (the current one-process setup)
+    uvicorn    ``uvicorn --workers N ml.serve:app``; every worker loads its own models
+    prefork    ``python -m ml.prefork --workers N``; the parent loads once and forks
+
+For every process of the server tree the benchmark records RSS and PSS from
+``/proc/<pid>/smaps_rollup`` after the load test. PSS divides shared pages
+between the processes that map them, so the PSS sum is the server's real
+footprint, while RSS counts copy-on-write weights again in every worker.
+Memory columns are empty where ``/proc`` is not available.
+
+Usage:
+    python -m ml.benchmarks.workers --regression lstm_reg.pt --workers 4 \\
+        --endpoint predict_regression --concurrency 32 --duration 10 --json workers.json
+"""
+import argparse
+import asyncio
+import subprocess
+import sys
+import time
+from typing import Dict, List
+
+from ml.benchmarks.serve import ENDPOINTS, _body_factory, _drive, _rows, _server_env, unsupported
+
+MODES = ('single', 'uvicorn', 'prefork')
+
+
+def _command(mode: str, workers: int, port: int) -> List[str]:
+    if mode == 'prefork':
+        return [sys.executable, '-m', 'ml.prefork', '--host', '127.0.0.1', '--port', str(port),
+                '--workers', str(workers), '--log-level', 'warning']
+    cmd = [sys.executable, '-m', 'uvicorn', 'ml.serve:app', '--host', '127.0.0.1', '--port', str(port),
+           '--log-level', 'warning', '--no-access-log']
+    if mode == 'uvicorn':
+        cmd += ['--workers', str(workers)]
+    return cmd
+
+
+def _children(pid: int) -> List[int]:
+    try:
+        with open(f'/proc/{pid}/task/{pid}/children') as f:
+            return [int(p) for p in f.read().split()]
+    except OSError:
+        return []
+
+
+def _tree(pid: int) -> List[int]:
+    pids = [pid]
+    for child in _children(pid):
+        pids.extend(_tree(child))
+    return pids
+
+
+def _memory_mb(pid: int) -> Dict[str, float]:
+    out = {}
+    try:
+        with open(f'/proc/{pid}/smaps_rollup') as f:
+            for line in f:
+                key, _, rest = line.partition(':')
+                if key in ('Rss', 'Pss'):
+                    out[key.lower() + '_mb'] = int(rest.split()[0]) / 1024.0
+    except OSError:
+        pass
+    return out
+
+
+async def _wait_ready(client, proc, timeout: float) -> Dict:
+    import httpx
+    deadline = time.perf_counter() + timeout
+    while True:
+        if proc.poll() is not None:
+            raise RuntimeError(f'server exited with code {proc.returncode}')
+        try:
+            resp = await client.get('/health')
+            if resp.status_code == 200:
+                return resp.json()
+        except httpx.TransportError:
+            pass
+        if time.perf_counter() > deadline:
+            raise RuntimeError('server did not become ready in time')
+        await asyncio.sleep(0.1)
+
+
+async def _run_mode(args, mode: str, models: Dict[str, str]) -> Dict:
+    import httpx
+    workers = 1 if mode == 'single' else args.workers
+    env = _server_env(args, models)
+    if mode == 'uvicorn':
+        # Same per-worker thread limit prefork picks, so only the loading strategy differs
+        from ml.prefork import worker_threads
+        env.setdefault('TORCH_INTRA_OP_THREADS', str(worker_threads(workers)['intra_op_threads']))
+    started = time.perf_counter()
+    proc = subprocess.Popen(_command(mode, workers, args.port), env=env)
+    try:
+        limits = httpx.Limits(max_connections=args.concurrency + 4)
+        async with httpx.AsyncClient(base_url=f'http://127.0.0.1:{args.port}', timeout=60.0, limits=limits) as client:
+            health = await _wait_ready(client, proc, args.startup_timeout)
+            # /health answers as soon as one worker is up; give the rest the same time again
+            ready_s = time.perf_counter() - started
+            if workers > 1:
+                await asyncio.sleep(min(ready_s, args.startup_timeout))
+            info = {m['name']: m for m in health['models']}['regression']
+            reason = unsupported(args.endpoint, info)
+            if reason:
+                raise SystemExit(f'{args.endpoint}: {args.regression} {reason}')
+            seq_len = info['seq_len']
+            make_body = _body_factory(args.endpoint, _rows(args.rows, seq_len, args.seed), args.batch_size)
+            row = await _drive(client, ENDPOINTS[args.endpoint][0], {'model': 'regression'}, make_body,
+                               args.concurrency, args.duration, args.warmup)
+        processes = [dict(pid=pid, **_memory_mb(pid)) for pid in _tree(proc.pid)]
+    finally:
+        proc.terminate()
+        proc.wait(timeout=30)
+    row.update(mode=mode, workers=workers, ready_s=ready_s, processes=processes,
+               rss_total_mb=sum(p.get('rss_mb', 0.0) for p in processes),
+               pss_total_mb=sum(p.get('pss_mb', 0.0) for p in processes))
+    served = [p for p in processes if p['pid'] != proc.pid] if mode != 'single' else processes
+    row['rss_per_worker_mb'] = sum(p.get('rss_mb', 0.0) for p in served) / max(1, len(served))
+    row['pss_per_worker_mb'] = sum(p.get('pss_mb', 0.0) for p in served) / max(1, len(served))
+    return row
+
+
+async def _run(args, models: Dict[str, str]) -> List[Dict]:
+    results = []
+    for mode in [m.strip() for m in args.modes.split(',') if m.strip()]:
+        row = await _run_mode(args, mode, models)
+        results.append(row)
+        errs = sum(row['errors'].values())
+        print(f"{mode:>8} x{row['workers']:<3} | ready {row['ready_s']:6.2f}s | {row['requests_per_s']:8.1f} req/s | "
+              f"p50 {row['p50_ms']:7.2f} | p99 {row['p99_ms']:7.2f} ms | RSS/worker {row['rss_per_worker_mb']:7.1f} MB | "
+              f"PSS total {row['pss_total_mb']:7.1f} MB | RSS total {row['rss_total_mb']:7.1f} MB | errors {errs}")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare memory and throughput of single-process, uvicorn --workers and prefork serving')
+    parser.add_argument('--regression', type=str, default='lstm_reg.pt')
+    parser.add_argument('--modes', type=str, default=','.join(MODES))
+    parser.add_argument('--workers', type=int, default=0, help='Workers for the multi-process modes (default: one per CPU)')
+    parser.add_argument('--endpoint', choices=[name for name, (_, kind, _) in ENDPOINTS.items() if kind == 'regression'],
+                        default='predict_regression')
+    parser.add_argument('--batch-size', type=int, default=16, help='Rows per request for the batch endpoints')
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--duration', type=float, default=10.0)
+    parser.add_argument('--warmup', type=int, default=20)
+    parser.add_argument('--rows', type=int, default=20000)
+    parser.add_argument('--seed', type=int, default=7)
+    parser.add_argument('--cache', action='store_true', help='Keep the prediction cache enabled')
+    parser.add_argument('--port', type=int, default=8766)
+    parser.add_argument('--startup-timeout', type=float, default=120.0)
+    parser.add_argument('--json', type=str, default='')
+    args = parser.parse_args()
+
+    if not args.workers:
+        from ml.prefork import worker_threads
+        args.workers = worker_threads(0)['workers']
+    results = asyncio.run(_run(args, {'regression': args.regression}))
+    if args.json:
+        from ml.benchmarks.common import write_json
+        write_json(args.json, 'workers', vars(args), results)
+
+
+if __name__ == '__main__':
+    main()
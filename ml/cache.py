@@ -0,0 +1,135 @@
+"""In-process LRU + TTL cache for model outputs.
+
+Keys are built from the normalised model inputs (the float32 arrays produced by
+ml.preprocess) plus the fingerprint of the checkpoint that computed them, so
+identical inputs hit the cache regardless of how the raw request was written,
+several models can share one cache, and a new checkpoint never serves stale
+results.
+"""
+import hashlib
+import struct
+import sys
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+import numpy as np
+
+_ENTRY_OVERHEAD = 160  # rough per-entry bookkeeping cost in bytes (tuple, dict slot)
+
+
+def file_fingerprint(path: str) -> str:
+    """Short sha256 of a checkpoint file's contents."""
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+    return h.hexdigest()[:16]
+
+
+def _value_size(value: Any) -> int:
+    if isinstance(value, (list, tuple)):
+        return sys.getsizeof(value) + sum(_value_size(v) for v in value)
+    if isinstance(value, np.ndarray):
+        return value.nbytes + 112
+    return sys.getsizeof(value)
+
+
+class PredictionCache:
+    """Bounded by entry count and approximate bytes; entries expire after ``ttl_s``."""
+
+    def __init__(self, max_entries: int = 50000, ttl_s: float = 300.0, max_bytes: int = 64 * 1024 * 1024):
+        self.max_entries = int(max_entries)
+        self.ttl_s = float(ttl_s)
+        self.max_bytes = int(max_bytes)
+        self._data: 'OrderedDict[bytes, tuple]' = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0 and self.max_bytes > 0
+
+    def invalidate(self, fingerprint: str):
+        """Drop every entry computed by checkpoint ``fingerprint`` (after it is unloaded)."""
+        fp = fingerprint.encode()
+        with self._lock:
+            # Keys are kind|fingerprint|arrays; kinds and fingerprints never contain '|'
+            stale = [k for k in self._data if k.split(b'|', 2)[1] == fp]
+            for k in stale:
+                self._bytes -= self._data.pop(k)[2]
+            if stale:
+                self.invalidations += 1
+
+    def key(self, kind: str, fingerprint: str, *arrays: np.ndarray) -> bytes:
+        parts = [kind.encode(), b'|', fingerprint.encode(), b'|']
+        for a in arrays:
+            a = np.ascontiguousarray(a, dtype=np.float32)
+            # Each array's shape goes before its bytes, so arrays of varying lengths cannot run into each other
+            parts.append(struct.pack(f'<B{a.ndim}I', a.ndim, *a.shape))
+            parts.append(a.tobytes())
+        return b''.join(parts)
+
+    def get(self, key: bytes) -> Optional[Any]:
+        if not self.enabled:
+            return None
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires, value, size = entry
+            if expires < time.monotonic():
+                del self._data[key]
+                self._bytes -= size
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key: bytes, value: Any):
+        if not self.enabled:
+            return
+        size = len(key) + _value_size(value) + _ENTRY_OVERHEAD
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self._bytes -= old[2]
+            self._data[key] = (time.monotonic() + self.ttl_s, value, size)
+            self._bytes += size
+            while len(self._data) > self.max_entries or self._bytes > self.max_bytes:
+                _, (_, _, evicted) = self._data.popitem(last=False)
+                self._bytes -= evicted
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            'enabled': self.enabled,
+            'entries': len(self._data),
+            'bytes': self._bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': (self.hits / lookups) if lookups else 0.0,
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+            'invalidations': self.invalidations,
+            'max_entries': self.max_entries,
+            'max_bytes': self.max_bytes,
+            'ttl_s': self.ttl_s,
+        }
@@ -0,0 +1,28 @@
+"""Reading training checkpoints once, as cheaply as torch allows.
+
+Checkpoints written by the trainers hold only tensors and plain Python values,
+so ``weights_only=True`` (no arbitrary unpickling) works, and ``mmap=True`` maps
+the tensor storage instead of copying it through a read buffer. Older
+checkpoints in the legacy (non-zip) format cannot be memory-mapped and are read
+without ``mmap``, still with ``weights_only=True``.
+
+A checkpoint holding objects outside torch's allowlist fails to load. Set
+``ALLOW_UNSAFE_CHECKPOINTS=1`` to fall back to full unpickling for files you
+trust; it runs arbitrary code from the file.
+"""
+import os
+import pickle
+import zipfile
+from typing import Dict
+
+import torch
+
+
+def read_checkpoint(path: str, map_location='cpu') -> Dict:
+    try:
+        return torch.load(path, map_location=map_location, weights_only=True, mmap=zipfile.is_zipfile(path))
+    except pickle.UnpicklingError:
+        # Non-allowlisted objects in the pickle
+        if os.environ.get('ALLOW_UNSAFE_CHECKPOINTS', '').strip() != '1':
+            raise
+        return torch.load(path, map_location=map_location, weights_only=False)
@@ -0,0 +1,128 @@
+"""K-fold cross-validation with the folds trained in parallel processes.
+
+A single ``train_test_split`` makes checkpoint comparisons noisy; k folds give
+every row one turn in validation and a spread to judge differences by. The
+data is generated once and shared with the workers (``ml.shared_data``), and
+the folds run at the same time, one per process, each limited to
+``cpus // workers`` torch threads so they do not oversubscribe the cores.
+With ``workers == k`` the whole evaluation takes about as long as one fold.
+
+The trainers drive this through ``--kfold K``; each provides a
+``train_fold(data, train_idx, val_idx, opts)`` that trains on one split and
+returns the validation metrics of its best epoch.
+"""
+import importlib
+import math
+import os
+import statistics
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import multiprocessing as mp
+import numpy as np
+
+try:
+    from .runtime import cpu_quota  # type: ignore
+    from .shared_data import SharedArrays, attach  # type: ignore
+except ImportError:  # pragma: no cover
+    current_dir = os.path.dirname(os.path.abspath(__file__))
+    parent_dir = os.path.dirname(current_dir)
+    if parent_dir not in sys.path:
+        sys.path.append(parent_dir)
+    from ml.runtime import cpu_quota  # type: ignore
+    from ml.shared_data import SharedArrays, attach  # type: ignore
+
+# Worker process state (set by _init_worker)
+_DATA: Dict = {}
+_HANDLES: List = []
+_TRAINER = None
+
+
+def fold_indices(n: int, k: int, seed: int = 42, stratify: Optional[np.ndarray] = None) -> List[Tuple[np.ndarray, np.ndarray]]:
+    """(train_idx, val_idx) per fold; stratified on ``stratify`` labels when given."""
+    from sklearn.model_selection import KFold, StratifiedKFold
+    if stratify is not None:
+        splitter = StratifiedKFold(n_splits=k, shuffle=True, random_state=seed)
+        return list(splitter.split(np.zeros(n), stratify))
+    return list(KFold(n_splits=k, shuffle=True, random_state=seed).split(np.arange(n)))
+
+
+def confidence_interval(values: Sequence[float], level: float = 0.95) -> Tuple[float, float]:
+    """(mean, half-width) of a Student-t interval for the mean of the fold scores."""
+    mean = statistics.fmean(values)
+    if len(values) < 2:
+        return mean, float('nan')
+    sem = statistics.stdev(values) / math.sqrt(len(values))
+    try:
+        from scipy.stats import t
+        crit = float(t.ppf((1 + level) / 2, len(values) - 1))
+    except ImportError:
+        # Normal approximation; narrower than the t interval for small k
+        crit = statistics.NormalDist().inv_cdf((1 + level) / 2)
+    return mean, crit * sem
+
+
+def _init_worker(spec, trainer: str, threads: int):
+    global _DATA, _HANDLES, _TRAINER
+    import torch
+    torch.set_num_threads(threads)
+    try:
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        pass
+    _DATA, _HANDLES = attach(spec)
+    _TRAINER = importlib.import_module(f'.{trainer}', __package__ or 'ml')
+
+
+def _run_fold(fold: int, train_idx: np.ndarray, val_idx: np.ndarray, opts: Dict) -> Dict:
+    import torch
+    torch.manual_seed(opts.get('seed', 42) + fold)
+    started = time.perf_counter()
+    metrics = _TRAINER.train_fold(_DATA, train_idx, val_idx, opts)
+    return dict(metrics, fold=fold, train_s=time.perf_counter() - started)
+
+
+def run_kfold(trainer: str, arrays: Dict[str, np.ndarray], opts: Dict, k: int, workers: int = 0,
+              seed: int = 42, stratify: Optional[np.ndarray] = None, level: float = 0.95) -> Dict:
+    """Train ``k`` folds of ``ml.<trainer>.train_fold`` in parallel and aggregate their metrics."""
+    if k < 2:
+        raise ValueError('k-fold cross-validation needs k >= 2')
+    n = len(next(iter(arrays.values())))
+    folds = fold_indices(n, k, seed=seed, stratify=stratify)
+    cpus = max(1, math.floor(cpu_quota()))
+    workers = max(1, min(workers or cpus, k))
+    threads = max(1, cpus // workers)
+    started = time.perf_counter()
+    with SharedArrays(arrays) as shared:
+        with ProcessPoolExecutor(max_workers=workers, mp_context=mp.get_context('spawn'),
+                                 initializer=_init_worker, initargs=(shared.spec, trainer, threads)) as pool:
+            futures = [pool.submit(_run_fold, i, tr, va, opts) for i, (tr, va) in enumerate(folds)]
+            results = [f.result() for f in futures]
+    elapsed = time.perf_counter() - started
+    names = [m for m in results[0] if m not in ('fold', 'train_s', 'best_epoch')]
+    summary = {}
+    for m in names:
+        values = [r[m] for r in results]
+        mean, half = confidence_interval(values, level)
+        summary[m] = {'mean': mean, 'std': statistics.stdev(values), 'ci_low': mean - half, 'ci_high': mean + half}
+    return {'k': k, 'workers': workers, 'threads_per_worker': threads, 'level': level, 'elapsed_s': elapsed,
+            'fold_train_s': [r['train_s'] for r in results], 'folds': results, 'summary': summary}
+
+
+def report(result: Dict, scale: Optional[Dict[str, float]] = None):
+    """Print per-fold metrics and mean ± CI; ``scale`` multiplies metrics for display (e.g. 100 for %)."""
+    scale = scale or {}
+    names = list(result['summary'])
+    print(f"{'fold':>4} " + ' '.join(f'{m:>12}' for m in names) + f" {'train_s':>8}")
+    for r in result['folds']:
+        print(f"{r['fold']:>4} " + ' '.join(f'{r[m] * scale.get(m, 1.0):>12.4f}' for m in names) + f" {r['train_s']:>8.1f}")
+    pct = int(round(result['level'] * 100))
+    for m in names:
+        s = result['summary'][m]
+        f = scale.get(m, 1.0)
+        print(f"{m}: {s['mean'] * f:.4f} ± {(s['ci_high'] - s['mean']) * f:.4f} ({pct}% CI {s['ci_low'] * f:.4f} .. {s['ci_high'] * f:.4f}, std {s['std'] * f:.4f})")
+    longest = max(result['fold_train_s'])
+    print(f"{result['k']} folds on {result['workers']} worker(s) x {result['threads_per_worker']} thread(s): "
+          f"{result['elapsed_s']:.1f}s wall, slowest fold {longest:.1f}s, sum of folds {sum(result['fold_train_s']):.1f}s")
@@ -1,62 +1,71 @@
 import numpy as np
-import pandas as pd
+
+# Archetypes in sampling order and their probabilities
+ARCHETYPES = ("strong", "improving", "declining", "struggler", "resilient")
+ARCHETYPE_WEIGHTS = (0.15, 0.20, 0.15, 0.35, 0.15)
+
+# Past grades: linear trend from start to end plus gaussian noise (per archetype)
+_PAST_START = np.array([85, 60, 90, 75, 55], dtype=np.float32)
+_PAST_END = np.array([85, 85, 70, 75, 80], dtype=np.float32)
+_PAST_STD = np.array([5, 5, 5, 10, 7], dtype=np.float32)
+# Current grade: avg_past + offset - slope * difficulty + gaussian noise (per archetype)
+# (resilient's avg_past + (10 - difficulty) * 0.5 is written as offset 5, slope 0.5)
+_CUR_OFFSET = np.array([0, 5, -5, 0, 5], dtype=np.float32)
+_CUR_SLOPE = np.array([1.5, 2.0, 2.5, 4.0, 0.5], dtype=np.float32)
+_CUR_STD = np.array([5, 5, 6, 8, 6], dtype=np.float32)
+
+# Rows generated per step; fixed so output for a seed does not depend on n_samples chunking
+_GEN_CHUNK = 1 << 20
+
+
+def generate_student_arrays(n_samples=10000, seed=42, seq_len=10):
+    """Vectorised synthetic generator returning dense arrays.
+
+    ``seed`` may be an int, a ``np.random.SeedSequence`` or a ``np.random.Generator``.
+    Returns a dict with ``past_grades`` (N, seq_len) float32, ``difficulty`` (N,) int8
+    in 1..10, ``current_grade`` (N,) float32 and ``archetype`` (N,) int8 indices into
+    ``ARCHETYPES``.
+    """
+    rng = np.random.default_rng(seed)
+    n = int(n_samples)
+    past = np.empty((n, seq_len), dtype=np.float32)
+    difficulty = np.empty(n, dtype=np.int8)
+    current = np.empty(n, dtype=np.float32)
+    archetype = np.empty(n, dtype=np.int8)
+    trend = np.linspace(_PAST_START, _PAST_END, seq_len, axis=1, dtype=np.float32)  # (5, seq_len)
+    for lo in range(0, n, _GEN_CHUNK):
+        hi = min(n, lo + _GEN_CHUNK)
+        m = hi - lo
+        arch = rng.choice(len(ARCHETYPES), size=m, p=ARCHETYPE_WEIGHTS)
+        grades = rng.standard_normal((m, seq_len), dtype=np.float32)
+        grades *= _PAST_STD[arch, None]
+        grades += trend[arch]
+        np.clip(grades, 0, 100, out=grades)
+        diff = rng.integers(1, 11, size=m)
+        cur = grades.mean(axis=1) + _CUR_OFFSET[arch] - _CUR_SLOPE[arch] * diff
+        cur += rng.standard_normal(m, dtype=np.float32) * _CUR_STD[arch]
+        past[lo:hi] = grades
+        difficulty[lo:hi] = diff
+        current[lo:hi] = np.clip(cur, 0, 100)
+        archetype[lo:hi] = arch
+    return {
+        "past_grades": past,
+        "difficulty": difficulty,
+        "current_grade": current,
+        "archetype": archetype,
+    }
+
 
 def generate_student_data(n_samples=10000, seed=42):
-    np.random.seed(seed)
-    data = []
-    
-    # Define archetypes
-    archetypes = ["strong", "improving", "declining", "struggler", "resilient"]
-    weights = [0.15, 0.20, 0.15, 0.35, 0.15]
-
-    for _ in range(n_samples):
-        # Pick an archetype
-        archetype = np.random.choice(archetypes, p=weights)
-        
-        # Generate past grades based on archetype
-        if archetype == "strong":
-            past_grades = np.random.normal(85, 5, 10)  # stable high
-        elif archetype == "improving":
-            base = np.linspace(60, 85, 10)  # upward trend
-            past_grades = base + np.random.normal(0, 5, 10)
-        elif archetype == "declining":
-            base = np.linspace(90, 70, 10)  # downward trend
-            past_grades = base + np.random.normal(0, 5, 10)
-        elif archetype == "struggler":
-            past_grades = np.random.normal(75, 10, 10)  # mid but noisy
-        elif archetype == "resilient":
-            base = np.linspace(55, 80, 10)  # improving despite low start
-            past_grades = base + np.random.normal(0, 7, 10)
-
-        past_grades = np.clip(past_grades, 0, 100)
-        avg_past = np.mean(past_grades)
-        
-        # Generate difficulty (1 easy → 10 hard)
-        difficulty = np.random.randint(1, 11)
-        
-        # Compute current grade depending on archetype
-        if archetype == "strong":
-            current = avg_past - (difficulty * 1.5) + np.random.normal(0, 5)
-        elif archetype == "improving":
-            current = avg_past + 5 - (difficulty * 2) + np.random.normal(0, 5)
-        elif archetype == "declining":
-            current = avg_past - 5 - (difficulty * 2.5) + np.random.normal(0, 6)
-        elif archetype == "struggler":
-            current = avg_past - (difficulty * 4) + np.random.normal(0, 8)
-        elif archetype == "resilient":
-            current = avg_past + (10 - difficulty) * 0.5 + np.random.normal(0, 6)
-        
-        current = np.clip(current, 0, 100)
-        
-        # Store in dataset
-        data.append({
-            "past_grades": past_grades.tolist(),
-            "difficulty": difficulty,
-            "current_grade": current,
-            "archetype": archetype
-        })
-    
-    return pd.DataFrame(data)
+    """DataFrame view of ``generate_student_arrays`` (one row per student)."""
+    arrays = generate_student_arrays(n_samples=n_samples, seed=seed)
+    import pandas as pd  # DataFrame helpers only; the array paths work without pandas (inference image)
+    return pd.DataFrame({
+        "past_grades": list(arrays["past_grades"]),
+        "difficulty": arrays["difficulty"].astype(np.int64),
+        "current_grade": arrays["current_grade"],
+        "archetype": np.asarray(ARCHETYPES, dtype=object)[arrays["archetype"]],
+    })
 
 def fetch_raw(limit: int = 0, seed: int = 42):
     """Fetch raw synthetic student records (optionally limited)."""
@@ -64,7 +73,63 @@ def fetch_raw(limit: int = 0, seed: int = 42):
     return generate_student_data(n_samples=n, seed=seed)
 
 
-def build_features(df: pd.DataFrame,
+def fetch_raw_arrays(limit: int = 0, seed: int = 42):
+    """Like ``fetch_raw`` but returns the dense arrays of ``generate_student_arrays``."""
+    n = limit if limit and limit > 0 else 1000
+    return generate_student_arrays(n_samples=n, seed=seed)
+
+
+def feature_columns(seq_len: int = 10, add_difficulty: bool = True):
+    """Column names of the feature matrix (stored as checkpoint metadata)."""
+    return [f'g{i}' for i in range(seq_len)] + (['difficulty'] if add_difficulty else [])
+
+
+def bucket_bins(ten_class: bool = False, bucket_5: bool = False):
+    if bucket_5:
+        return [0, 60, 70, 80, 90, 101]
+    bins = list(range(0, 101, 10))
+    if bins[-1] != 100:
+        bins.append(101)
+    return bins
+
+
+def bucketize(values: np.ndarray, bins) -> np.ndarray:
+    """Array equivalent of ``pd.cut(values, bins, labels=False, include_lowest=True)`` for in-range values."""
+    edges = np.asarray(bins, dtype=np.float64)
+    labels = np.searchsorted(edges, np.asarray(values, dtype=np.float64), side='left') - 1
+    return np.clip(labels, 0, len(edges) - 2).astype(np.int64)
+
+
+def build_feature_arrays(grades: np.ndarray,
+                         difficulty: np.ndarray | None = None,
+                         target: np.ndarray | None = None,
+                         scale_grades: bool = False,
+                         add_difficulty: bool = True,
+                         ten_class: bool = False,
+                         bucket_5: bool = False):
+    """Columnar feature builder on dense arrays.
+
+    Returns a contiguous float32 (N, seq_len [+1]) matrix and the target (bucket
+    labels as int64 when ``ten_class``/``bucket_5`` is set, float32 grades otherwise,
+    None when no target is given).
+    """
+    X = np.array(grades, dtype=np.float32, copy=True, order='C')
+    if scale_grades:
+        X /= 100.0
+    if add_difficulty:
+        if difficulty is None:
+            raise ValueError('difficulty is required when add_difficulty=True')
+        diff = (np.asarray(difficulty, dtype=np.float32) - 1) / 9.0
+        X = np.concatenate([X, diff[:, None]], axis=1)
+    y = None
+    if target is not None:
+        y = np.asarray(target, dtype=np.float32)
+        if bucket_5 or ten_class:
+            y = bucketize(y, bucket_bins(ten_class=ten_class, bucket_5=bucket_5))
+    return X, y
+
+
+def build_features(df,
                    extended: bool = False,
                    scale_grades: bool = False,
                    super_minimal: bool = False,
@@ -73,33 +138,33 @@ def build_features(df: pd.DataFrame,
                    difficulty_group: str | None = None,
                    dfw_threshold_percent: float = 50.0,
                    ten_class: bool = False,
-                   bucket_5: bool = False):
-    """Transform raw dataframe into feature matrix X and target y.
+                   bucket_5: bool = False,
+                   return_type: str = 'pandas'):
+    """Transform raw records into feature matrix X and target y.
 
+    ``df`` is a DataFrame from ``fetch_raw`` or the array dict from ``fetch_raw_arrays``.
+    ``return_type`` selects 'pandas' (DataFrame/Series with g0..g9[, difficulty] columns),
+    'numpy' or 'torch'; use ``feature_columns`` for the column names of array outputs.
     Parameters mirror those expected by model.py (some are placeholders for future real dataset integration).
     """
-    # Past grades -> columns g0..g9
-    grade_cols = [f'g{i}' for i in range(10)]
-    grades_expanded = df.past_grades.apply(lambda lst: pd.Series(lst, index=grade_cols))
-    feat_df = grades_expanded
-    if add_difficulty:
-        feat_df = pd.concat([feat_df, df['difficulty']], axis=1)
-        feat_df['difficulty'] = (feat_df['difficulty'].astype(float) - 1) / 9.0
-
-    if scale_grades:
-        feat_df[grade_cols] = feat_df[grade_cols] / 100.0
-
-    y = df['current_grade']
-    if bucket_5 or ten_class:
-        if bucket_5:
-            bins = [0,60,70,80,90,101]
-        else:
-            bins = list(range(0, 101, 10))
-            if bins[-1] != 100:
-                bins.append(101)
-        y = pd.cut(y, bins=bins, labels=False, include_lowest=True)
-
-    return feat_df, y
+    if isinstance(df, dict):
+        grades, difficulty, target = df['past_grades'], df['difficulty'], df['current_grade']
+    else:
+        grades = np.stack(df['past_grades'].values)
+        difficulty = df['difficulty'].values
+        target = df['current_grade'].values
+    X, y = build_feature_arrays(grades, difficulty, target, scale_grades=scale_grades, add_difficulty=add_difficulty, ten_class=ten_class, bucket_5=bucket_5)
+    if return_type == 'numpy':
+        return X, y
+    if return_type == 'torch':
+        import torch
+        return torch.from_numpy(X), torch.from_numpy(y)
+    if return_type != 'pandas':
+        raise ValueError(f"unknown return_type {return_type!r}")
+    import pandas as pd
+    index = None if isinstance(df, dict) else df.index
+    feat_df = pd.DataFrame(X, columns=feature_columns(X.shape[1] - (1 if add_difficulty else 0), add_difficulty), index=index)
+    return feat_df, pd.Series(y, index=index, name='current_grade')
 
 # If run standalone, show a quick sample
 if __name__ == '__main__':
@@ -0,0 +1,115 @@
+"""Deep ensembles of the LSTM regressor, evaluated as one stacked model.
+
+``lstm_regression.py --ensemble K`` trains K copies of
+``StudentPerformanceModel`` from different seeds and saves all of their
+state dicts in one checkpoint (``ensemble_states``). ``StackedRegressionEnsemble``
+stacks the members' parameters along a leading K axis and runs the LSTM
+recurrence and the fc head with batched matmuls (``torch.baddbmm``), so all
+members are evaluated in one pass over the sequence instead of K separate
+forward calls. The members' spread is the ensemble's uncertainty estimate.
+"""
+from typing import Dict, List, Optional
+
+import torch
+import torch.nn as nn
+
+_FC_LAYERS = ('fc.0', 'fc.2', 'fc.4')
+
+
+def is_ensemble_checkpoint(ckpt: Dict) -> bool:
+    return bool(ckpt.get('ensemble_states'))
+
+
+class StackedRegressionEnsemble(nn.Module):
+    """K ``StudentPerformanceModel`` members with stacked weights.
+
+    ``forward`` has the same signature as the single model and returns the
+    members' mean; ``forward_members`` returns every member's (K, B)
+    predictions. ``lengths`` marks left-aligned histories shorter than
+    ``past``; finished rows keep their last state, as in a packed sequence.
+    """
+
+    def __init__(self, states: List[Dict[str, torch.Tensor]], seq_len: int = 10, use_difficulty: bool = True):
+        super().__init__()
+        if not states:
+            raise ValueError("an ensemble needs at least one member")
+        self.size = len(states)
+        self.seq_len = seq_len
+        self.use_difficulty = use_difficulty
+        self.quantiles: List[float] = []
+
+        def stack(key: str) -> torch.Tensor:
+            return torch.stack([s[key].detach().float() for s in states])
+
+        w_hh = stack('lstm.weight_hh_l0')                                                # (K, 4H, H)
+        h = self.hidden_size = w_hh.shape[2]
+        # PyTorch gate order is (i, f, g, o); reorder to (i, f, o, g) so one sigmoid
+        # covers a contiguous 3H block and one tanh the last H
+        order = torch.cat([torch.arange(0, 2 * h), torch.arange(3 * h, 4 * h), torch.arange(2 * h, 3 * h)])
+        self.register_buffer('w_ih', stack('lstm.weight_ih_l0')[:, order, 0])            # (K, 4H)
+        self.register_buffer('w_hh_t', w_hh[:, order].transpose(1, 2).contiguous())      # (K, H, 4H)
+        self.register_buffer('bias', (stack('lstm.bias_ih_l0') + stack('lstm.bias_hh_l0'))[:, order])  # (K, 4H)
+        for i, name in enumerate(_FC_LAYERS):
+            self.register_buffer(f'fc{i}_w', stack(f'{name}.weight').transpose(1, 2).contiguous())  # (K, in, out)
+            self.register_buffer(f'fc{i}_b', stack(f'{name}.bias')[:, None, :])                     # (K, 1, out)
+
+    def forward_members(self, past: torch.Tensor, difficulty: Optional[torch.Tensor] = None, lengths: Optional[torch.Tensor] = None) -> torch.Tensor:
+        k, (b, t), h_size = self.size, past.shape, self.hidden_size
+        h = past.new_zeros(k, b, h_size)
+        c = past.new_zeros(k, b, h_size)
+        if lengths is not None:
+            lengths = lengths.to(past.device).view(1, b, 1)
+        # Input projections of every step in one broadcast: (T, K, B, 4H)
+        x_proj = torch.addcmul(self.bias[None, :, None, :], past.t()[:, None, :, None], self.w_ih[None, :, None, :])
+        for step in range(t):
+            gates = torch.baddbmm(x_proj[step], h, self.w_hh_t)                        # (K, B, 4H)
+            sig = torch.sigmoid(gates[..., :3 * h_size])
+            g = torch.tanh(gates[..., 3 * h_size:])
+            c_new = torch.addcmul(sig[..., h_size:2 * h_size] * c, sig[..., :h_size], g)
+            h_new = sig[..., 2 * h_size:] * torch.tanh(c_new)
+            if lengths is not None:
+                live = step < lengths
+                c = torch.where(live, c_new, c)
+                h = torch.where(live, h_new, h)
+            else:
+                h, c = h_new, c_new
+        x = h
+        if self.use_difficulty:
+            if difficulty is None:
+                raise ValueError("difficulty tensor required but missing")
+            x = torch.cat([h, difficulty.reshape(1, b, 1).expand(k, b, 1).to(h.dtype)], dim=2)
+        x = torch.relu(torch.baddbmm(self.fc0_b, x, self.fc0_w))
+        x = torch.relu(torch.baddbmm(self.fc1_b, x, self.fc1_w))
+        return torch.baddbmm(self.fc2_b, x, self.fc2_w)[..., 0]                         # (K, B)
+
+    def forward(self, past: torch.Tensor, difficulty: Optional[torch.Tensor] = None, lengths: Optional[torch.Tensor] = None) -> torch.Tensor:
+        return self.forward_members(past, difficulty, lengths).mean(dim=0)
+
+
+def ensemble_from_checkpoint(ckpt: Dict):
+    """Build the eval-mode stacked ensemble from an already-read checkpoint dict."""
+    model = StackedRegressionEnsemble(ckpt['ensemble_states'], seq_len=ckpt['seq_len'], use_difficulty=ckpt['use_difficulty'])
+    model.eval()
+    return model, ckpt
+
+
+def ensemble_metrics(model: StackedRegressionEnsemble, loader, scale_grades: bool) -> Dict[str, float]:
+    """Validation MAE of the ensemble mean plus spread statistics, in grade points.
+
+    ``coverage_2std`` is the share of targets within two member standard
+    deviations of the mean; near 0.95 means the spread is well calibrated.
+    """
+    factor = 100.0 if scale_grades else 1.0
+    abs_err, member_err, stds, covered, n = 0.0, 0.0, 0.0, 0.0, 0
+    with torch.no_grad():
+        for past, diff, y in loader:
+            preds = model.forward_members(past, diff if model.use_difficulty else None) * factor  # (K, B)
+            y = y * factor
+            mean, std = preds.mean(dim=0), preds.std(dim=0, unbiased=False)
+            abs_err += (mean - y).abs().sum().item()
+            member_err += (preds - y).abs().mean(dim=0).sum().item()
+            stds += std.sum().item()
+            covered += ((mean - y).abs() <= 2 * std).float().sum().item()
+            n += len(y)
+    n = max(1, n)
+    return {'mae': abs_err / n, 'mean_member_mae': member_err / n, 'mean_std': stds / n, 'coverage_2std': covered / n}
@@ -0,0 +1,154 @@
+"""Export a training checkpoint to a frozen TorchScript serving artifact.
+
+The artifact holds the traced, frozen model plus the checkpoint metadata (seq_len,
+scaling flags, quantile levels, ...) as ``meta.json`` in the archive's extra
+files, so ml/serve.py can load it with ``torch.jit.load`` alone: no model
+classes, no training modules, no sklearn.
+
+Usage:
+    python -m ml.export lstm_reg.pt -o lstm_reg.ts
+"""
+import argparse
+import json
+import os
+import sys
+import zipfile
+from typing import Dict, Optional, Tuple
+
+import torch
+import torch.nn as nn
+
+ARTIFACT_FORMAT = 'torchscript'
+META_FILE = 'meta.json'
+
+
+class RegressionForward(nn.Module):
+    """Uniform (past, difficulty) signature for regression models.
+
+    ``difficulty`` is always passed (zeros when unused) so the traced graph has a
+    fixed signature; quantile checkpoints also expose ``forward_with_quantiles``.
+    ``lengths`` (packed variable-length histories) exists only in eager mode;
+    traced artifacts take full-width histories of any length.
+    """
+
+    def __init__(self, model: nn.Module):
+        super().__init__()
+        self.model = model
+        self.use_difficulty = bool(model.use_difficulty)
+
+    def forward(self, past: torch.Tensor, difficulty: torch.Tensor, lengths: Optional[torch.Tensor] = None) -> torch.Tensor:
+        return self.model(past, difficulty if self.use_difficulty else None, lengths)
+
+    def forward_with_quantiles(self, past: torch.Tensor, difficulty: torch.Tensor, lengths: Optional[torch.Tensor] = None) -> Tuple[torch.Tensor, torch.Tensor]:
+        return self.model.forward_with_quantiles(past, difficulty if self.use_difficulty else None, lengths)
+
+    def encode(self, past: torch.Tensor, state: Optional[Tuple[torch.Tensor, torch.Tensor]] = None, lengths: Optional[torch.Tensor] = None) -> Tuple[torch.Tensor, torch.Tensor]:
+        return self.model.encode(past, state, lengths)
+
+    def head(self, h: torch.Tensor, difficulty: torch.Tensor) -> torch.Tensor:
+        return self.model.head(h, difficulty if self.use_difficulty else None)
+
+
+def is_torchscript_artifact(path: str) -> bool:
+    """True for archives written by ``export`` (they carry extra/meta.json)."""
+    if not zipfile.is_zipfile(path):
+        return False
+    with zipfile.ZipFile(path) as zf:
+        return any(name.endswith('/extra/' + META_FILE) for name in zf.namelist())
+
+
+def load_artifact(path: str, map_location='cpu') -> Tuple[torch.jit.ScriptModule, Dict]:
+    extra = {META_FILE: ''}
+    module = torch.jit.load(path, map_location=map_location, _extra_files=extra)
+    module.eval()
+    return module, json.loads(extra[META_FILE])
+
+
+def _example_inputs(meta: Dict, is_regression: bool, batch: int = 4):
+    seq_len = meta.get('seq_len', 10) or 10
+    gen = torch.Generator().manual_seed(0)
+    if is_regression:
+        return (torch.rand(batch, seq_len, generator=gen), torch.rand(batch, 1, generator=gen))
+    return (torch.rand(batch, meta['input_dim'], generator=gen),)
+
+
+def export(ckpt_path: str, out_path: str, optimize: bool = True, quantize: str = '', max_mae_drift: float = 0.5, max_acc_drop: float = 0.01) -> Dict:
+    """Trace, freeze and save ``ckpt_path``; returns the embedded metadata.
+
+    ``quantize='int8'`` applies dynamic INT8 quantization first and refuses to
+    export if it fails the accuracy gate in ml/quantize.py.
+    """
+    try:
+        from .lstm_regression import regression_model_from_checkpoint  # type: ignore
+        from .Model import model_from_checkpoint  # type: ignore
+        from .checkpoint import read_checkpoint  # type: ignore
+        from .cache import file_fingerprint  # type: ignore
+        from .quantize import quantize_verified  # type: ignore
+    except ImportError:  # pragma: no cover
+        sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        from ml.lstm_regression import regression_model_from_checkpoint  # type: ignore
+        from ml.Model import model_from_checkpoint  # type: ignore
+        from ml.checkpoint import read_checkpoint  # type: ignore
+        from ml.cache import file_fingerprint  # type: ignore
+        from ml.quantize import quantize_verified  # type: ignore
+
+    raw = read_checkpoint(ckpt_path)
+    if raw.get('ensemble_states'):
+        # Tracing would unroll the stacked recurrence to a fixed length
+        raise ValueError("ensemble checkpoints are served eagerly; export a single member instead")
+    is_regression = raw.get('model_type') == 'lstm_regression'
+    if is_regression:
+        model, ckpt = regression_model_from_checkpoint(raw)
+        module = RegressionForward(model).eval()
+    else:
+        model, ckpt = model_from_checkpoint(raw)
+        module = model.eval()
+    meta = {k: v for k, v in ckpt.items() if k != 'model_state'}
+    meta.setdefault('model_type', 'lstm_regression' if is_regression else 'classification')
+    meta['artifact_format'] = ARTIFACT_FORMAT
+    meta['source_checkpoint'] = os.path.basename(ckpt_path)
+    meta['source_fingerprint'] = file_fingerprint(ckpt_path)
+    if quantize:
+        if quantize != 'int8':
+            raise ValueError(f"unsupported quantization {quantize!r}")
+        module, report = quantize_verified(module, meta, is_regression, max_mae_drift=max_mae_drift, max_acc_drop=max_acc_drop)
+        meta['quantization'] = dict(report, dtype='qint8')
+        # Quantized kernels are already fused; the float-graph passes do not apply
+        optimize = False
+
+    example = _example_inputs(meta, is_regression)
+    methods = {'forward': example}
+    if is_regression and meta.get('quantiles'):
+        methods['forward_with_quantiles'] = example
+    with torch.no_grad():
+        traced = torch.jit.trace_module(module, methods)
+        preserved = [m for m in methods if m != 'forward']
+        frozen = torch.jit.freeze(traced, preserved_attrs=preserved)
+        if optimize:
+            frozen = torch.jit.optimize_for_inference(frozen, other_methods=preserved)
+        # The traced graph must not have baked in the example batch size
+        check = _example_inputs(meta, is_regression, batch=7)
+        if not torch.allclose(frozen(*check), module(*check), atol=1e-5):
+            raise RuntimeError('exported module does not match the eager model')
+    torch.jit.save(frozen, out_path, _extra_files={META_FILE: json.dumps(meta)})
+    return meta
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Export a .pt checkpoint to a TorchScript serving artifact')
+    parser.add_argument('checkpoint', type=str)
+    parser.add_argument('-o', '--output', type=str, default='', help='Output path (default: <checkpoint>.ts)')
+    parser.add_argument('--no-optimize', action='store_true', help='Skip torch.jit.optimize_for_inference')
+    parser.add_argument('--quantize', type=str, default='', choices=['', 'int8'], help='Apply dynamic INT8 quantization (gated on accuracy drift)')
+    parser.add_argument('--max-mae-drift', type=float, default=0.5, help='Max allowed MAE increase in grade points for --quantize')
+    parser.add_argument('--max-acc-drop', type=float, default=0.01, help='Max allowed accuracy drop for --quantize (classifier)')
+    args = parser.parse_args()
+    out = args.output or os.path.splitext(args.checkpoint)[0] + '.ts'
+    meta = export(args.checkpoint, out, optimize=not args.no_optimize, quantize=args.quantize, max_mae_drift=args.max_mae_drift, max_acc_drop=args.max_acc_drop)
+    print(f"Exported {meta['model_type']} model to {out}")
+    if 'quantization' in meta:
+        print('Quantization check: ' + ', '.join(f'{k}={v:.4f}' if isinstance(v, float) else f'{k}={v}' for k, v in meta['quantization'].items()))
+
+
+if __name__ == '__main__':
+    main()
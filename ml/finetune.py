@@ -0,0 +1,355 @@
+"""Incremental fine-tuning of the regression checkpoint from newly resolved grades.
+
+When a course resolves, the student's real grade becomes a labelled example
+(past grades, difficulty, grade). Instead of regenerating data and retraining,
+this takes a batch of such records and fine-tunes the current checkpoint for
+a few optimizer steps:
+
+* every step mixes the new records with samples from a replay buffer (a
+  reservoir sample of earlier records, seeded with synthetic students on the
+  first run), so the model does not forget the distribution it was trained on;
+* the result is checked against a synthetic holdout (the quantization gate's
+  seed, never used for training) and a held-out slice of the new records. It
+  is rejected (exit status 1, nothing published) if the holdout MAE grows by
+  more than ``--max-holdout-increase`` over the checkpoint being fine-tuned or
+  over the original (pre-fine-tuning) baseline, whose holdout MAE every version
+  carries in ``finetune.base_holdout_mae``, or if the held-out new records get
+  worse. Gating on the baseline keeps a chain of runs from drifting step by step;
+* an accepted model is written as a new version next to the others
+  (``<versions-dir>/<name>.ft0003.pt``) and then atomically replaces the
+  served checkpoint, which a server running with ``MODEL_WATCH_INTERVAL_S``
+  picks up on its own (or via ``POST /admin/models/{name}/reload``).
+
+Records are JSON lines shaped like a ``/predict_regression`` request plus the
+observed grade::
+
+    {"past_grades": [78, 82, ...], "difficulty": 6, "grade": 74.5}
+
+For checkpoints trained with ``--variable-length`` a record may hold 1..seq_len
+past grades; records and replay samples carry their history lengths.
+
+Usage:
+    python -m ml.finetune --checkpoint lstm_reg.pt --records resolved.jsonl \\
+        --replay-buffer replay.npz --steps 50
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import time
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import torch
+import torch.nn as nn
+import torch.optim as optim
+
+try:
+    from . import data as data_mod  # type: ignore
+    from .cache import file_fingerprint  # type: ignore
+    from .checkpoint import read_checkpoint  # type: ignore
+    from .lstm_regression import RegressionGradesDataset, pinball_loss, regression_model_from_checkpoint  # type: ignore
+    from .quantize import HOLDOUT_SEED  # type: ignore
+except ImportError:  # pragma: no cover
+    current_dir = os.path.dirname(os.path.abspath(__file__))
+    parent_dir = os.path.dirname(current_dir)
+    if parent_dir not in sys.path:
+        sys.path.append(parent_dir)
+    import ml.data as data_mod  # type: ignore
+    from ml.cache import file_fingerprint  # type: ignore
+    from ml.checkpoint import read_checkpoint  # type: ignore
+    from ml.lstm_regression import RegressionGradesDataset, pinball_loss, regression_model_from_checkpoint  # type: ignore
+    from ml.quantize import HOLDOUT_SEED  # type: ignore
+
+# Training-state keys a served checkpoint may carry that no longer apply after fine-tuning
+_STALE_KEYS = ('optimizer_state', 'epoch', 'early_stopping', 'history')
+
+
+def _empty(seq_len: int) -> Dict[str, np.ndarray]:
+    return {'past_grades': np.zeros((0, seq_len), dtype=np.float32), 'difficulty': np.zeros(0, dtype=np.float32),
+            'current_grade': np.zeros(0, dtype=np.float32), 'history_length': np.zeros(0, dtype=np.int64)}
+
+
+def _full_length(arrays: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+    """Add ``history_length`` (every grade real) to arrays from the synthetic generator."""
+    out = {k: arrays[k].astype(np.float32) for k in ('past_grades', 'difficulty', 'current_grade')}
+    n, seq_len = out['past_grades'].shape
+    out['history_length'] = np.full(n, seq_len, dtype=np.int64)
+    return out
+
+
+def _truncate(arrays: Dict[str, np.ndarray], min_len: int, rng: np.random.Generator) -> Dict[str, np.ndarray]:
+    """Keep the most recent L grades of each row (L uniform in [min_len, seq_len]), left-aligned and zero-padded."""
+    past = arrays['past_grades']
+    n, seq_len = past.shape
+    lengths = rng.integers(max(1, min_len), seq_len + 1, size=n)
+    idx = np.arange(seq_len)[None, :] + (seq_len - lengths)[:, None]
+    out = np.take_along_axis(past, np.minimum(idx, seq_len - 1), axis=1) * (idx < seq_len)
+    return dict(arrays, past_grades=out.astype(np.float32), history_length=lengths.astype(np.int64))
+
+
+def _take(arrays: Dict[str, np.ndarray], idx) -> Dict[str, np.ndarray]:
+    return {k: v[idx] for k, v in arrays.items()}
+
+
+def _concat(*parts: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+    return {k: np.concatenate([p[k] for p in parts]) for k in parts[0]}
+
+
+class ReplayBuffer:
+    """Reservoir sample (uniform over everything ever added) of at most ``capacity`` records."""
+
+    def __init__(self, capacity: int, seq_len: int, seed: int = 0):
+        self.capacity = capacity
+        self.arrays = _empty(seq_len)
+        self.seen = 0
+        self.rng = np.random.default_rng(seed)
+
+    def __len__(self):
+        return len(self.arrays['current_grade'])
+
+    def add(self, records: Dict[str, np.ndarray]):
+        n = len(records['current_grade'])
+        room = max(0, self.capacity - len(self))
+        if room:
+            self.arrays = _concat(self.arrays, _take(records, slice(0, min(room, n))))
+        for i in range(min(room, n), n):
+            # Algorithm R: record number seen+i+1 replaces a random slot with probability capacity / (seen+i+1)
+            j = int(self.rng.integers(0, self.seen + i + 1))
+            if j < self.capacity:
+                for k, v in self.arrays.items():
+                    v[j] = records[k][i]
+        self.seen += n
+
+    def sample(self, n: int, rng: np.random.Generator) -> Dict[str, np.ndarray]:
+        if not len(self) or n <= 0:
+            return _empty(self.arrays['past_grades'].shape[1])
+        return _take(self.arrays, rng.integers(0, len(self), size=n))
+
+    def save(self, path: str):
+        tmp = path + '.tmp.npz'
+        np.savez(tmp, seen=np.int64(self.seen), **self.arrays)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: str, capacity: int, seq_len: int, seed: int = 0) -> 'ReplayBuffer':
+        buf = cls(capacity, seq_len, seed)
+        if os.path.exists(path):
+            with np.load(path) as f:
+                buf.arrays = {k: np.array(f[k]) for k in ('past_grades', 'difficulty', 'current_grade')}
+                n = len(buf.arrays['current_grade'])
+                # Buffers written before history lengths were stored hold full histories
+                buf.arrays['history_length'] = (np.array(f['history_length']) if 'history_length' in f.files
+                                                else np.full(n, buf.arrays['past_grades'].shape[1], dtype=np.int64))
+                buf.seen = int(f['seen'])
+            if buf.arrays['past_grades'].shape[1] != seq_len:
+                raise ValueError(f'replay buffer {path} holds seq_len {buf.arrays["past_grades"].shape[1]}, model expects {seq_len}')
+            if len(buf) > capacity:
+                buf.arrays = _take(buf.arrays, slice(0, capacity))
+        return buf
+
+
+def read_records(path: str, seq_len: int, variable_length: bool = False) -> Tuple[Dict[str, np.ndarray], List[str]]:
+    """Parse JSON-lines records; returns (arrays, problems with the skipped lines).
+
+    With ``variable_length`` histories of 1..seq_len grades are kept,
+    left-aligned and zero-padded to seq_len.
+    """
+    past, diff, grade, lengths, problems = [], [], [], [], []
+    with open(path) as f:
+        for lineno, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                rec = json.loads(line)
+                grades = [float(g) for g in rec['past_grades']]
+                d, g = float(rec['difficulty']), float(rec['grade'])
+            except (ValueError, KeyError, TypeError) as e:
+                problems.append(f'line {lineno}: {e!r}')
+                continue
+            if variable_length and not 1 <= len(grades) <= seq_len:
+                problems.append(f'line {lineno}: past_grades length {len(grades)} must be between 1 and seq_len {seq_len}')
+            elif not variable_length and len(grades) != seq_len:
+                problems.append(f'line {lineno}: past_grades length {len(grades)} does not match seq_len {seq_len}')
+            elif not (1 <= d <= 10 and 0 <= g <= 100 and all(0 <= x <= 100 for x in grades)):
+                problems.append(f'line {lineno}: values out of range')
+            else:
+                past.append(grades + [0.0] * (seq_len - len(grades)))
+                lengths.append(len(grades))
+                diff.append(d)
+                grade.append(g)
+    if not grade:
+        return _empty(seq_len), problems
+    return {'past_grades': np.asarray(past, dtype=np.float32), 'difficulty': np.asarray(diff, dtype=np.float32),
+            'current_grade': np.asarray(grade, dtype=np.float32), 'history_length': np.asarray(lengths, dtype=np.int64)}, problems
+
+
+def _tensors(ckpt: Dict, arrays: Dict[str, np.ndarray]):
+    ds = RegressionGradesDataset(arrays, seq_len=ckpt['seq_len'], scale_grades=ckpt['scale_grades'], use_difficulty=ckpt['use_difficulty'])
+    diff = ds.difficulty if ds.difficulty is not None else torch.zeros(len(ds.targets))
+    return ds.past, diff, torch.from_numpy(arrays['history_length']), ds.targets
+
+
+def evaluate(model: nn.Module, ckpt: Dict, arrays: Dict[str, np.ndarray]) -> Optional[float]:
+    """MAE in grade points, or None for an empty set."""
+    if not len(arrays['current_grade']):
+        return None
+    past, diff, lengths, _ = _tensors(ckpt, arrays)
+    model.eval()
+    with torch.no_grad():
+        pred = model(past, diff, lengths).numpy() * (100.0 if ckpt['scale_grades'] else 1.0)
+    return float(np.abs(np.clip(pred, 0, 100) - arrays['current_grade']).mean())
+
+
+def finetune(model: nn.Module, ckpt: Dict, new: Dict[str, np.ndarray], replay: ReplayBuffer, steps: int, lr: float,
+             batch_size: int, replay_ratio: float, seed: int = 0) -> List[float]:
+    """A few Adam steps on batches of new records mixed with ``replay_ratio`` replay samples per new one."""
+    rng = np.random.default_rng(seed)
+    torch.manual_seed(seed)
+    criterion = nn.SmoothL1Loss()
+    optimiz = optim.Adam(model.parameters(), lr=lr)
+    use_quantiles = bool(getattr(model, 'quantiles', None))
+    levels = torch.tensor(model.quantiles, dtype=torch.float32) if use_quantiles else None
+    quantile_weight = (ckpt.get('args') or {}).get('quantile_weight', 1.0)
+    n_new = len(new['current_grade'])
+    per_new = max(1, int(round(batch_size / (1.0 + replay_ratio))))
+    losses = []
+    model.train()
+    for _ in range(steps):
+        k = min(n_new, per_new)
+        batch = _concat(_take(new, rng.choice(n_new, size=k, replace=False)), replay.sample(batch_size - k, rng))
+        past, diff, lengths, y = _tensors(ckpt, batch)
+        optimiz.zero_grad()
+        if use_quantiles:
+            pred, quants = model.forward_with_quantiles(past, diff, lengths)
+            loss = criterion(pred, y) + quantile_weight * pinball_loss(quants, y, levels)
+        else:
+            loss = criterion(model(past, diff, lengths), y)
+        loss.backward()
+        nn.utils.clip_grad_norm_(model.parameters(), 5.0)
+        optimiz.step()
+        losses.append(loss.item())
+    model.eval()
+    return losses
+
+
+def publish(ckpt: Dict, target: str, versions_dir: str, version: int) -> str:
+    """Write version ``version`` into ``versions_dir``, then atomically replace ``target`` with it."""
+    os.makedirs(versions_dir, exist_ok=True)
+    stem = os.path.splitext(os.path.basename(target))[0]
+    versioned = os.path.join(versions_dir, f'{stem}.ft{version:04d}.pt')
+    torch.save(ckpt, versioned)
+    # Copy next to the target first so the final rename stays on one filesystem
+    tmp = os.path.join(os.path.dirname(os.path.abspath(target)), f'.{os.path.basename(target)}.tmp')
+    shutil.copyfile(versioned, tmp)
+    os.replace(tmp, target)
+    return versioned
+
+
+def _fmt(value: Optional[float]) -> str:
+    return 'n/a' if value is None else f'{value:.3f}'
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Fine-tune the regression checkpoint on newly resolved grades')
+    parser.add_argument('--checkpoint', type=str, default='lstm_reg.pt', help='Current (served) regression checkpoint')
+    parser.add_argument('--records', type=str, required=True, help='JSON lines: {"past_grades": [...], "difficulty": d, "grade": g}')
+    parser.add_argument('--replay-buffer', type=str, default='replay.npz', help='Replay buffer file (created on first run)')
+    parser.add_argument('--replay-capacity', type=int, default=50000)
+    parser.add_argument('--replay-synthetic', type=int, default=20000, help='Synthetic students to seed an empty replay buffer with')
+    parser.add_argument('--replay-ratio', type=float, default=3.0, help='Replay samples per new record in each batch')
+    parser.add_argument('--steps', type=int, default=50)
+    parser.add_argument('--lr', type=float, default=1e-4)
+    parser.add_argument('--batch-size', type=int, default=128)
+    parser.add_argument('--holdout-fraction', type=float, default=0.2, help='Share of new records held out for validation')
+    parser.add_argument('--holdout-samples', type=int, default=5000, help='Synthetic holdout size')
+    parser.add_argument('--max-holdout-increase', type=float, default=0.25, help='Reject if synthetic-holdout MAE grows by more than this over the parent or the pre-fine-tuning baseline (grade points)')
+    parser.add_argument('--publish', type=str, default='', help='Checkpoint path to replace (default: --checkpoint)')
+    parser.add_argument('--versions-dir', type=str, default='', help='Where versioned checkpoints go (default: <checkpoint dir>/versions)')
+    parser.add_argument('--dry-run', action='store_true', help='Fine-tune and validate but do not publish')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    ckpt = read_checkpoint(args.checkpoint)
+    if ckpt.get('model_type') != 'lstm_regression':
+        raise SystemExit('fine-tuning supports the LSTM regression checkpoint only')
+    if ckpt.get('ensemble_states'):
+        # Only model_state would change while ml.serve keeps serving the old ensemble members
+        raise SystemExit('fine-tuning does not support ensemble checkpoints; retrain with lstm_regression.py --ensemble')
+    model, _ = regression_model_from_checkpoint(ckpt)
+    seq_len = ckpt['seq_len']
+    variable_length = bool(ckpt.get('variable_length'))
+    records, problems = read_records(args.records, seq_len, variable_length=variable_length)
+    for p in problems:
+        print(f'Skipping {p}')
+    n = len(records['current_grade'])
+    if not n:
+        raise SystemExit('no usable records')
+
+    rng = np.random.default_rng(args.seed)
+    order = rng.permutation(n)
+    n_hold = int(n * args.holdout_fraction) if n >= 5 else 0
+    new_hold, new_train = _take(records, order[:n_hold]), _take(records, order[n_hold:])
+    replay = ReplayBuffer.load(args.replay_buffer, args.replay_capacity, seq_len, seed=args.seed)
+    if not len(replay) and args.replay_synthetic > 0:
+        synth = _full_length(data_mod.generate_student_arrays(n_samples=args.replay_synthetic, seed=args.seed + 1, seq_len=seq_len))
+        if variable_length and ckpt.get('min_history'):
+            # Same short histories the model was trained on, so replay keeps it good at them
+            synth = _truncate(synth, ckpt['min_history'], rng)
+        replay.add(synth)
+    prev = ckpt.get('finetune') or {}
+    if prev and prev.get('holdout_samples', args.holdout_samples) != args.holdout_samples:
+        raise SystemExit(f"--holdout-samples must stay {prev['holdout_samples']} (the baseline's holdout size) to compare against its MAE")
+    holdout = _full_length(data_mod.generate_student_arrays(n_samples=args.holdout_samples, seed=HOLDOUT_SEED, seq_len=seq_len))
+
+    before = {'holdout_mae': evaluate(model, ckpt, holdout), 'new_holdout_mae': evaluate(model, ckpt, new_hold)}
+    # Holdout MAE of the checkpoint before its first fine-tune
+    base_holdout_mae = float(prev.get('base_holdout_mae', before['holdout_mae']))
+    started = time.perf_counter()
+    losses = finetune(model, ckpt, new_train, replay, args.steps, args.lr, args.batch_size, args.replay_ratio, seed=args.seed)
+    elapsed = time.perf_counter() - started
+    after = {'holdout_mae': evaluate(model, ckpt, holdout), 'new_holdout_mae': evaluate(model, ckpt, new_hold)}
+    print(f"{len(new_train['current_grade'])} new record(s) + replay ({len(replay)} buffered), {args.steps} steps in {elapsed:.2f}s, "
+          f"loss {losses[0]:.4f} -> {losses[-1]:.4f}")
+    print(f"Synthetic holdout MAE {_fmt(before['holdout_mae'])} -> {_fmt(after['holdout_mae'])} (baseline {base_holdout_mae:.3f}) | "
+          f"held-out new records MAE {_fmt(before['new_holdout_mae'])} -> {_fmt(after['new_holdout_mae'])}")
+
+    if after['holdout_mae'] > before['holdout_mae'] + args.max_holdout_increase:
+        raise SystemExit(f"Rejected: holdout MAE grew by {after['holdout_mae'] - before['holdout_mae']:.3f} (> {args.max_holdout_increase}); not publishing")
+    if after['holdout_mae'] > base_holdout_mae + args.max_holdout_increase:
+        raise SystemExit(f"Rejected: holdout MAE is {after['holdout_mae'] - base_holdout_mae:.3f} above the pre-fine-tuning baseline "
+                         f"(> {args.max_holdout_increase}); not publishing")
+    if before['new_holdout_mae'] is not None and after['new_holdout_mae'] > before['new_holdout_mae']:
+        raise SystemExit('Rejected: held-out new records got worse; not publishing')
+    if args.dry_run:
+        print('Dry run: not publishing')
+        return
+
+    version = int(prev.get('version', 0)) + 1
+    out = {k: v for k, v in ckpt.items() if k not in _STALE_KEYS}
+    out['model_state'] = model.state_dict()
+    out['finetune'] = {
+        'version': version,
+        'parent': file_fingerprint(args.checkpoint),
+        'records': n,
+        'steps': args.steps,
+        'lr': args.lr,
+        'replay_ratio': args.replay_ratio,
+        'before': before,
+        'after': after,
+        'base_holdout_mae': base_holdout_mae,
+        'holdout_samples': args.holdout_samples,
+        'created_at': time.time(),
+    }
+    target = args.publish or args.checkpoint
+    versions_dir = args.versions_dir or os.path.join(os.path.dirname(os.path.abspath(target)), 'versions')
+    versioned = publish(out, target, versions_dir, version)
+    replay.add(records)
+    replay.save(args.replay_buffer)
+    print(f'Published fine-tune version {version}: {versioned} -> {target}')
+
+
+if __name__ == '__main__':
+    main()
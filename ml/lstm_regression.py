@@ -8,25 +8,41 @@ import torch
 import torch.nn as nn
 import torch.optim as optim
 from torch.utils.data import Dataset, DataLoader
-from sklearn.model_selection import train_test_split
-from sklearn.metrics import mean_absolute_error, r2_score
+from torch.nn.utils.rnn import pack_padded_sequence
 
 try:
     from . import data as data_mod  # type: ignore
+    from . import shards as shards_mod  # type: ignore
+    from .tensor_loader import TensorBatchLoader  # type: ignore
+    from .checkpoint import read_checkpoint  # type: ignore
+    from .training import Checkpointer, EarlyStopping, resume_state  # type: ignore
+    from .crossval import report as report_kfold, run_kfold  # type: ignore
+    from .ensemble import StackedRegressionEnsemble, ensemble_metrics  # type: ignore
 except ImportError:  # pragma: no cover
     current_dir = os.path.dirname(os.path.abspath(__file__))
     parent_dir = os.path.dirname(current_dir)
     if parent_dir not in sys.path:
         sys.path.append(parent_dir)
     import ml.data as data_mod  # type: ignore
+    import ml.shards as shards_mod  # type: ignore
+    from ml.tensor_loader import TensorBatchLoader  # type: ignore
+    from ml.checkpoint import read_checkpoint  # type: ignore
+    from ml.training import Checkpointer, EarlyStopping, resume_state  # type: ignore
+    from ml.crossval import report as report_kfold, run_kfold  # type: ignore
+    from ml.ensemble import StackedRegressionEnsemble, ensemble_metrics  # type: ignore
 
 
 class StudentPerformanceModel(nn.Module):
     """LSTM-based regression model predicting continuous current grade.
 
-    Assumes fixed-length history (seq_len) of past grades and one difficulty feature.
+    Takes a history of past grades (oldest first) and one difficulty feature.
+    Histories are ``seq_len`` long unless ``lengths`` is given: rows are then
+    left-aligned and zero-padded to the longest one, and the LSTM runs over a
+    packed sequence so each row's state stops at its own last grade.
+    When ``quantiles`` is given, a quantile head shares the MLP trunk with the point
+    head and predicts the grade at each quantile level (non-crossing by construction).
     """
-    def __init__(self, seq_len: int = 10, hidden_size: int = 32, fc_hidden: int = 64, use_difficulty: bool = True):
+    def __init__(self, seq_len: int = 10, hidden_size: int = 32, fc_hidden: int = 64, use_difficulty: bool = True, quantiles: List[float] | None = None):
         super().__init__()
         self.seq_len = seq_len
         self.use_difficulty = use_difficulty
@@ -39,41 +55,107 @@ class StudentPerformanceModel(nn.Module):
             nn.ReLU(),
             nn.Linear(fc_hidden // 2, 1)
         )
-
-    def forward(self, past_grades: torch.Tensor, difficulty: torch.Tensor | None = None):
-        # past_grades: (B, seq_len)
-        x = past_grades.unsqueeze(-1)  # (B, seq_len, 1)
-        _, (h, _) = self.lstm(x)       # h: (1,B,H)
-        feat = h[-1]                   # (B,H)
+        self.quantiles = sorted(float(q) for q in quantiles) if quantiles else []
+        if self.quantiles:
+            self.quantile_head = nn.Linear(fc_hidden // 2, len(self.quantiles))
+
+    def encode(self, past_grades: torch.Tensor, state: Tuple[torch.Tensor, torch.Tensor] | None = None, lengths: torch.Tensor | None = None):
+        """Run the LSTM over (B, T) grades starting from ``state`` (zeros if None); returns the final (h, c), each (1, B, H).
+
+        Encoding a history in pieces, feeding each piece the previous piece's
+        state, gives the same state as encoding it in one go. ``lengths`` (B,)
+        marks how many leading grades of each row are real.
+        """
+        x = past_grades.unsqueeze(-1)  # (B, T, 1)
+        if lengths is not None and bool((lengths < past_grades.size(1)).any()):
+            packed = pack_padded_sequence(x, lengths.cpu(), batch_first=True, enforce_sorted=False)
+            _, (h, c) = self.lstm(packed, state)
+            return h, c
+        _, (h, c) = self.lstm(x, state)
+        return h, c
+
+    def head(self, h: torch.Tensor, difficulty: torch.Tensor | None = None):
+        """Point prediction (B,) from a final hidden state h (B, H)."""
+        return self.fc(self._with_difficulty(h, difficulty)).squeeze(1)
+
+    def _features(self, past_grades: torch.Tensor, difficulty: torch.Tensor | None, lengths: torch.Tensor | None = None):
+        # past_grades: (B, T)
+        h, _ = self.encode(past_grades, lengths=lengths)  # h: (1,B,H)
+        return self._with_difficulty(h[-1], difficulty)
+
+    def _with_difficulty(self, feat: torch.Tensor, difficulty: torch.Tensor | None):
         if self.use_difficulty:
             if difficulty is None:
                 raise ValueError("difficulty tensor required but missing")
             if difficulty.dim() == 1:
                 difficulty = difficulty.unsqueeze(1)
             feat = torch.cat([feat, difficulty], dim=1)
-        out = self.fc(feat).squeeze(1)
+        return feat
+
+    def forward(self, past_grades: torch.Tensor, difficulty: torch.Tensor | None = None, lengths: torch.Tensor | None = None):
+        out = self.fc(self._features(past_grades, difficulty, lengths)).squeeze(1)
         return out
 
+    def forward_with_quantiles(self, past_grades: torch.Tensor, difficulty: torch.Tensor | None = None, lengths: torch.Tensor | None = None):
+        """Return (point prediction (B,), quantile predictions (B, Q))."""
+        if not self.quantiles:
+            raise ValueError("model was trained without quantile heads")
+        trunk = self.fc[:-1](self._features(past_grades, difficulty, lengths))
+        point = self.fc[-1](trunk).squeeze(1)
+        raw = self.quantile_head(trunk)
+        # Lowest quantile plus positive increments keeps the quantiles ordered
+        steps = torch.nn.functional.softplus(raw[:, 1:])
+        quants = torch.cat([raw[:, :1], raw[:, :1] + torch.cumsum(steps, dim=1)], dim=1)
+        return point, quants
+
+
+def random_truncate(past: torch.Tensor, min_len: int, generator: torch.Generator | None = None) -> Tuple[torch.Tensor, torch.Tensor]:
+    """Keep the most recent L grades of each row, L uniform in [min_len, T].
+
+    Returns the shortened histories left-aligned and zero-padded to T, with
+    their lengths, so a fixed-length dataset also teaches the model short
+    histories (new students).
+    """
+    b, t = past.shape
+    lengths = torch.randint(min_len, t + 1, (b,), generator=generator)
+    idx = torch.arange(t).unsqueeze(0) + (t - lengths).unsqueeze(1)  # (B, T) source column
+    valid = (idx < t).to(past.device)
+    out = torch.gather(past, 1, idx.clamp(max=t - 1).to(past.device)) * valid
+    return out, lengths
+
+
+def pinball_loss(quant_pred: torch.Tensor, target: torch.Tensor, levels: torch.Tensor):
+    """Mean quantile (pinball) loss of (B, Q) predictions against (B,) targets."""
+    err = target.unsqueeze(1) - quant_pred
+    return torch.maximum(levels * err, (levels - 1.0) * err).mean()
+
 
 class RegressionGradesDataset(Dataset):
+    """Accepts a DataFrame from ``data.fetch_raw`` or the array dict from ``data.fetch_raw_arrays``."""
     def __init__(self, df, seq_len: int = 10, scale_grades: bool = True, use_difficulty: bool = True):
         self.seq_len = seq_len
         self.use_difficulty = use_difficulty
-        grades = np.stack(df.past_grades.values).astype(np.float32)  # (N,10)
+        if isinstance(df, dict):
+            grades = np.asarray(df['past_grades'], dtype=np.float32)
+            difficulty = np.asarray(df['difficulty'], dtype=np.float32)
+            targets = np.asarray(df['current_grade'], dtype=np.float32)
+        else:
+            grades = np.stack(df.past_grades.values).astype(np.float32)  # (N,10)
+            difficulty = df.difficulty.values.astype(np.float32)
+            targets = df.current_grade.values.astype(np.float32)
         if grades.shape[1] != seq_len:
             raise ValueError(f"Expected seq_len={seq_len} but got {grades.shape[1]}")
         if scale_grades:
             grades = grades / 100.0
-        self.past = torch.from_numpy(grades)
+        self.past = torch.from_numpy(np.ascontiguousarray(grades))
         self.scale_grades = scale_grades
         if use_difficulty:
-            self.difficulty = torch.tensor(((df.difficulty.values.astype(np.float32) - 1) / 9.0))
+            self.difficulty = torch.from_numpy((difficulty - 1) / 9.0)
         else:
             self.difficulty = None
-        targets = df.current_grade.values.astype(np.float32)
         if scale_grades:
             targets = targets / 100.0
-        self.targets = torch.tensor(targets)
+        self.targets = torch.from_numpy(np.ascontiguousarray(targets))
 
     def __len__(self):
         return len(self.targets)
@@ -85,21 +167,97 @@ class RegressionGradesDataset(Dataset):
         return past, diff, y
 
 
-def build_loaders(df, seq_len: int, batch_size: int, test_size: float, scale_grades: bool, use_difficulty: bool, seed: int = 42) -> Tuple[DataLoader, DataLoader]:
-    train_df, val_df = train_test_split(df, test_size=test_size, random_state=seed)
+class ShardRegressionLoader:
+    """Streams (past, diff, y) batches from a memory-mapped ``shards.ShardedDataset``."""
+    def __init__(self, dataset, batch_size: int, shuffle: bool, scale_grades: bool, use_difficulty: bool, seed: int = 42):
+        self.dataset = dataset
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.scale_grades = scale_grades
+        self.use_difficulty = use_difficulty
+        self.seed = seed
+        self.epoch = 0
+
+    def __iter__(self):
+        self.epoch += 1
+        for batch in self.dataset.iter_batches(self.batch_size, shuffle=self.shuffle, seed=self.seed + self.epoch):
+            past = torch.from_numpy(batch['past_grades'].astype(np.float32))
+            y = torch.from_numpy(batch['current_grade'].astype(np.float32))
+            if self.scale_grades:
+                past = past / 100.0
+                y = y / 100.0
+            if self.use_difficulty:
+                diff = (torch.from_numpy(batch['difficulty'].astype(np.float32)) - 1) / 9.0
+            else:
+                diff = torch.zeros(len(y))
+            yield past, diff, y
+
+
+def build_shard_loaders(root: str, batch_size: int, test_size: float, scale_grades: bool, use_difficulty: bool, seed: int = 42) -> Tuple[ShardRegressionLoader, ShardRegressionLoader]:
+    train_ds, val_ds = shards_mod.ShardedDataset(root).split(test_size)
+    return (
+        ShardRegressionLoader(train_ds, batch_size, shuffle=True, scale_grades=scale_grades, use_difficulty=use_difficulty, seed=seed),
+        ShardRegressionLoader(val_ds, batch_size, shuffle=False, scale_grades=scale_grades, use_difficulty=use_difficulty, seed=seed),
+    )
+
+
+def build_loaders(df, seq_len: int, batch_size: int, test_size: float, scale_grades: bool, use_difficulty: bool, seed: int = 42, loader: str = 'tensor', pin_memory: bool = False,
+                  split: Tuple[np.ndarray, np.ndarray] | None = None):
+    """Train/val loaders; ``loader='tensor'`` slices whole batches, ``'torch'`` uses the per-item DataLoader.
+
+    ``split`` gives explicit (train, val) row indices (e.g. a cross-validation fold) instead of a random ``test_size`` split.
+    """
+    from sklearn.model_selection import train_test_split
+    if isinstance(df, dict):
+        train_idx, val_idx = split if split is not None else train_test_split(np.arange(len(df['current_grade'])), test_size=test_size, random_state=seed)
+        train_df = {k: v[train_idx] for k, v in df.items()}
+        val_df = {k: v[val_idx] for k, v in df.items()}
+    elif split is not None:
+        train_df, val_df = df.iloc[split[0]], df.iloc[split[1]]
+    else:
+        train_df, val_df = train_test_split(df, test_size=test_size, random_state=seed)
     train_ds = RegressionGradesDataset(train_df, seq_len=seq_len, scale_grades=scale_grades, use_difficulty=use_difficulty)
     val_ds = RegressionGradesDataset(val_df, seq_len=seq_len, scale_grades=scale_grades, use_difficulty=use_difficulty)
+    if loader == 'torch':
+        return (
+            DataLoader(train_ds, batch_size=batch_size, shuffle=True, pin_memory=pin_memory),
+            DataLoader(val_ds, batch_size=batch_size, shuffle=False, pin_memory=pin_memory),
+        )
+    def tensors(ds):
+        diff = ds.difficulty if ds.difficulty is not None else torch.zeros(len(ds.targets))
+        return ds.past, diff, ds.targets
     return (
-        DataLoader(train_ds, batch_size=batch_size, shuffle=True),
-        DataLoader(val_ds, batch_size=batch_size, shuffle=False),
+        TensorBatchLoader(*tensors(train_ds), batch_size=batch_size, shuffle=True, pin_memory=pin_memory, seed=seed),
+        TensorBatchLoader(*tensors(val_ds), batch_size=batch_size, shuffle=False, pin_memory=pin_memory),
     )
 
 
-def train(model, train_loader, val_loader, device: str, epochs: int, lr: float, scale_grades: bool, tolerance_acc: float | None, want_val_acc: bool, rel_acc: float | None):
+def train(model, train_loader, val_loader, device: str, epochs: int, lr: float, scale_grades: bool, tolerance_acc: float | None, want_val_acc: bool, rel_acc: float | None, quantile_weight: float = 1.0, optimizer=None, verbose: bool = True,
+          patience: int = 0, min_delta: float = 0.0, checkpointer=None, resume: Dict | None = None, min_history: int = 0):
+    """Train up to ``epochs`` epochs; returns (best val MAE, per-epoch history).
+
+    The model ends up holding the weights of the best validation epoch. With
+    ``patience`` > 0 training stops after that many epochs without the MAE
+    improving by ``min_delta``. ``checkpointer`` (``training.Checkpointer``)
+    saves resumable state periodically; ``resume`` is such a checkpoint (its
+    ``model_state`` already loaded into ``model``) to continue from.
+
+    Pass ``optimizer`` (built over the model's parameters, already on ``device``)
+    to continue a previous run with its optimizer state; ``lr`` is then unused.
+
+    ``min_history`` > 0 trains and validates on randomly truncated histories
+    (``random_truncate``) run as packed sequences; validation draws the same
+    truncations every epoch so its metrics stay comparable.
+    """
+    from sklearn.metrics import mean_absolute_error, r2_score
     criterion = nn.SmoothL1Loss()
-    optimiz = optim.Adam(model.parameters(), lr=lr)
     model.to(device)
+    optimiz = optimizer if optimizer is not None else optim.Adam(model.parameters(), lr=lr)
+    use_quantiles = bool(getattr(model, 'quantiles', None))
+    levels = torch.tensor(model.quantiles, dtype=torch.float32, device=device) if use_quantiles else None
     keys = ['train_loss','val_loss','val_mae','val_r2']
+    if use_quantiles:
+        keys.append('val_pinball')
     if tolerance_acc is not None:
         keys.append('val_tol_acc')
     if want_val_acc:
@@ -107,34 +265,55 @@ def train(model, train_loader, val_loader, device: str, epochs: int, lr: float,
     if rel_acc is not None:
         keys.append('val_rel_acc')
     history: Dict[str, List[float]] = {k: [] for k in keys}
-    best_mae = float('inf')
-    for ep in range(1, epochs+1):
+    stopper = EarlyStopping(patience=patience, min_delta=min_delta)
+    start = resume_state(resume, optimiz, stopper, history) if resume is not None else 1
+    for ep in range(start, epochs+1):
         model.train()
         total_loss = 0.0
+        n_train = 0
         for past, diff, y in train_loader:
-            past, diff, y = past.to(device), diff.to(device), y.to(device)
+            past, diff, y = past.to(device, non_blocking=True), diff.to(device, non_blocking=True), y.to(device, non_blocking=True)
+            lengths = None
+            if min_history:
+                past, lengths = random_truncate(past, min_history)
             optimiz.zero_grad()
-            pred = model(past, diff)
-            loss = criterion(pred, y)
+            if use_quantiles:
+                pred, quants = model.forward_with_quantiles(past, diff, lengths)
+                loss = criterion(pred, y) + quantile_weight * pinball_loss(quants, y, levels)
+            else:
+                pred = model(past, diff, lengths)
+                loss = criterion(pred, y)
             loss.backward()
             nn.utils.clip_grad_norm_(model.parameters(), 5.0)
             optimiz.step()
             total_loss += loss.item() * past.size(0)
-        train_loss = total_loss / len(train_loader.dataset)
+            n_train += past.size(0)
+        train_loss = total_loss / max(1, n_train)
 
         # Validation
         model.eval()
         val_loss_sum = 0.0
+        pinball_sum = 0.0
+        n_val = 0
         preds_all, targets_all = [], []
+        val_gen = torch.Generator().manual_seed(0)
         with torch.no_grad():
             for past, diff, y in val_loader:
                 past, diff, y = past.to(device), diff.to(device), y.to(device)
-                pred = model(past, diff)
+                lengths = None
+                if min_history:
+                    past, lengths = random_truncate(past, min_history, generator=val_gen)
+                if use_quantiles:
+                    pred, quants = model.forward_with_quantiles(past, diff, lengths)
+                    pinball_sum += pinball_loss(quants, y, levels).item() * past.size(0)
+                else:
+                    pred = model(past, diff, lengths)
                 loss = criterion(pred, y)
                 val_loss_sum += loss.item() * past.size(0)
+                n_val += past.size(0)
                 preds_all.append(pred.cpu())
                 targets_all.append(y.cpu())
-        val_loss = val_loss_sum / len(val_loader.dataset)
+        val_loss = val_loss_sum / max(1, n_val)
         preds = torch.cat(preds_all)
         targets = torch.cat(targets_all)
         # Convert back to grade points if scaled for metrics readability
@@ -148,6 +327,11 @@ def train(model, train_loader, val_loader, device: str, epochs: int, lr: float,
         # r2 on unscaled domain
         r2 = r2_score(targets_points.numpy(), preds_points.numpy())
 
+        if use_quantiles:
+            # reported in grade points like MAE
+            val_pinball = pinball_sum / max(1, n_val) * (100.0 if scale_grades else 1.0)
+            history['val_pinball'].append(val_pinball)
+
         if tolerance_acc is not None:
             diff_abs = (preds_points - targets_points).abs()
             tol_hits = (diff_abs <= tolerance_acc).float().mean().item()
@@ -180,6 +364,8 @@ def train(model, train_loader, val_loader, device: str, epochs: int, lr: float,
             f"ValMAE {mae:.2f}",
             f"R2 {r2:.3f}"
         ]
+        if use_quantiles:
+            components.append(f"Pinball {val_pinball:.2f}")
         if tolerance_acc is not None:
             components.append(f"TolAcc(±{tolerance_acc:.1f}) {tol_hits*100:.2f}%")
         if want_val_acc:
@@ -189,12 +375,36 @@ def train(model, train_loader, val_loader, device: str, epochs: int, lr: float,
                 components.append(f"RelAcc(±{rel_acc:.0f}%) {rel_hits*100:.2f}%")
             else:
                 components.append(f"RelAcc(±{rel_acc*100:.0f}%) {rel_hits*100:.2f}%")
-        print(" | ".join(components))
-        if mae < best_mae:
-            best_mae = mae
+        if stopper.update(mae, model, ep):
+            components.append("*")
+        if verbose:
+            print(" | ".join(components))
+        stop = stopper.should_stop
+        if checkpointer is not None:
+            checkpointer.maybe_save(ep, model, optimiz, stopper, history, final=stop or ep == epochs)
+        if stop:
+            if verbose:
+                print(f"Early stopping: no improvement for {patience} epochs (best epoch {stopper.best_epoch})")
+            break
+    stopper.restore(model)
+    best_mae = stopper.best if stopper.best is not None else float('inf')
     return best_mae, history
 
 
+def train_fold(data, train_idx: np.ndarray, val_idx: np.ndarray, opts: Dict) -> Dict[str, float]:
+    """Train one cross-validation fold (see ``ml.crossval``); returns metrics of its best epoch."""
+    use_difficulty = not opts['no_difficulty']
+    tolerance = opts['tolerance_acc'] if opts['tolerance_acc'] is not None else 5.0
+    train_loader, val_loader = build_loaders(data, seq_len=opts['seq_len'], batch_size=opts['batch_size'], test_size=0.0, scale_grades=opts['scale_grades'],
+                                             use_difficulty=use_difficulty, seed=opts['seed'], split=(train_idx, val_idx))
+    model = StudentPerformanceModel(seq_len=opts['seq_len'], hidden_size=opts['hidden_size'], fc_hidden=opts['fc_hidden'], use_difficulty=use_difficulty, quantiles=opts['quantiles'])
+    best_mae, history = train(model, train_loader, val_loader, 'cpu', epochs=opts['epochs'], lr=opts['lr'], scale_grades=opts['scale_grades'], tolerance_acc=tolerance,
+                              want_val_acc=False, rel_acc=None, quantile_weight=opts['quantile_weight'], verbose=False, patience=opts['patience'], min_delta=opts['min_delta'],
+                              min_history=opts.get('min_history', 1) if opts.get('variable_length') else 0)
+    best = history['val_mae'].index(best_mae)
+    return {'mae': history['val_mae'][best], 'r2': history['val_r2'][best], 'tol_acc': history['val_tol_acc'][best], 'best_epoch': best + 1}
+
+
 def main():
     parser = argparse.ArgumentParser(description='LSTM regression for current grade prediction')
     parser.add_argument('--limit', type=int, default=0, help='Number of synthetic samples (0 -> default 1000)')
@@ -213,38 +423,113 @@ def main():
     parser.add_argument('--tolerance-acc', type=float, default=None, help='If set (e.g. 5), report accuracy within ±tolerance grade points.')
     parser.add_argument('--val-accuracy', action='store_true', help='Also compute exact integer grade match accuracy (%)')
     parser.add_argument('--relative-acc', type=float, default=None, help='Relative accuracy threshold (e.g. 0.1 or 10 for 10%).')
+    parser.add_argument('--loader', type=str, default='tensor', choices=['tensor', 'torch'], help='Batch-slicing tensor loader or per-item torch DataLoader')
+    parser.add_argument('--pin-memory', action='store_true', help='Page-locked batch buffers for faster host-to-GPU copies')
+    parser.add_argument('--shards', type=str, default='', help='Shard directory to stream training data from (generated from --limit/--seed/--seq-len if missing; an existing one must match them)')
+    parser.add_argument('--shard-size', type=int, default=1_000_000, help='Rows per shard when generating --shards')
+    parser.add_argument('--quantiles', type=str, default='', help='Comma-separated quantile levels for the distribution head (e.g. 0.05,0.1,...,0.95)')
+    parser.add_argument('--quantile-weight', type=float, default=1.0, help='Weight of the pinball loss relative to the SmoothL1 point loss')
+    parser.add_argument('--patience', type=int, default=0, help='Stop after this many epochs without val MAE improvement (0 = run all epochs)')
+    parser.add_argument('--min-delta', type=float, default=0.0, help='Minimum val MAE decrease (grade points) that counts as an improvement')
+    parser.add_argument('--checkpoint-path', type=str, default='', help='Write a resumable training checkpoint here')
+    parser.add_argument('--checkpoint-every', type=int, default=1, help='Epochs between training checkpoints')
+    parser.add_argument('--resume', type=str, default='', help='Continue from a training checkpoint written via --checkpoint-path')
+    parser.add_argument('--kfold', type=int, default=0, help='Evaluate with K-fold cross-validation (folds trained in parallel) instead of training one model')
+    parser.add_argument('--kfold-workers', type=int, default=0, help='Parallel fold processes (0 -> min(K, CPUs))')
+    parser.add_argument('--seed', type=int, default=42, help='Data generation and train/val split seed')
+    parser.add_argument('--variable-length', action='store_true', help='Train on randomly truncated histories (packed sequences) so the model serves histories of 1..seq_len grades')
+    parser.add_argument('--min-history', type=int, default=1, help='Shortest history drawn with --variable-length')
+    parser.add_argument('--ensemble', type=int, default=1, help='Train this many members from seeds seed..seed+K-1 and save them as one ensemble checkpoint')
     args = parser.parse_args()
+    quantiles = [float(q) for q in args.quantiles.split(',') if q.strip()]
+    if any(not 0.0 < q < 1.0 for q in quantiles):
+        raise SystemExit('--quantiles levels must lie strictly between 0 and 1')
+    if args.variable_length and not 1 <= args.min_history <= args.seq_len:
+        raise SystemExit('--min-history must lie between 1 and --seq-len')
+    min_history = args.min_history if args.variable_length else 0
+    if args.ensemble > 1 and (quantiles or args.resume or args.checkpoint_path or args.kfold):
+        raise SystemExit('--ensemble cannot be combined with --quantiles, --resume, --checkpoint-path or --kfold')
+
+    if args.kfold:
+        if args.shards:
+            raise SystemExit('--kfold works on in-memory data; drop --shards')
+        raw = data_mod.fetch_raw_arrays(args.limit, seed=args.seed)
+        arrays = {k: raw[k] for k in ('past_grades', 'difficulty', 'current_grade')}
+        opts = dict(vars(args), quantiles=quantiles)
+        result = run_kfold('lstm_regression', arrays, opts, k=args.kfold, workers=args.kfold_workers, seed=args.seed)
+        report_kfold(result, scale={'tol_acc': 100.0})
+        return
 
     device = 'cuda' if (args.device == 'auto' and torch.cuda.is_available()) else ('cpu' if args.device == 'auto' else args.device)
     print(f'Using device: {device}')
 
-    raw = data_mod.fetch_raw(args.limit)
-    # raw already has past_grades, difficulty, current_grade
-
-    loaders = build_loaders(raw, seq_len=args.seq_len, batch_size=args.batch_size, test_size=args.test_size, scale_grades=args.scale_grades, use_difficulty=not args.no_difficulty)
+    if args.shards:
+        try:
+            shards_mod.ensure_shards(args.shards, args.limit if args.limit and args.limit > 0 else None, shard_size=args.shard_size, seed=args.seed, seq_len=args.seq_len)
+        except ValueError as e:
+            raise SystemExit(str(e))
+        loaders = build_shard_loaders(args.shards, batch_size=args.batch_size, test_size=args.test_size, scale_grades=args.scale_grades, use_difficulty=not args.no_difficulty, seed=args.seed)
+    else:
+        raw = data_mod.fetch_raw_arrays(args.limit, seed=args.seed)
+        # raw already has past_grades, difficulty, current_grade as dense arrays
+        loaders = build_loaders(raw, seq_len=args.seq_len, batch_size=args.batch_size, test_size=args.test_size, scale_grades=args.scale_grades, use_difficulty=not args.no_difficulty, seed=args.seed, loader=args.loader, pin_memory=args.pin_memory)
     train_loader, val_loader = loaders
 
-    model = StudentPerformanceModel(seq_len=args.seq_len, hidden_size=args.hidden_size, fc_hidden=args.fc_hidden, use_difficulty=not args.no_difficulty)
+    model = StudentPerformanceModel(seq_len=args.seq_len, hidden_size=args.hidden_size, fc_hidden=args.fc_hidden, use_difficulty=not args.no_difficulty, quantiles=quantiles)
+    resume = None
+    if args.resume:
+        resume = read_checkpoint(args.resume)
+        model.load_state_dict(resume['model_state'])
+        print(f"Resuming from {args.resume} after epoch {resume.get('epoch')}")
 
-    best_mae, history = train(model, train_loader, val_loader, device, epochs=args.epochs, lr=args.lr, scale_grades=args.scale_grades, tolerance_acc=args.tolerance_acc, want_val_acc=args.val_accuracy, rel_acc=args.relative_acc)
-
-    print(f'Best Val MAE: {best_mae:.2f}')
-
-    if args.save_path:
-        ckpt = {
-            'model_state': model.state_dict(),
+    def checkpoint_meta():
+        return {
             'model_type': 'lstm_regression',
             'seq_len': args.seq_len,
             'hidden_size': args.hidden_size,
             'fc_hidden': args.fc_hidden,
             'use_difficulty': not args.no_difficulty,
             'scale_grades': args.scale_grades,
-            'best_val_mae': best_mae,
+            'quantiles': model.quantiles,
+            'variable_length': args.variable_length,
+            'min_history': min_history,
             'args': vars(args),
             'tolerance_acc': args.tolerance_acc,
             'val_accuracy': args.val_accuracy,
             'relative_acc': args.relative_acc
         }
+    checkpointer = None
+    if args.checkpoint_path:
+        checkpointer = Checkpointer(args.checkpoint_path, checkpoint_meta, every=args.checkpoint_every)
+
+    ensemble_fields = {}
+    if args.ensemble > 1:
+        members = []
+        for k in range(args.ensemble):
+            torch.manual_seed(args.seed + k)
+            member = StudentPerformanceModel(seq_len=args.seq_len, hidden_size=args.hidden_size, fc_hidden=args.fc_hidden, use_difficulty=not args.no_difficulty)
+            print(f'Ensemble member {k + 1}/{args.ensemble} (seed {args.seed + k})')
+            member_mae, member_history = train(member, train_loader, val_loader, device, epochs=args.epochs, lr=args.lr, scale_grades=args.scale_grades, tolerance_acc=args.tolerance_acc, want_val_acc=args.val_accuracy, rel_acc=args.relative_acc,
+                                               patience=args.patience, min_delta=args.min_delta, min_history=min_history)
+            members.append((member_mae, member, member_history))
+        # The best member doubles as the checkpoint's single model (export, NumPy runtime)
+        _, model, history = min(members, key=lambda m: m[0])
+        states = [{k: v.detach().cpu() for k, v in m.state_dict().items()} for _, m, _ in members]
+        stats = ensemble_metrics(StackedRegressionEnsemble(states, seq_len=args.seq_len, use_difficulty=not args.no_difficulty).eval(), val_loader, args.scale_grades)
+        best_mae = stats['mae']
+        print(f"Ensemble of {args.ensemble}: Val MAE {stats['mae']:.2f} (members {stats['mean_member_mae']:.2f} on average) | "
+              f"mean std {stats['mean_std']:.2f} | within 2 std {stats['coverage_2std'] * 100:.1f}%")
+        ensemble_fields = {'ensemble_states': states, 'ensemble_size': args.ensemble, 'member_val_mae': [float(m[0]) for m in members],
+                           'ensemble_val': stats}
+    else:
+        best_mae, history = train(model, train_loader, val_loader, device, epochs=args.epochs, lr=args.lr, scale_grades=args.scale_grades, tolerance_acc=args.tolerance_acc, want_val_acc=args.val_accuracy, rel_acc=args.relative_acc, quantile_weight=args.quantile_weight,
+                                  patience=args.patience, min_delta=args.min_delta, checkpointer=checkpointer, resume=resume, min_history=min_history)
+
+    print(f'Best Val MAE: {best_mae:.2f}')
+
+    if args.save_path:
+        # train() restored the best epoch's weights
+        ckpt = dict(checkpoint_meta(), model_state=model.state_dict(), best_val_mae=best_mae, **ensemble_fields)
         torch.save(ckpt, args.save_path)
         print(f'Saved checkpoint to {args.save_path}')
 
@@ -322,13 +607,17 @@ def main():
             pass
 
 
-def load_regression_model(path: str):
-    ckpt = torch.load(path, map_location='cpu')
-    model = StudentPerformanceModel(seq_len=ckpt['seq_len'], hidden_size=ckpt['hidden_size'], fc_hidden=ckpt['fc_hidden'], use_difficulty=ckpt['use_difficulty'])
+def regression_model_from_checkpoint(ckpt: Dict):
+    """Build the eval-mode model from an already-read checkpoint dict."""
+    model = StudentPerformanceModel(seq_len=ckpt['seq_len'], hidden_size=ckpt['hidden_size'], fc_hidden=ckpt['fc_hidden'], use_difficulty=ckpt['use_difficulty'], quantiles=ckpt.get('quantiles'))
     model.load_state_dict(ckpt['model_state'])
     model.eval()
     return model, ckpt
 
 
+def load_regression_model(path: str):
+    return regression_model_from_checkpoint(read_checkpoint(path))
+
+
 if __name__ == '__main__':
     main()
@@ -0,0 +1,275 @@
+"""Dependency-free Prometheus metrics for the inference service.
+
+Counters, gauges and histograms render in the Prometheus text exposition
+format (0.0.4). An observation is a lock, a ``bisect`` and a few additions, so
+the instrumentation stays on in production; everything derived from other
+state (queue depths, cache counters, model identity) is computed only when
+``/metrics`` is scraped, through collector callbacks.
+
+``MetricsMiddleware`` is a pure ASGI middleware: it times each request end to
+end, counts it by route template / model / status, tracks in-flight requests,
+and splits the time spent before and after the endpoint body (request parsing
+and validation, response serialization) using the ``RequestTimer`` that the
+endpoint fills in through ``current_timer()``.
+"""
+import bisect
+import contextvars
+import functools
+import math
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024, 2048, 4096, 8192, 16384)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels(names: Sequence[str], values: Sequence[str], extra: str = '') -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return '{' + ','.join(parts) + '}' if parts else ''
+
+
+def _fmt(value: float) -> str:
+    if value == math.inf:
+        return '+Inf'
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+Collector = Callable[[], Iterable[Tuple[Tuple[str, ...], float]]]
+
+
+class _Metric:
+    kind = ''
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def header(self) -> List[str]:
+        return [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.kind}']
+
+
+class _Value(_Metric):
+    """Single-value series; ``collect`` (if given) supplies the values at scrape time instead."""
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (), collect: Optional[Collector] = None):
+        super().__init__(name, help, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self.collect = collect
+
+    def inc(self, *labelvalues: str, amount: float = 1.0):
+        with self._lock:
+            self._values[labelvalues] = self._values.get(labelvalues, 0.0) + amount
+
+    def render(self) -> List[str]:
+        if self.collect is not None:
+            items = sorted(self.collect())
+        else:
+            with self._lock:
+                items = sorted(self._values.items())
+        return self.header() + [f'{self.name}{_labels(self.labelnames, k)} {_fmt(v)}' for k, v in items]
+
+
+class Counter(_Value):
+    kind = 'counter'
+
+
+class Gauge(_Value):
+    kind = 'gauge'
+
+    def set(self, value: float, *labelvalues: str):
+        with self._lock:
+            self._values[labelvalues] = value
+
+    def dec(self, *labelvalues: str, amount: float = 1.0):
+        self.inc(*labelvalues, amount=-amount)
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # labelvalues -> [per-bucket counts (non-cumulative, last is +Inf), sum, count]
+        self._series: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, *labelvalues: str):
+        idx = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labelvalues)
+            if series is None:
+                series = self._series[labelvalues] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][idx] += 1
+            series[1] += value
+            series[2] += 1
+
+    def time(self, *labelvalues: str) -> '_Timer':
+        return _Timer(self, labelvalues)
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = sorted((k, (list(v[0]), v[1], v[2])) for k, v in self._series.items())
+        lines = self.header()
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, c in zip(self.buckets + (math.inf,), counts):
+                cumulative += c
+                le = 'le="%s"' % _fmt(bound)
+                lines.append(f'{self.name}_bucket{_labels(self.labelnames, key, le)} {cumulative}')
+            lines.append(f'{self.name}_sum{_labels(self.labelnames, key)} {_fmt(total)}')
+            lines.append(f'{self.name}_count{_labels(self.labelnames, key)} {count}')
+        return lines
+
+
+class _Timer:
+    __slots__ = ('hist', 'labelvalues', 'start')
+
+    def __init__(self, hist: Histogram, labelvalues: Tuple[str, ...]):
+        self.hist = hist
+        self.labelvalues = labelvalues
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.hist.observe(time.perf_counter() - self.start, *self.labelvalues)
+        return False
+
+
+class MetricsRegistry:
+    def __init__(self, prefix: str = ''):
+        self.prefix = prefix
+        self._metrics: List[_Metric] = []
+
+    def _add(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, help: str, labelnames: Sequence[str] = (), collect: Optional[Collector] = None) -> Counter:
+        return self._add(Counter(self.prefix + name, help, labelnames, collect))
+
+    def gauge(self, name: str, help: str, labelnames: Sequence[str] = (), collect: Optional[Collector] = None) -> Gauge:
+        return self._add(Gauge(self.prefix + name, help, labelnames, collect))
+
+    def histogram(self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        return self._add(Histogram(self.prefix + name, help, labelnames, buckets))
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+class RequestTimer:
+    """Per-request marks filled in by the endpoint (see ``current_timer``)."""
+    __slots__ = ('start', 'handler_start', 'handler_end', 'model', 'error')
+
+    def __init__(self, start: float):
+        self.start = start
+        self.handler_start = 0.0
+        self.handler_end = 0.0
+        self.model = ''
+        self.error = ''
+
+
+_CURRENT: 'contextvars.ContextVar[Optional[RequestTimer]]' = contextvars.ContextVar('request_timer', default=None)
+
+
+def current_timer() -> Optional[RequestTimer]:
+    return _CURRENT.get()
+
+
+def timed_endpoint(fn):
+    """Mark where the endpoint body starts and ends, and record its error type.
+
+    Everything before the start is body parsing and validation; everything
+    between the end and the first response message is serialization.
+    ``functools.wraps`` keeps the signature FastAPI inspects.
+    """
+    @functools.wraps(fn)
+    async def wrapper(*args, **kwargs):
+        timer = _CURRENT.get()
+        if timer is None:
+            return await fn(*args, **kwargs)
+        timer.handler_start = time.perf_counter()
+        try:
+            return await fn(*args, **kwargs)
+        except Exception as e:
+            code = getattr(e, 'status_code', None)
+            timer.error = timer.error or (f'http_{code}' if code else type(e).__name__)
+            raise
+        finally:
+            timer.handler_end = time.perf_counter()
+    return wrapper
+
+
+class MetricsMiddleware:
+    """Pure ASGI middleware recording request-level metrics into ``registry``."""
+
+    def __init__(self, app, registry: MetricsRegistry, skip_paths: Sequence[str] = ('/metrics',)):
+        self.app = app
+        self.skip_paths = set(skip_paths)
+        self.requests = registry.counter('requests_total', 'Requests by route, model and status', ('endpoint', 'model', 'status'))
+        self.errors = registry.counter('request_errors_total', 'Failed requests by route and error type', ('endpoint', 'error'))
+        self.latency = registry.histogram('request_duration_seconds', 'End-to-end request latency inside the app', ('endpoint', 'model'))
+        self.stages = registry.histogram('request_stage_seconds', 'Request time outside the endpoint body, by stage', ('endpoint', 'stage'))
+        self.in_flight = registry.gauge('requests_in_flight', 'Requests currently being handled', ('endpoint',))
+
+    def _route_path(self, scope) -> str:
+        # Label by route template (bounded cardinality), resolved before dispatch
+        router = getattr(scope.get('app'), 'router', None)
+        for candidate in getattr(router, 'routes', ()):
+            match, _ = candidate.matches(scope)
+            if match.name == 'FULL':
+                return getattr(candidate, 'path', '<unmatched>')
+        return '<unmatched>'
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or scope['path'] in self.skip_paths:
+            await self.app(scope, receive, send)
+            return
+        timer = RequestTimer(time.perf_counter())
+        token = _CURRENT.set(timer)
+        status = {'code': 500, 'started': 0.0}
+        endpoint = self._route_path(scope)
+        self.in_flight.inc(endpoint)
+
+        async def send_wrapper(message):
+            if message['type'] == 'http.response.start':
+                status['code'] = message['status']
+                status['started'] = time.perf_counter()
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        except Exception as e:
+            timer.error = timer.error or type(e).__name__
+            raise
+        finally:
+            end = time.perf_counter()
+            _CURRENT.reset(token)
+            self.in_flight.dec(endpoint)
+            code = status['code']
+            self.requests.inc(endpoint, timer.model, str(code))
+            self.latency.observe(end - timer.start, endpoint, timer.model)
+            if timer.handler_start:
+                self.stages.observe(timer.handler_start - timer.start, endpoint, 'parse_validate')
+            if timer.handler_end and status['started']:
+                self.stages.observe(status['started'] - timer.handler_end, endpoint, 'serialize')
+            if code >= 400 or timer.error:
+                # 422 is raised by FastAPI before the endpoint runs
+                self.errors.inc(endpoint, timer.error or ('validation' if code == 422 else f'http_{code}'))
@@ -0,0 +1,216 @@
+"""Torch-free inference for the LSTM regression model.
+
+``NumpyRegressionModel`` reproduces ``StudentPerformanceModel`` (one LSTM layer,
+the fc MLP and the optional quantile head) with batched NumPy matrix products,
+so ml/serve.py can run it from an ``.npz`` file in an image without torch
+(``requirements.inference-numpy.txt``). Weights come from a
+``load_regression_model`` checkpoint (needs torch, once) or from the ``.npz``
+written by this module's CLI, which also checks parity against the torch model:
+
+    python -m ml.numpy_runtime lstm_reg.pt -o lstm_reg.npz
+"""
+import argparse
+import json
+import os
+import sys
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+META_KEY = '__meta__'
+ARTIFACT_FORMAT = 'numpy'
+
+_FC_LAYERS = ('fc.0', 'fc.2', 'fc.4')
+
+
+def _sigmoid(x: np.ndarray) -> np.ndarray:
+    # tanh form: no overflow warnings for large negative inputs
+    return 0.5 * (np.tanh(0.5 * x) + 1.0)
+
+
+def _softplus(x: np.ndarray) -> np.ndarray:
+    return np.logaddexp(0.0, x)
+
+
+class NumpyRegressionModel:
+    """Same inputs and outputs as ``RegressionForward``, on float32 ndarrays.
+
+    ``past`` is (B, seq_len) and ``difficulty`` is (B, 1) (ignored when the model
+    was trained without it); returns (B,) predictions in model units. Optional
+    ``lengths`` (B,) give left-aligned histories shorter than ``past``'s width,
+    the NumPy counterpart of a packed sequence.
+    """
+
+    def __init__(self, state: Dict[str, np.ndarray], meta: Dict):
+        self.meta = meta
+        self.seq_len = int(meta['seq_len'])
+        self.use_difficulty = bool(meta['use_difficulty'])
+        self.quantiles = [float(q) for q in meta.get('quantiles') or []]
+        w_ih = np.asarray(state['lstm.weight_ih_l0'], dtype=np.float32)   # (4H, 1)
+        w_hh = np.asarray(state['lstm.weight_hh_l0'], dtype=np.float32)   # (4H, H)
+        bias = np.asarray(state['lstm.bias_ih_l0'], dtype=np.float32) + np.asarray(state['lstm.bias_hh_l0'], dtype=np.float32)
+        self.hidden_size = w_hh.shape[1]
+        # PyTorch gate order is (i, f, g, o); reorder to (i, f, o, g) so one sigmoid
+        # covers a contiguous 3H block and tanh the last H
+        h = self.hidden_size
+        order = np.r_[0:2 * h, 3 * h:4 * h, 2 * h:3 * h]
+        self.w_ih = np.ascontiguousarray(w_ih[order, 0])                  # (4H,)
+        self.w_hh_t = np.ascontiguousarray(w_hh[order].T)                 # (H, 4H)
+        self.bias = np.ascontiguousarray(bias[order])                     # (4H,)
+        self.fc = [(np.ascontiguousarray(np.asarray(state[f'{name}.weight'], dtype=np.float32).T),
+                    np.asarray(state[f'{name}.bias'], dtype=np.float32)) for name in _FC_LAYERS]
+        if self.quantiles:
+            self.quantile_head = (np.ascontiguousarray(np.asarray(state['quantile_head.weight'], dtype=np.float32).T),
+                                  np.asarray(state['quantile_head.bias'], dtype=np.float32))
+
+    def encode(self, past: np.ndarray, h0: Optional[np.ndarray] = None, c0: Optional[np.ndarray] = None, lengths: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """Final LSTM (h, c), each (B, H), after ``past`` (B, T) starting from (h0, c0) (zeros if None)."""
+        past = np.asarray(past, dtype=np.float32)
+        n, h = past.shape[0], self.hidden_size
+        # Input projections for every timestep in one broadcast: (S, B, 4H)
+        x_proj = past.T[:, :, None] * self.w_ih + self.bias
+        h_t = np.zeros((n, h), dtype=np.float32) if h0 is None else np.asarray(h0, dtype=np.float32).reshape(n, h)
+        c_t = np.zeros((n, h), dtype=np.float32) if c0 is None else np.asarray(c0, dtype=np.float32).reshape(n, h)
+        gates = np.empty((n, 4 * h), dtype=np.float32)
+        for t in range(past.shape[1]):
+            np.matmul(h_t, self.w_hh_t, out=gates)
+            gates += x_proj[t]
+            sig = _sigmoid(gates[:, :3 * h])
+            g = np.tanh(gates[:, 3 * h:])
+            c_new = sig[:, h:2 * h] * c_t + sig[:, :h] * g
+            h_new = sig[:, 2 * h:] * np.tanh(c_new)
+            if lengths is not None:
+                # Rows whose history has ended keep their last state
+                live = (t < lengths)[:, None]
+                c_new = np.where(live, c_new, c_t)
+                h_new = np.where(live, h_new, h_t)
+            h_t, c_t = h_new, c_new
+        return h_t, c_t
+
+    def _with_difficulty(self, h_t: np.ndarray, difficulty: np.ndarray) -> np.ndarray:
+        if self.use_difficulty:
+            return np.concatenate([h_t, np.asarray(difficulty, dtype=np.float32).reshape(h_t.shape[0], 1)], axis=1)
+        return h_t
+
+    def _features(self, past: np.ndarray, difficulty: np.ndarray, lengths: Optional[np.ndarray] = None) -> np.ndarray:
+        return self._with_difficulty(self.encode(past, lengths=lengths)[0], difficulty)
+
+    def head(self, h: np.ndarray, difficulty: np.ndarray) -> np.ndarray:
+        """(B,) predictions from final hidden states h (B, H)."""
+        x = self._with_difficulty(np.asarray(h, dtype=np.float32), difficulty)
+        for w, b in self.fc[:-1]:
+            x = np.maximum(x @ w + b, 0.0)
+        w, b = self.fc[-1]
+        return (x @ w + b)[:, 0]
+
+    def _trunk(self, past: np.ndarray, difficulty: np.ndarray, lengths: Optional[np.ndarray] = None) -> np.ndarray:
+        x = self._features(past, difficulty, lengths)
+        for w, b in self.fc[:-1]:
+            x = np.maximum(x @ w + b, 0.0)
+        return x
+
+    def __call__(self, past: np.ndarray, difficulty: np.ndarray, lengths: Optional[np.ndarray] = None) -> np.ndarray:
+        w, b = self.fc[-1]
+        return (self._trunk(past, difficulty, lengths) @ w + b)[:, 0]
+
+    def forward_with_quantiles(self, past: np.ndarray, difficulty: np.ndarray, lengths: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        if not self.quantiles:
+            raise ValueError("model was trained without quantile heads")
+        trunk = self._trunk(past, difficulty, lengths)
+        w, b = self.fc[-1]
+        point = (trunk @ w + b)[:, 0]
+        qw, qb = self.quantile_head
+        raw = trunk @ qw + qb
+        # Same non-crossing construction as StudentPerformanceModel.forward_with_quantiles
+        quants = np.concatenate([raw[:, :1], raw[:, :1] + np.cumsum(_softplus(raw[:, 1:]), axis=1)], axis=1)
+        return point, quants.astype(np.float32)
+
+
+def is_npz_artifact(path: str) -> bool:
+    return path.endswith('.npz')
+
+
+def save_npz(path: str, state: Dict[str, np.ndarray], meta: Dict):
+    meta = dict(meta, artifact_format=ARTIFACT_FORMAT)
+    np.savez(path, **{k: np.asarray(v, dtype=np.float32) for k, v in state.items()}, **{META_KEY: np.array(json.dumps(meta, default=str))})
+
+
+def load_npz(path: str) -> Tuple[NumpyRegressionModel, Dict]:
+    with np.load(path, allow_pickle=False) as z:
+        meta = json.loads(str(z[META_KEY]))
+        state = {k: z[k] for k in z.files if k != META_KEY}
+    return NumpyRegressionModel(state, meta), meta
+
+
+def from_checkpoint(ckpt: Dict) -> Tuple[NumpyRegressionModel, Dict]:
+    """Build from a regression checkpoint dict already loaded with ``torch.load``."""
+    if ckpt.get('model_type', 'lstm_regression') != 'lstm_regression':
+        raise ValueError("the NumPy runtime only supports lstm_regression checkpoints")
+    if ckpt.get('ensemble_states'):
+        raise ValueError("ensemble checkpoints are served by the torch backend (stacked members); the NumPy runtime runs single models")
+    state = {k: v.detach().cpu().numpy() for k, v in ckpt['model_state'].items()}
+    meta = {k: v for k, v in ckpt.items() if k != 'model_state'}
+    return NumpyRegressionModel(state, meta), meta
+
+
+def load(path: str) -> Tuple[NumpyRegressionModel, Dict]:
+    """Load an ``.npz`` (torch-free) or a ``.pt`` regression checkpoint (needs torch)."""
+    if is_npz_artifact(path):
+        return load_npz(path)
+    return from_checkpoint(_read_checkpoint(path))
+
+
+def _read_checkpoint(path: str) -> Dict:
+    try:
+        from .checkpoint import read_checkpoint  # type: ignore
+    except ImportError:  # pragma: no cover
+        sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        from ml.checkpoint import read_checkpoint  # type: ignore
+    return read_checkpoint(path)
+
+
+def parity(ckpt_path: str, model: NumpyRegressionModel, n: int = 4096, seed: int = 0) -> Dict[str, float]:
+    """Max abs difference between the torch model and ``model`` on random inputs."""
+    import torch
+    try:
+        from .lstm_regression import load_regression_model  # type: ignore
+        from .export import RegressionForward  # type: ignore
+    except ImportError:  # pragma: no cover
+        sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        from ml.lstm_regression import load_regression_model  # type: ignore
+        from ml.export import RegressionForward  # type: ignore
+    ref = RegressionForward(load_regression_model(ckpt_path)[0]).eval()
+    rng = np.random.default_rng(seed)
+    past = rng.random((n, model.seq_len), dtype=np.float32)
+    diff = rng.random((n, 1), dtype=np.float32)
+    with torch.no_grad():
+        expected = ref(torch.from_numpy(past), torch.from_numpy(diff)).numpy()
+        report = {'samples': n, 'max_abs_diff': float(np.abs(model(past, diff) - expected).max())}
+        if model.quantiles:
+            _, q_expected = ref.forward_with_quantiles(torch.from_numpy(past), torch.from_numpy(diff))
+            _, q_got = model.forward_with_quantiles(past, diff)
+            report['max_abs_quantile_diff'] = float(np.abs(q_got - q_expected.numpy()).max())
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Export a regression checkpoint to .npz for the NumPy runtime and check parity')
+    parser.add_argument('checkpoint', type=str)
+    parser.add_argument('-o', '--output', type=str, default='', help='Output path (default: <checkpoint>.npz)')
+    parser.add_argument('--tolerance', type=float, default=1e-5, help='Max allowed abs difference vs. torch (model units)')
+    parser.add_argument('--samples', type=int, default=4096)
+    args = parser.parse_args()
+    ckpt = _read_checkpoint(args.checkpoint)
+    out = args.output or os.path.splitext(args.checkpoint)[0] + '.npz'
+    _, meta = from_checkpoint(ckpt)
+    save_npz(out, {k: v.detach().cpu().numpy() for k, v in ckpt['model_state'].items()}, meta)
+    reloaded, _ = load_npz(out)
+    report = parity(args.checkpoint, reloaded, n=args.samples)
+    print(f'Exported {out}; parity: ' + ', '.join(f'{k}={v:.2e}' if isinstance(v, float) else f'{k}={v}' for k, v in report.items()))
+    worst = max(v for k, v in report.items() if k.startswith('max_abs'))
+    if worst > args.tolerance:
+        raise SystemExit(f'NumPy runtime differs from torch by {worst:.2e} (> {args.tolerance})')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,166 @@
+"""Pre-fork multi-process serving: load and warm the models once, fork the workers.
+
+``uvicorn --workers N ml.serve:app`` starts N independent interpreters. Each one
+reads and warms every checkpoint itself, and each sizes its torch thread pool
+from the whole CPU quota, so N workers oversubscribe the cores N times.
+
+Here the parent imports ``ml.serve``, loads and warms every model
+(``MODEL_CKPT`` / ``MODEL_REGISTRY`` as usual), freezes the garbage collector
+and only then forks. The workers inherit the weights copy-on-write: tensor
+storage is never written after loading, and ``gc.freeze()`` keeps the
+collector from touching (and so copying) the parent's objects. All workers
+accept connections from one listening socket.
+
+Each worker gets ``quota // workers`` intra-op threads (at least 1) and one
+inference executor thread unless ``TORCH_INTRA_OP_THREADS`` /
+``INFER_EXECUTOR_WORKERS`` are set. The parent keeps torch single-threaded while
+it loads: GNU OpenMP is not fork-safe once its thread pool has started.
+
+The parent restarts workers that exit (a re-fork is immediate, the models are
+already warm) and forwards SIGTERM / SIGINT to them for a graceful shutdown.
+Caches and ``/metrics`` are per worker. So is the student state store, and a
+student's appends would land on whichever worker accepts the connection, so
+``/predict_regression/incremental`` answers 503 with more than one worker. A
+hot reload (``MODEL_WATCH_INTERVAL_S``, ``/admin/models/<name>/reload``)
+happens in each worker separately and the new version is private to it;
+restart the pool to share a new checkpoint again.
+
+Usage:
+    MODEL_CKPT=lstm_reg.pt python -m ml.prefork --workers 4 --port 8000
+
+``python -m ml.benchmarks.workers`` compares memory per worker and throughput
+against a single process and ``uvicorn --workers``.
+"""
+import argparse
+import gc
+import math
+import os
+import signal
+import socket
+import sys
+import time
+from typing import Dict
+
+try:
+    from .runtime import configure_torch_threads, cpu_quota  # type: ignore
+except ImportError:  # pragma: no cover
+    current_dir = os.path.dirname(os.path.abspath(__file__))
+    parent_dir = os.path.dirname(current_dir)
+    if parent_dir not in sys.path:
+        sys.path.append(parent_dir)
+    from ml.runtime import configure_torch_threads, cpu_quota  # type: ignore
+
+
+def worker_threads(workers: int, cpus: float = None) -> Dict[str, int]:
+    """Worker count and per-worker thread limits so workers x threads matches the CPU quota."""
+    cores = max(1, math.floor(cpus if cpus is not None else cpu_quota()))
+    workers = workers or cores
+    executor = int(os.environ.get('INFER_EXECUTOR_WORKERS', '').strip() or 1)
+    intra = int(os.environ.get('TORCH_INTRA_OP_THREADS', '').strip() or max(1, cores // (workers * executor)))
+    return {'cpus': cores, 'workers': workers, 'executor_workers': executor, 'intra_op_threads': intra}
+
+
+def _listen(host: str, port: int, backlog: int) -> socket.socket:
+    family = socket.AF_INET6 if ':' in host else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    sock.set_inheritable(True)
+    return sock
+
+
+def _run_worker(serve, sock: socket.socket, threads: Dict[str, int], log_level: str):
+    import uvicorn
+    gc.enable()
+    serve._THREADS['intra_op_threads'] = threads['intra_op_threads']
+    if serve.torch is not None:
+        configure_torch_threads(threads['intra_op_threads'], serve._THREADS['inter_op_threads'])
+    config = uvicorn.Config(serve.app, log_level=log_level, access_log=False)
+    uvicorn.Server(config).run(sockets=[sock])
+
+
+def run(host: str, port: int, workers: int, backlog: int = 2048, log_level: str = 'info'):
+    threads = worker_threads(workers)
+    # ml.serve reads its thread configuration at import time; load single-threaded,
+    # the workers switch to their own limit after the fork
+    os.environ['INFER_EXECUTOR_WORKERS'] = str(threads['executor_workers'])
+    os.environ['TORCH_INTRA_OP_THREADS'] = '1'
+    gc.disable()
+    try:
+        from . import serve  # type: ignore
+    except ImportError:  # pragma: no cover
+        import ml.serve as serve  # type: ignore
+    started = time.perf_counter()
+    serve._load_on_start()
+    serve._WORKER_PROCESSES = threads['workers']
+    gc.collect()
+    gc.freeze()
+    sock = _listen(host, port, backlog)
+    print(f"prefork: models loaded in {time.perf_counter() - started:.2f}s; {threads['workers']} worker(s) x "
+          f"{threads['intra_op_threads']} thread(s) on {threads['cpus']} CPU(s), listening on {host}:{port}", flush=True)
+
+    children: Dict[int, int] = {}
+    stopping = False
+
+    def spawn(slot: int):
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                signal.signal(signal.SIGTERM, signal.SIG_DFL)
+                signal.signal(signal.SIGINT, signal.SIG_DFL)
+                _run_worker(serve, sock, threads, log_level)
+            except BaseException:
+                import traceback
+                traceback.print_exc()
+                code = 1
+            finally:
+                sys.stdout.flush()
+                sys.stderr.flush()
+                os._exit(code)
+        children[pid] = slot
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in list(children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    for slot in range(threads['workers']):
+        spawn(slot)
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        slot = children.pop(pid, None)
+        if slot is None or stopping:
+            continue
+        print(f"prefork: worker {pid} exited with status {os.waitstatus_to_exitcode(status)}; restarting", flush=True)
+        # Do not spin if a worker fails right after starting
+        time.sleep(1.0)
+        if not stopping:
+            spawn(slot)
+    sock.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve ml.serve from pre-forked workers sharing the loaded models')
+    parser.add_argument('--host', type=str, default=os.environ.get('HOST', '0.0.0.0'))
+    parser.add_argument('--port', type=int, default=int(os.environ.get('PORT', '8000')))
+    parser.add_argument('--workers', type=int, default=int(os.environ.get('PREFORK_WORKERS', '0')),
+                        help='Worker processes (default: one per CPU of the quota)')
+    parser.add_argument('--backlog', type=int, default=2048)
+    parser.add_argument('--log-level', type=str, default='info')
+    args = parser.parse_args()
+    run(args.host, args.port, args.workers, backlog=args.backlog, log_level=args.log_level)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,168 @@
+"""Vectorised request preprocessing shared by the serving endpoints.
+
+Each function takes the checkpoint metadata plus N raw rows and returns dense
+float32 arrays for the whole batch, along with a per-row error message (None for
+valid rows). Invalid rows are zero-filled so callers can still run one forward
+pass over the batch and drop them afterwards.
+"""
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+
+
+def _seq_len(meta) -> int:
+    return meta.get('seq_len', 10) or 10
+
+
+def _stack_grades(seq_len: int, past_rows: Sequence[Sequence[float]], errors: List[Optional[str]], variable_length: bool = False) -> Tuple[np.ndarray, np.ndarray]:
+    """(N, seq_len) grades plus (N,) history lengths.
+
+    With ``variable_length`` any history of 1..seq_len grades is accepted and
+    stored left-aligned with zero padding after it.
+    """
+    n = len(past_rows)
+    grades = np.zeros((n, seq_len), dtype=np.float32)
+    lengths = np.full(n, seq_len, dtype=np.int64)
+    ok = []
+    short = []
+    for i, row in enumerate(past_rows):
+        if len(row) == seq_len:
+            ok.append(i)
+        elif variable_length and 1 <= len(row) < seq_len:
+            short.append(i)
+        elif variable_length:
+            errors[i] = f"past_grades length {len(row)} must be between 1 and seq_len {seq_len}"
+        else:
+            errors[i] = f"past_grades length {len(row)} does not match expected seq_len {seq_len}"
+    if ok:
+        if len(ok) == n:
+            grades[:] = np.asarray(past_rows, dtype=np.float32)
+        else:
+            grades[ok] = np.asarray([past_rows[i] for i in ok], dtype=np.float32)
+    for i in short:
+        lengths[i] = len(past_rows[i])
+        grades[i, :lengths[i]] = past_rows[i]
+    return grades, lengths
+
+
+def _difficulty_column(difficulties: Sequence[Optional[float]]) -> np.ndarray:
+    return np.asarray([np.nan if d is None else d for d in difficulties], dtype=np.float32)
+
+
+def _scale_rows(grades: np.ndarray) -> np.ndarray:
+    # Rows already on a 0-1 scale are left untouched, mirroring the single-row heuristic
+    if grades.size == 0:
+        return grades
+    needs = grades.max(axis=1) > 1.0
+    grades[needs] /= 100.0
+    return grades
+
+
+def regression_inputs(meta, past_rows: Sequence[Sequence[float]], difficulties: Sequence[Optional[float]]) -> Tuple[np.ndarray, np.ndarray, np.ndarray, List[Optional[str]], bool, bool]:
+    """Build (N, seq_len) grades, (N, 1) difficulty and (N,) history lengths for the LSTM regressor.
+
+    Checkpoints trained with ``--variable-length`` accept 1..seq_len grades per
+    row; the others need exactly seq_len.
+    """
+    errors: List[Optional[str]] = [None] * len(past_rows)
+    grades, lengths = _stack_grades(_seq_len(meta), past_rows, errors, variable_length=bool(meta.get('variable_length', False)))
+    scale_grades = bool(meta.get('scale_grades', False))
+    if scale_grades:
+        grades = _scale_rows(grades)
+    use_diff = bool(meta.get('use_difficulty', False))
+    diff = np.zeros((len(past_rows), 1), dtype=np.float32)
+    if use_diff:
+        raw = _difficulty_column(difficulties)
+        missing = np.isnan(raw)
+        for i in np.flatnonzero(missing):
+            if errors[i] is None:
+                errors[i] = "difficulty is required by this regression model"
+        diff[:, 0] = np.where(missing, 0.0, (raw - 1.0) / 9.0)
+    return grades, diff, lengths, errors, scale_grades, use_diff
+
+
+def sweep_inputs(meta, past: Sequence[float], scenarios: Sequence[Sequence[float]], difficulties: Sequence[float]) -> Tuple[np.ndarray, np.ndarray, np.ndarray, Optional[str], bool, bool]:
+    """Inputs for a what-if grid: one history, S sets of appended grades, D difficulties.
+
+    Returns (S, T) left-aligned windows holding the last seq_len grades of
+    ``past`` + each scenario, their (S,) lengths and the (D, 1) normalised
+    difficulties; the caller crosses windows with difficulties. Appended grades
+    must be on the same scale as ``past``.
+    """
+    errors: List[Optional[str]] = [None]
+    seq_len = _seq_len(meta)
+    _stack_grades(seq_len, [past], errors, variable_length=bool(meta.get('variable_length', False)))
+    error = errors[0]
+    values = np.concatenate([np.asarray(past, dtype=np.float32)] + [np.asarray(s, dtype=np.float32) for s in scenarios])
+    if error is None and values.size and (not np.isfinite(values).all() or values.min() < 0.0 or values.max() > 100.0):
+        error = "grades must be between 0 and 100"
+    histories = [list(past) + list(s) for s in scenarios]
+    lengths = np.asarray([min(len(h), seq_len) for h in histories], dtype=np.int64)
+    windows = np.zeros((len(histories), int(lengths.max()) if len(histories) else seq_len), dtype=np.float32)
+    for i, h in enumerate(histories):
+        windows[i, :lengths[i]] = h[len(h) - lengths[i]:]
+    scale_grades = bool(meta.get('scale_grades', False))
+    # Same scale heuristic as regression_inputs, decided once from the real history
+    if scale_grades and len(past) and max(past) > 1.0:
+        windows /= 100.0
+    use_diff = bool(meta.get('use_difficulty', False))
+    diff = ((np.asarray(difficulties, dtype=np.float32) - 1.0) / 9.0).reshape(-1, 1)
+    if not use_diff:
+        diff = np.zeros_like(diff)
+    return windows, lengths, diff, error, scale_grades, use_diff
+
+
+def length_buckets(lengths: np.ndarray, width: int = 1) -> List[np.ndarray]:
+    """Row indices grouped into buckets of ``width`` consecutive history lengths.
+
+    Rows in a bucket are padded only up to the bucket's longest row, so width 1
+    runs every row unpadded at the cost of one forward pass per distinct length.
+    """
+    keys = (np.asarray(lengths) - 1) // width
+    if len(keys) == 0 or (keys == keys[0]).all():
+        return [np.arange(len(keys))]
+    order = np.argsort(keys, kind='stable')
+    return np.split(order, np.flatnonzero(np.diff(keys[order])) + 1)
+
+
+def classification_inputs(meta, past_rows: Sequence[Sequence[float]], difficulties: Sequence[Optional[float]]) -> Tuple[np.ndarray, List[Optional[str]]]:
+    """Build the (N, F) feature matrix expected by ConvClassifier checkpoints."""
+    errors: List[Optional[str]] = [None] * len(past_rows)
+    grades, _ = _stack_grades(_seq_len(meta), past_rows, errors)
+    args = meta.get('args', {})
+    # Grade scaling is only recorded in the training args of classifier checkpoints
+    if meta.get('feature_columns') and args.get('scale_grades', False):
+        grades = _scale_rows(grades)
+    if not args.get('add_difficulty', False):
+        return grades, errors
+    raw = _difficulty_column(difficulties)
+    missing = np.isnan(raw)
+    for i in np.flatnonzero(missing):
+        if errors[i] is None:
+            errors[i] = "difficulty is required by this model"
+    diff = np.where(missing, 0.0, (raw - 1.0) / 9.0).astype(np.float32)
+    return np.concatenate([grades, diff[:, None]], axis=1), errors
+
+
+def history_inputs(meta, grades: Sequence[float], difficulty: Optional[float]) -> Tuple[np.ndarray, np.ndarray, Optional[str], bool, bool]:
+    """(1, T) grades of any length T and (1, 1) difficulty for stateful regression.
+
+    Incremental requests carry a few grades at a time, too few for the row-max
+    scale heuristic, so grades must be on the 0-100 scale and are divided by 100
+    whenever the checkpoint was trained on scaled grades.
+    """
+    error = None
+    past = np.asarray(grades, dtype=np.float32).reshape(1, -1)
+    if past.size and (not np.isfinite(past).all() or past.min() < 0.0 or past.max() > 100.0):
+        error = "grades must be between 0 and 100"
+    scale_grades = bool(meta.get('scale_grades', False))
+    if scale_grades:
+        past = past / 100.0
+    use_diff = bool(meta.get('use_difficulty', False))
+    diff = np.zeros((1, 1), dtype=np.float32)
+    if use_diff:
+        if difficulty is None:
+            error = error or "difficulty is required by this regression model"
+        else:
+            diff[0, 0] = (difficulty - 1.0) / 9.0
+    return past, diff, error, scale_grades, use_diff
@@ -0,0 +1,82 @@
+"""Dynamic INT8 quantization with an accuracy gate.
+
+``quantize_dynamic_int8`` converts the LSTM and Linear layers to int8 weights
+with dynamically quantized activations (CPU only). ConvClassifier keeps its
+Conv1d layers in float because dynamic quantization does not cover
+convolutions; its Linear head is quantized.
+
+``verify`` scores the float and quantized models on a held-out synthetic set
+(drawn with a seed the trainers never use) and ``check_drift`` refuses the
+quantized model if regression MAE grows, or classification accuracy drops,
+by more than the allowed amount.
+"""
+import importlib
+from typing import Dict
+
+import numpy as np
+import torch
+import torch.nn as nn
+
+try:
+    from .preprocess import classification_inputs, regression_inputs  # type: ignore
+except ImportError:  # pragma: no cover
+    from ml.preprocess import classification_inputs, regression_inputs  # type: ignore
+
+HOLDOUT_SEED = 20250914
+
+
+class QuantizationDriftError(RuntimeError):
+    """The quantized model drifted too far from the float model."""
+
+
+def quantize_dynamic_int8(model: nn.Module) -> nn.Module:
+    return torch.ao.quantization.quantize_dynamic(model, {nn.LSTM, nn.Linear}, dtype=torch.qint8)
+
+
+def _holdout(meta: Dict, is_regression: bool, n: int, seed: int):
+    data_mod = importlib.import_module('.data', __package__ or 'ml')
+    raw = data_mod.generate_student_arrays(n_samples=n, seed=seed, seq_len=meta.get('seq_len', 10) or 10)
+    grades, difficulty, target = raw['past_grades'], raw['difficulty'].astype(np.float32), raw['current_grade']
+    if is_regression:
+        past, diff, _, _, scaled, _ = regression_inputs(meta, grades, difficulty)
+        return (torch.from_numpy(past), torch.from_numpy(diff)), target, scaled
+    x, _ = classification_inputs(meta, grades, difficulty)
+    bins = data_mod.bucket_bins(ten_class=meta.get('num_classes') == 10, bucket_5=meta.get('num_classes') == 5)
+    return (torch.from_numpy(x),), data_mod.bucketize(target, bins), False
+
+
+def verify(float_model: nn.Module, quant_model: nn.Module, meta: Dict, is_regression: bool, n: int = 2000, seed: int = HOLDOUT_SEED) -> Dict[str, float]:
+    """Compare float and quantized models on ``n`` held-out synthetic students."""
+    inputs, target, scaled = _holdout(meta, is_regression, n, seed)
+    with torch.no_grad():
+        out_f = float_model(*inputs)
+        out_q = quant_model(*inputs)
+    if is_regression:
+        factor = 100.0 if scaled else 1.0
+        pred_f = np.clip(out_f.numpy() * factor, 0, 100)
+        pred_q = np.clip(out_q.numpy() * factor, 0, 100)
+        mae_f = float(np.abs(pred_f - target).mean())
+        mae_q = float(np.abs(pred_q - target).mean())
+        return {'samples': n, 'float_mae': mae_f, 'quant_mae': mae_q, 'mae_drift': mae_q - mae_f,
+                'max_abs_pred_diff': float(np.abs(pred_f - pred_q).max())}
+    cls_f = out_f.argmax(dim=1).numpy()
+    cls_q = out_q.argmax(dim=1).numpy()
+    acc_f = float((cls_f == target).mean())
+    acc_q = float((cls_q == target).mean())
+    return {'samples': n, 'float_acc': acc_f, 'quant_acc': acc_q, 'acc_drop': acc_f - acc_q,
+            'agreement': float((cls_f == cls_q).mean())}
+
+
+def check_drift(report: Dict[str, float], max_mae_drift: float, max_acc_drop: float):
+    if 'mae_drift' in report and report['mae_drift'] > max_mae_drift:
+        raise QuantizationDriftError(f"INT8 model MAE drift {report['mae_drift']:.3f} exceeds {max_mae_drift} grade points")
+    if 'acc_drop' in report and report['acc_drop'] > max_acc_drop:
+        raise QuantizationDriftError(f"INT8 model accuracy drop {report['acc_drop']:.4f} exceeds {max_acc_drop}")
+
+
+def quantize_verified(model: nn.Module, meta: Dict, is_regression: bool, max_mae_drift: float = 0.5, max_acc_drop: float = 0.01, n: int = 2000):
+    """Quantize ``model`` and return (quantized model, report); raises QuantizationDriftError on drift."""
+    quant = quantize_dynamic_int8(model).eval()
+    report = verify(model, quant, meta, is_regression, n=n)
+    check_drift(report, max_mae_drift, max_acc_drop)
+    return quant, report
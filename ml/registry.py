@@ -0,0 +1,248 @@
+"""Named, versioned models with background reload and atomic swap.
+
+The registry holds one current ``ModelEntry`` per name plus up to
+``keep_versions - 1`` previous versions, so clients can pin ``name@version``
+across a deploy. Reloads run the loader on a worker thread; the new entry is
+published under a lock only after it loaded successfully, so requests keep
+being served by the old version until the swap and a failed load leaves it in
+place. Requests already holding an entry finish on it; an evicted entry's
+micro-batcher is closed once its queue has drained.
+
+The loader (``ml/serve.py`` supplies it) builds a ``ModelEntry`` from a name
+and a checkpoint path; the registry never looks inside models.
+"""
+import asyncio
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+
+class ModelEntry:
+    """One loaded model version. ``model`` / ``meta`` are whatever the loader produced."""
+
+    def __init__(self, name: str, path: str, model: Any, meta: Dict, is_regression: bool, backend: str, fingerprint: str):
+        self.name = name
+        self.path = path
+        self.model = model
+        self.meta = meta
+        self.is_regression = is_regression
+        self.backend = backend
+        self.fingerprint = fingerprint
+        self.version = 0
+        self.loaded_at = time.time()
+        self.batcher = None
+        # Regression models whose forward takes per-row history lengths (eager and NumPy, not TorchScript)
+        self.supports_lengths = False
+        self.timings: Dict[str, float] = {}
+
+    @property
+    def model_type(self) -> str:
+        return 'lstm_regression' if self.is_regression else 'classification'
+
+    def describe(self) -> Dict[str, Any]:
+        return {
+            'name': self.name,
+            'version': self.version,
+            'model_type': self.model_type,
+            'backend': self.backend,
+            'checkpoint': self.fingerprint,
+            'path': self.path,
+            'loaded_at': self.loaded_at,
+            'seq_len': self.meta.get('seq_len', 10) or 10,
+            'variable_length': bool(self.meta.get('variable_length', False)),
+            'ensemble_size': int(self.meta.get('ensemble_size', 0) or 0),
+            'quantiles': [float(q) for q in self.meta.get('quantiles') or []],
+            'num_classes': 0 if self.is_regression else self.meta.get('num_classes', 0),
+            'timings': dict(self.timings),
+        }
+
+
+def parse_model_specs(spec: str) -> Dict[str, str]:
+    """``"reg=/app/lstm_reg.pt,clf=/app/clf.ts"`` -> {name: path}."""
+    specs: Dict[str, str] = {}
+    for part in spec.split(','):
+        part = part.strip()
+        if not part:
+            continue
+        name, sep, path = part.partition('=')
+        if not sep or not name.strip() or not path.strip():
+            raise ValueError(f"invalid model spec {part!r}; expected name=path")
+        specs[name.strip()] = path.strip()
+    return specs
+
+
+def parse_model_ref(ref: str) -> Tuple[str, Optional[int]]:
+    """``"name"`` or ``"name@version"``."""
+    name, sep, version = ref.partition('@')
+    if not sep:
+        return name, None
+    try:
+        return name, int(version)
+    except ValueError:
+        raise ValueError(f"invalid model version in {ref!r}")
+
+
+def _file_state(path: str) -> Optional[Tuple[int, int]]:
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_mtime_ns, st.st_size
+
+
+class ModelRegistry:
+    def __init__(self, loader: Callable[[str, str], ModelEntry], keep_versions: int = 2,
+                 fingerprint: Optional[Callable[[str], str]] = None, on_retire: Optional[Callable[[ModelEntry], None]] = None):
+        if keep_versions < 1:
+            raise ValueError('keep_versions must be >= 1')
+        self.loader = loader
+        self.keep_versions = keep_versions
+        self.fingerprint = fingerprint
+        self.on_retire = on_retire
+        self.default: Optional[str] = None
+        self._paths: Dict[str, str] = {}
+        self._current: Dict[str, ModelEntry] = {}
+        self._versions: Dict[str, 'OrderedDict[int, ModelEntry]'] = {}
+        self._next_version: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._load_locks: Dict[str, threading.Lock] = {}
+        self._watch_task: Optional[asyncio.Task] = None
+        self.reloads = 0
+        self.failed_reloads = 0
+        self.last_error: Optional[str] = None
+
+    # Lookup
+
+    def names(self) -> List[str]:
+        return list(self._current)
+
+    def get(self, name: Optional[str] = None, version: Optional[int] = None) -> Optional[ModelEntry]:
+        name = name or self.default
+        with self._lock:
+            if version is None:
+                return self._current.get(name)
+            return self._versions.get(name, {}).get(version)
+
+    def entries(self) -> List[ModelEntry]:
+        with self._lock:
+            return list(self._current.values())
+
+    def describe(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            out = []
+            for name, entry in self._current.items():
+                info = entry.describe()
+                info['default'] = name == self.default
+                info['versions'] = list(self._versions[name])
+                out.append(info)
+            return out
+
+    # Loading
+
+    def load(self, name: str, path: str) -> Tuple[ModelEntry, List[ModelEntry]]:
+        """Load ``path`` as the new current version of ``name`` (blocking).
+
+        Returns the new entry and the entries evicted by the swap; the caller
+        retires those (see ``retire``). Concurrent loads of one name are serialised.
+        """
+        with self._lock:
+            load_lock = self._load_locks.setdefault(name, threading.Lock())
+        with load_lock:
+            entry = self.loader(name, path)
+            with self._lock:
+                entry.version = self._next_version.get(name, 1)
+                self._next_version[name] = entry.version + 1
+                versions = self._versions.setdefault(name, OrderedDict())
+                versions[entry.version] = entry
+                evicted = []
+                while len(versions) > self.keep_versions:
+                    evicted.append(versions.popitem(last=False)[1])
+                self._paths[name] = path
+                self._current[name] = entry
+                if self.default is None:
+                    self.default = name
+            return entry, evicted
+
+    async def reload(self, name: str, path: Optional[str] = None, force: bool = False) -> ModelEntry:
+        """Load a new version of ``name`` off the event loop and swap it in.
+
+        Without ``path`` the model's current file is reloaded. Unless ``force``,
+        an unchanged file (same fingerprint) keeps the current version.
+        """
+        path = path or self._paths.get(name)
+        if not path:
+            raise KeyError(name)
+        loop = asyncio.get_running_loop()
+        current = self.get(name)
+        try:
+            if current is not None and not force and self.fingerprint is not None:
+                if await loop.run_in_executor(None, self.fingerprint, path) == current.fingerprint:
+                    return current
+            entry, evicted = await loop.run_in_executor(None, self.load, name, path)
+        except Exception as e:
+            self.failed_reloads += 1
+            self.last_error = f'{name}: {e}'
+            raise
+        self.reloads += 1
+        await self.retire(evicted)
+        return entry
+
+    async def retire(self, entries: List[ModelEntry]):
+        for entry in entries:
+            if entry.batcher is not None:
+                await entry.batcher.close()
+            if self.on_retire is not None:
+                self.on_retire(entry)
+
+    # File watching
+
+    async def watch(self, interval_s: float):
+        """Reload a model when its file changes; a change must hold still for one interval."""
+        seen = {name: _file_state(path) for name, path in self._paths.items()}
+        pending: Dict[str, Tuple[int, int]] = {}
+        while True:
+            await asyncio.sleep(interval_s)
+            for name, path in list(self._paths.items()):
+                state = _file_state(path)
+                if state is None or state == seen.get(name):
+                    pending.pop(name, None)
+                    continue
+                if pending.get(name) != state:
+                    # Still being written (or first sighting): check again next tick
+                    pending[name] = state
+                    continue
+                pending.pop(name, None)
+                seen[name] = state
+                before = self.get(name)
+                try:
+                    entry = await self.reload(name, path)
+                    if entry is not before:
+                        print(f'Model {name!r} now at version {entry.version} ({entry.fingerprint})')
+                except Exception as e:
+                    print(f'Reload of model {name!r} from {path} failed, keeping current version: {e}')
+
+    def start_watching(self, interval_s: float):
+        if interval_s > 0 and self._watch_task is None:
+            self._watch_task = asyncio.get_running_loop().create_task(self.watch(interval_s))
+
+    async def stop_watching(self):
+        if self._watch_task is not None:
+            self._watch_task.cancel()
+            try:
+                await self._watch_task
+            except asyncio.CancelledError:
+                pass
+            self._watch_task = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'models': len(self._current),
+            'default': self.default,
+            'keep_versions': self.keep_versions,
+            'reloads': self.reloads,
+            'failed_reloads': self.failed_reloads,
+            'last_error': self.last_error,
+            'watching': self._watch_task is not None,
+        }
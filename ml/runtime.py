@@ -0,0 +1,111 @@
+"""CPU sizing and the bounded executor used to keep inference off the event loop.
+
+Thread counts come from the environment when set, otherwise from the CPU quota
+of the container (cgroup v2 ``cpu.max`` / cgroup v1 CFS quota, then CPU
+affinity):
+
+    INFER_EXECUTOR_WORKERS   concurrent forward passes (default 1)
+    INFER_MAX_PENDING        queued + running inference jobs before rejecting (default 64)
+    TORCH_INTRA_OP_THREADS   threads per forward pass (default quota // executor workers)
+    TORCH_INTER_OP_THREADS   torch inter-op pool size (default 1)
+
+One worker with all cores per forward gives the lowest latency per batch;
+several workers with fewer threads each trade per-request latency for
+throughput when batches are small. ``python -m ml.benchmarks.threads`` measures
+both for a given box.
+"""
+import math
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, Optional
+
+
+class ExecutorSaturated(RuntimeError):
+    """Raised when more than ``max_pending`` inference jobs are outstanding."""
+
+
+def cpu_quota() -> float:
+    """CPUs available to this process, honouring cgroup CPU limits."""
+    try:
+        with open('/sys/fs/cgroup/cpu.max') as f:
+            quota, period = f.read().split()[:2]
+        if quota != 'max':
+            return max(0.01, int(quota) / int(period))
+    except (OSError, ValueError):
+        pass
+    try:
+        with open('/sys/fs/cgroup/cpu/cpu.cfs_quota_us') as f:
+            quota_us = int(f.read())
+        with open('/sys/fs/cgroup/cpu/cpu.cfs_period_us') as f:
+            period_us = int(f.read())
+        if quota_us > 0 and period_us > 0:
+            return max(0.01, quota_us / period_us)
+    except (OSError, ValueError):
+        pass
+    try:
+        return float(len(os.sched_getaffinity(0)))
+    except AttributeError:  # pragma: no cover - not available on macOS
+        return float(os.cpu_count() or 1)
+
+
+def _env_int(name: str) -> Optional[int]:
+    raw = os.environ.get(name, '').strip()
+    return int(raw) if raw else None
+
+
+def thread_config(cpus: Optional[float] = None) -> Dict[str, int]:
+    """Resolve executor / torch thread counts from env vars and the CPU quota."""
+    cores = max(1, math.floor(cpus if cpus is not None else cpu_quota()))
+    workers = _env_int('INFER_EXECUTOR_WORKERS') or 1
+    intra = _env_int('TORCH_INTRA_OP_THREADS') or max(1, cores // workers)
+    inter = _env_int('TORCH_INTER_OP_THREADS') or 1
+    pending = _env_int('INFER_MAX_PENDING') or 64
+    return {'cpus': cores, 'executor_workers': workers, 'intra_op_threads': intra, 'inter_op_threads': inter, 'max_pending': pending}
+
+
+def configure_torch_threads(intra: int, inter: int):
+    import torch
+    torch.set_num_threads(intra)
+    try:
+        torch.set_num_interop_threads(inter)
+    except RuntimeError:
+        # Can only be set once, before any inter-op parallel work has started
+        pass
+
+
+class BoundedExecutor:
+    """Thread pool that rejects work instead of queueing without limit."""
+
+    def __init__(self, max_workers: int, max_pending: int, name: str = 'infer'):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=name)
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    @property
+    def pending(self) -> int:
+        return self._pending
+
+    def submit(self, fn: Callable, *args) -> Future:
+        if not self._slots.acquire(blocking=False):
+            raise ExecutorSaturated(f'more than {self.max_pending} inference jobs pending')
+        with self._lock:
+            self._pending += 1
+        try:
+            fut = self._pool.submit(fn, *args)
+        except Exception:
+            self._release(None)
+            raise
+        fut.add_done_callback(self._release)
+        return fut
+
+    def _release(self, _):
+        with self._lock:
+            self._pending -= 1
+        self._slots.release()
+
+    def shutdown(self, wait: bool = True):
+        self._pool.shutdown(wait=wait)
@@ -1,29 +1,48 @@
+import time
+_IMPORT_STARTED = time.perf_counter()
+
+import asyncio
+import functools
+import hmac
+import importlib
+import math
 import os
 import sys
-from typing import List, Optional
+import weakref
+from typing import Any, Dict, List, Optional
 
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, Header, HTTPException, Response
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel, Field
-import torch
+import numpy as np
 import uvicorn
 
 try:
-    from . import data as data_mod  # type: ignore
-    from .model import load_model, ConvClassifier  # type: ignore
-    from .lstm_regression import load_regression_model  # type: ignore
+    from .batching import MicroBatcher  # type: ignore
+    from .registry import ModelEntry, ModelRegistry, parse_model_ref, parse_model_specs  # type: ignore
+    from .metrics import CONTENT_TYPE, SIZE_BUCKETS, MetricsMiddleware, MetricsRegistry, current_timer, timed_endpoint  # type: ignore
+    from .cache import PredictionCache, file_fingerprint  # type: ignore
+    from .runtime import BoundedExecutor, ExecutorSaturated, configure_torch_threads, thread_config  # type: ignore
+    from .preprocess import classification_inputs, history_inputs, length_buckets, regression_inputs, sweep_inputs  # type: ignore
+    from .state_store import StateStore, StudentState  # type: ignore
+    from . import numpy_runtime  # type: ignore
 except ImportError:  # pragma: no cover
     current_dir = os.path.dirname(os.path.abspath(__file__))
     parent_dir = os.path.dirname(current_dir)
     if parent_dir not in sys.path:
         sys.path.append(parent_dir)
-    import ml.data as data_mod  # type: ignore
-    from ml.model import load_model, ConvClassifier  # type: ignore
-    from ml.lstm_regression import load_regression_model  # type: ignore
+    from ml.batching import MicroBatcher  # type: ignore
+    from ml.registry import ModelEntry, ModelRegistry, parse_model_ref, parse_model_specs  # type: ignore
+    from ml.metrics import CONTENT_TYPE, SIZE_BUCKETS, MetricsMiddleware, MetricsRegistry, current_timer, timed_endpoint  # type: ignore
+    from ml.cache import PredictionCache, file_fingerprint  # type: ignore
+    from ml.runtime import BoundedExecutor, ExecutorSaturated, configure_torch_threads, thread_config  # type: ignore
+    from ml.preprocess import classification_inputs, history_inputs, length_buckets, regression_inputs, sweep_inputs  # type: ignore
+    from ml.state_store import StateStore, StudentState  # type: ignore
+    import ml.numpy_runtime as numpy_runtime  # type: ignore
 
 
 class PredictRequest(BaseModel):
-    past_grades: List[float] = Field(..., description="List of past grades (length must match model seq_len, default 10)")
+    past_grades: List[float] = Field(..., description="List of past grades, oldest first (length must match model seq_len, default 10; 1..seq_len for variable-length regression models)")
     difficulty: Optional[float] = Field(None, description="Difficulty level 1-10 (optional if model not trained with difficulty)")
 
 class PredictResponse(BaseModel):
@@ -37,11 +56,124 @@ class PredictRegressionResponse(BaseModel):
     model_scaled: bool
     used_difficulty: bool
 
+class ExceedanceRequest(PredictRequest):
+    thresholds: List[float] = Field(..., description="Grade thresholds (0-100); returns P(grade >= threshold) for each")
+
+class QuantileValue(BaseModel):
+    level: float
+    grade: float
+
+class ThresholdProbability(BaseModel):
+    threshold: float
+    probability: float
+
+class ExceedanceResponse(BaseModel):
+    predicted_grade: float
+    quantiles: List[QuantileValue]
+    exceedance: List[ThresholdProbability]
+
+class IncrementalRequest(BaseModel):
+    student: str = Field(..., min_length=1, description="Student key; the server keeps this student's LSTM state between requests")
+    grades: List[float] = Field(default_factory=list, description="New grades (0-100), oldest first, appended to the student's history")
+    difficulty: Optional[float] = Field(None, description="Difficulty level 1-10 of the assessment being predicted")
+    history: Optional[List[float]] = Field(None, description="Grades (0-100) already seen before `grades`; rebuilds the state when none is stored or its length differs")
+    reset: bool = Field(False, description="Discard the stored state and start from `history` (empty if omitted)")
+
+class IncrementalResponse(PredictRegressionResponse):
+    student: str
+    history_length: int
+    state_source: str
+
+class EnsembleRequest(PredictRequest):
+    thresholds: List[float] = Field(default_factory=list, description="Grade thresholds (0-100); returns the share of members predicting at least each")
+
+class EnsembleResponse(BaseModel):
+    predicted_grade: float
+    rounded_grade: int
+    std: float
+    members: List[float]
+    exceedance: List[ThresholdProbability]
+    model_scaled: bool
+    used_difficulty: bool
+
+class SweepRequest(BaseModel):
+    past_grades: List[float] = Field(..., description="The student's history, oldest first (same length rules as /predict_regression)")
+    difficulty_min: float = Field(1.0, description="First difficulty of the grid")
+    difficulty_max: float = Field(10.0, description="Last difficulty of the grid (inclusive)")
+    difficulty_step: float = Field(1.0, ge=0.001, description="Spacing between grid difficulties (at least 0.001)")
+    scenarios: List[List[float]] = Field(default_factory=lambda: [[]], description="Hypothetical upcoming grades appended to the history, one list per scenario; [] is the history as is")
+
+class SweepScenario(BaseModel):
+    appended_grades: List[float]
+    predicted_grades: List[float]
+
+class SweepResponse(BaseModel):
+    difficulties: List[float]
+    scenarios: List[SweepScenario]
+    model_scaled: bool
+    used_difficulty: bool
+
+class BatchPredictRequest(BaseModel):
+    rows: List[PredictRequest] = Field(..., description="Rows to score; each row is validated and scored independently")
+
+class BatchPredictItem(BaseModel):
+    index: int
+    result: Optional[PredictResponse] = None
+    error: Optional[str] = None
+
+class BatchPredictResponse(BaseModel):
+    results: List[BatchPredictItem]
+    num_ok: int
+    num_failed: int
+
+class BatchPredictRegressionItem(BaseModel):
+    index: int
+    result: Optional[PredictRegressionResponse] = None
+    error: Optional[str] = None
+
+class BatchPredictRegressionResponse(BaseModel):
+    results: List[BatchPredictRegressionItem]
+    num_ok: int
+    num_failed: int
+
 class HealthResponse(BaseModel):
     status: str
     model_type: str
+    backend: str
     num_classes: int
     seq_len: int
+    checkpoint: str = ''
+    model: str = ''
+    version: int = 0
+    runtime: Optional[Dict[str, Any]] = None
+    batching: Optional[Dict[str, Any]] = None
+    cache: Optional[Dict[str, Any]] = None
+    quantization: Optional[Dict[str, Any]] = None
+    registry: Optional[Dict[str, Any]] = None
+    state_store: Optional[Dict[str, Any]] = None
+    models: Optional[List[Dict[str, Any]]] = None
+    startup: Optional[Dict[str, float]] = None
+
+class ModelInfo(BaseModel):
+    name: str
+    version: int
+    model_type: str
+    backend: str
+    checkpoint: str
+    path: str
+    loaded_at: float
+    seq_len: int
+    num_classes: int
+    variable_length: bool = False
+    ensemble_size: int = 0
+    quantiles: List[float] = []
+    default: bool = False
+    versions: List[int] = []
+    timings: Dict[str, float] = {}
+
+class ReloadRequest(BaseModel):
+    path: Optional[str] = Field(None, description="Checkpoint to load; defaults to the model's current file. A new name registers a new model.")
+    force: bool = Field(False, description="Reload even if the file's fingerprint is unchanged")
 
 app = FastAPI(title="Grade Bucket Prediction API", version="1.0.0")
 
@@ -54,96 +186,482 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-_MODEL = None  # Loaded torch.nn.Module
-_META = None   # Raw checkpoint dictionary
-_DEVICE = 'cuda' if torch.cuda.is_available() else 'cpu'
-_IS_REGRESSION = False
+# Prometheus metrics at /metrics (METRICS_ENABLED=0 drops the middleware; stage timers stay, they are cheap)
+_METRICS = MetricsRegistry(prefix='infer_')
+if os.environ.get('METRICS_ENABLED', '1') != '0':
+    app.add_middleware(MetricsMiddleware, registry=_METRICS)
+_STAGE = _METRICS.histogram('stage_seconds', 'Time per inference stage (preprocess, queue_wait, transfer_in, forward, transfer_out, batch)', ('model', 'stage'))
+_BATCH_ROWS = _METRICS.histogram('batch_rows', 'Rows per forward pass from the micro-batcher', ('model',), buckets=SIZE_BUCKETS)
 
+# Named models: MODEL_REGISTRY="reg=/app/lstm_reg.pt,clf=/app/clf.ts" and/or MODEL_CKPT (registered as
+# 'default'). Requests pick one with ?model=name or ?model=name@version; without it the default model
+# (DEFAULT_MODEL, else 'default', else the first listed) serves, or the first model of the right kind.
+_REGISTRY: Optional[ModelRegistry] = None
+_KEEP_VERSIONS = int(os.environ.get('MODEL_KEEP_VERSIONS', '2'))
+# Poll model files every N seconds and hot-reload on change (0 disables)
+_WATCH_INTERVAL_S = float(os.environ.get('MODEL_WATCH_INTERVAL_S', '0'))
+# /admin endpoints are disabled unless ADMIN_TOKEN is set; clients send it as X-Admin-Token
+_ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN', '')
+# torch is imported with the first torch-backed model, so NumPy-only deployments neither need it
+# installed nor pay for importing it
+torch = None
+_DEVICE = 'cpu'
+# 'torch' or 'numpy'; .npz models always use numpy, INFERENCE_BACKEND=numpy converts .pt regression checkpoints at load
+_INFERENCE_BACKEND = os.environ.get('INFERENCE_BACKEND', '').strip().lower() or 'torch'
 
-def _load_on_start():
-    global _MODEL, _META, _IS_REGRESSION
-    ckpt_path = os.environ.get('MODEL_CKPT', '').strip()
-    if not ckpt_path:
-        raise RuntimeError("Environment variable MODEL_CKPT not set. Provide path to saved .pt checkpoint.")
+# Micro-batching knobs: flush when this many requests are queued or after this many ms
+_BATCH_MAX_SIZE = int(os.environ.get('BATCH_MAX_SIZE', '32'))
+_BATCH_MAX_WAIT_MS = float(os.environ.get('BATCH_MAX_WAIT_MS', '2'))
+# Bulk endpoints: rows accepted per request and rows per forward pass
+_MAX_BATCH_ROWS = int(os.environ.get('MAX_BATCH_ROWS', '20000'))
+_BATCH_CHUNK_SIZE = int(os.environ.get('BATCH_CHUNK_SIZE', '2048'))
+# Variable-length regression batches of at least LENGTH_BUCKET_MIN_ROWS rows are split into buckets of
+# LENGTH_BUCKET_WIDTH history lengths, each run as one forward pass packed to its rows' own lengths;
+# smaller batches run as a single packed pass, since per-call overhead outweighs the saved steps there
+# (see ml/benchmarks/packed.py). TorchScript artifacts cannot pack and always use exact-length buckets.
+_LENGTH_BUCKET_WIDTH = max(1, int(os.environ.get('LENGTH_BUCKET_WIDTH', '1')))
+_LENGTH_BUCKET_MIN_ROWS = int(os.environ.get('LENGTH_BUCKET_MIN_ROWS', '1024'))
+# Largest scenarios x difficulties grid accepted by /predict_regression/sweep
+_MAX_SWEEP_POINTS = int(os.environ.get('MAX_SWEEP_POINTS', '5000'))
+# Forward passes run on every model before it takes traffic (startup and reloads), so lazy
+# allocator / kernel / TorchScript-profiling costs are not paid by the first requests
+_WARMUP_BATCH_SIZES = [int(v) for v in os.environ.get('WARMUP_BATCH_SIZES', f'1,{_BATCH_MAX_SIZE},256').split(',') if v.strip()]
+_WARMUP_ROUNDS = int(os.environ.get('WARMUP_ROUNDS', '2'))
+# Not ready (health 503) until every startup model is loaded and warmed up
+_READY = False
+_STARTUP: Dict[str, float] = {}
+
+# Opt-in INT8 dynamic quantization of eager checkpoints (QUANTIZE=int8); startup fails if the
+# quantized model drifts past these limits on a held-out synthetic set
+_QUANTIZE = os.environ.get('QUANTIZE', '').strip().lower()
+_QUANT_MAX_MAE_DRIFT = float(os.environ.get('QUANT_MAX_MAE_DRIFT', '0.5'))
+_QUANT_MAX_ACC_DROP = float(os.environ.get('QUANT_MAX_ACC_DROP', '0.01'))
+_QUANT_VERIFY_SAMPLES = int(os.environ.get('QUANT_VERIFY_SAMPLES', '2000'))
+
+# Forward passes run on a bounded thread pool sized from the CPU quota (see ml/runtime.py)
+_THREADS = thread_config()
+_EXECUTOR: Optional[BoundedExecutor] = None
+
+# Result cache keyed by normalised inputs + checkpoint fingerprint (PRED_CACHE_MAX_ENTRIES=0 disables)
+_CACHE = PredictionCache(
+    max_entries=int(os.environ.get('PRED_CACHE_MAX_ENTRIES', '50000')),
+    ttl_s=float(os.environ.get('PRED_CACHE_TTL_S', '300')),
+    max_bytes=int(float(os.environ.get('PRED_CACHE_MAX_MB', '64')) * 1024 * 1024),
+)
+
+# Per-student LSTM states for /predict_regression/incremental, keyed by checkpoint fingerprint;
+# least recently used states beyond STATE_STORE_MAX_ENTRIES spill to STATE_STORE_SPILL_DIR (or are dropped)
+_STATES = StateStore(
+    max_entries=int(os.environ.get('STATE_STORE_MAX_ENTRIES', '100000')),
+    spill_dir=os.environ.get('STATE_STORE_SPILL_DIR', '').strip(),
+)
+# One lock per student so concurrent appends for the same student apply in order
+_STUDENT_LOCKS: 'weakref.WeakValueDictionary[str, asyncio.Lock]' = weakref.WeakValueDictionary()
+# Set by ml.prefork; the state store is per process, so appends spread over several
+# workers would resume from missing or stale states
+_WORKER_PROCESSES = 1
+
+
+def _inference_executor() -> BoundedExecutor:
+    global _EXECUTOR
+    if _EXECUTOR is None:
+        _EXECUTOR = BoundedExecutor(_THREADS['executor_workers'], _THREADS['max_pending'])
+    return _EXECUTOR
+
+def _saturated(e: ExecutorSaturated) -> HTTPException:
+    timer = current_timer()
+    if timer is not None:
+        timer.error = 'executor_saturated'
+    return HTTPException(status_code=503, detail=str(e))
+
+async def _run_inference(fn, *args):
+    """Run a blocking forward pass on the inference executor."""
+    try:
+        return await asyncio.wrap_future(_inference_executor().submit(fn, *args))
+    except ExecutorSaturated as e:
+        raise _saturated(e)
+
+async def _submit(entry: ModelEntry, item):
+    try:
+        return await entry.batcher.submit(item)
+    except ExecutorSaturated as e:
+        raise _saturated(e)
+
+def _observe_batch(model: str, size: int, waits: List[float], run_s: float):
+    _BATCH_ROWS.observe(size, model)
+    _STAGE.observe(run_s, model, 'batch')
+    for w in waits:
+        _STAGE.observe(w, model, 'queue_wait')
+
+def _ml_module(name: str):
+    return importlib.import_module(f'.{name}', __package__ or 'ml')
+
+def _quantize(model, meta, is_regression):
+    if _QUANTIZE != 'int8':
+        raise RuntimeError(f"Unsupported QUANTIZE={_QUANTIZE!r}; only 'int8' is available")
+    if _DEVICE != 'cpu':
+        raise RuntimeError("INT8 dynamic quantization is CPU-only")
+    quant, report = _ml_module('quantize').quantize_verified(model, meta, is_regression, max_mae_drift=_QUANT_MAX_MAE_DRIFT, max_acc_drop=_QUANT_MAX_ACC_DROP, n=_QUANT_VERIFY_SAMPLES)
+    meta['quantization'] = dict(report, dtype='qint8')
+    return quant
+
+def _require_torch():
+    global torch, _DEVICE
+    if torch is None:
+        try:
+            import torch as torch_mod
+        except ImportError:
+            raise RuntimeError("torch is not installed; serve an .npz model exported with `python -m ml.numpy_runtime`")
+        configure_torch_threads(_THREADS['intra_op_threads'], _THREADS['inter_op_threads'])
+        _DEVICE = 'cuda' if torch_mod.cuda.is_available() else 'cpu'
+        torch = torch_mod
+    return torch
+
+def _warm_up(entry: ModelEntry):
+    seq_len = entry.meta.get('seq_len', 10) or 10
+    for _ in range(_WARMUP_ROUNDS):
+        for n in _WARMUP_BATCH_SIZES:
+            if entry.is_regression:
+                past = np.full((n, seq_len), 0.75, dtype=np.float32)
+                diff = np.full((n, 1), 0.5, dtype=np.float32)
+                _forward_regression(entry, past, diff)
+                if entry.meta.get('variable_length'):
+                    _forward_regression_bucketed(entry, past, diff, np.arange(n, dtype=np.int64) % seq_len + 1)
+                if entry.meta.get('quantiles'):
+                    _forward_regression_quantiles(entry, past, diff)
+            else:
+                _forward_classification(entry, np.full((n, entry.meta['input_dim']), 0.75, dtype=np.float32))
+
+def _load_model(name: str, ckpt_path: str) -> ModelEntry:
+    """Registry loader: build a ready-to-serve (loaded and warmed-up) entry for one checkpoint."""
+    started = time.perf_counter()
     if not os.path.isfile(ckpt_path):
         raise RuntimeError(f"Checkpoint file not found: {ckpt_path}")
-    # Inspect checkpoint to decide which loader to use
-    try:
-        meta = torch.load(ckpt_path, map_location='cpu')
-    except Exception as e:
-        raise RuntimeError(f"Failed to load checkpoint: {e}")
-    model_type = meta.get('model_type')
-    if model_type == 'lstm_regression' or ('num_classes' not in meta and 'model_state' in meta and 'best_val_mae' in meta):
-        model, meta_full = load_regression_model(ckpt_path)
-        _IS_REGRESSION = True
-        _MODEL = model.to(_DEVICE)
-        _META = meta_full
+    if _INFERENCE_BACKEND not in ('torch', 'numpy'):
+        raise RuntimeError(f"Unsupported INFERENCE_BACKEND={_INFERENCE_BACKEND!r}; use 'torch' or 'numpy'")
+    if numpy_runtime.is_npz_artifact(ckpt_path) or _INFERENCE_BACKEND == 'numpy':
+        if _QUANTIZE:
+            raise RuntimeError("QUANTIZE applies to the torch backend only")
+        # Exported by ml/numpy_runtime.py (or converted from a .pt checkpoint here): no torch at inference time
+        try:
+            model, meta = numpy_runtime.load(ckpt_path)
+        except Exception as e:
+            raise RuntimeError(f"Failed to load checkpoint for the NumPy backend: {e}")
+        is_regression = True
+        backend = 'numpy'
     else:
-        model, meta_full = load_model(ckpt_path)
-        _IS_REGRESSION = False
-        _MODEL = model.to(_DEVICE)
-        _META = meta_full
+        _require_torch()
+        backend = 'torch'
+        export_mod = _ml_module('export')
+        if export_mod.is_torchscript_artifact(ckpt_path):
+            # Exported by ml/export.py: frozen module + metadata, no model classes needed
+            model, meta = export_mod.load_artifact(ckpt_path, map_location=_DEVICE)
+            is_regression = meta.get('model_type') == 'lstm_regression'
+        else:
+            # Read once (weights-only, memory-mapped) and build the model from that dict
+            try:
+                raw = _ml_module('checkpoint').read_checkpoint(ckpt_path)
+            except Exception as e:
+                raise RuntimeError(f"Failed to load checkpoint: {e}")
+            model_type = raw.get('model_type')
+            ensemble_mod = _ml_module('ensemble')
+            if ensemble_mod.is_ensemble_checkpoint(raw):
+                if _QUANTIZE:
+                    # quantize_dynamic only swaps nn.LSTM / nn.Linear; the stacked weights are plain buffers
+                    raise RuntimeError("QUANTIZE does not support ensemble checkpoints")
+                # Stacked members evaluated in one pass; forward returns their mean
+                model, meta = ensemble_mod.ensemble_from_checkpoint(raw)
+                is_regression = True
+                model = model.to(_DEVICE)
+            elif model_type == 'lstm_regression' or ('num_classes' not in raw and 'model_state' in raw and 'best_val_mae' in raw):
+                # Training modules are imported only for eager checkpoints
+                model, meta = _ml_module('lstm_regression').regression_model_from_checkpoint(raw)
+                is_regression = True
+                model = export_mod.RegressionForward(model).to(_DEVICE).eval()
+            else:
+                model, meta = _ml_module('Model').model_from_checkpoint(raw)
+                is_regression = False
+                model = model.to(_DEVICE)
+            if _QUANTIZE:
+                model = _quantize(model, meta, is_regression)
+    entry = ModelEntry(name, ckpt_path, model, meta, is_regression, backend, file_fingerprint(ckpt_path))
+    entry.supports_lengths = is_regression and not (torch is not None and isinstance(model, torch.jit.ScriptModule))
+    batch_fn = _run_regression_batch if is_regression else _run_classification_batch
+    entry.batcher = MicroBatcher(functools.partial(batch_fn, entry), max_batch_size=_BATCH_MAX_SIZE, max_wait_ms=_BATCH_MAX_WAIT_MS,
+                                 executor=_inference_executor(), on_batch=functools.partial(_observe_batch, name))
+    loaded = time.perf_counter()
+    _warm_up(entry)
+    entry.timings = {'load_s': loaded - started, 'warmup_s': time.perf_counter() - loaded}
+    return entry
+
+def _on_retire(entry: ModelEntry):
+    _CACHE.invalidate(entry.fingerprint)
+    # A forced reload of the same file retires a version whose states are still valid
+    if _REGISTRY is None or all(e.fingerprint != entry.fingerprint for e in _REGISTRY.entries()):
+        _STATES.invalidate(entry.fingerprint)
+
+def _load_on_start():
+    global _REGISTRY, _READY
+    started = time.perf_counter()
+    specs = parse_model_specs(os.environ.get('MODEL_REGISTRY', ''))
+    ckpt_path = os.environ.get('MODEL_CKPT', '').strip()
+    if ckpt_path:
+        specs.setdefault('default', ckpt_path)
+    if not specs:
+        raise RuntimeError("Environment variable MODEL_CKPT not set. Provide path to saved .pt checkpoint (or MODEL_REGISTRY=name=path,...).")
+    registry = ModelRegistry(_load_model, keep_versions=_KEEP_VERSIONS, fingerprint=file_fingerprint, on_retire=_on_retire)
+    for name, path in specs.items():
+        registry.load(name, path)
+    default = os.environ.get('DEFAULT_MODEL', '').strip() or ('default' if 'default' in specs else next(iter(specs)))
+    if default not in specs:
+        raise RuntimeError(f"DEFAULT_MODEL={default!r} is not one of the registered models {list(specs)}")
+    registry.default = default
+    _REGISTRY = registry
+    _STARTUP.update(import_s=started - _IMPORT_STARTED, models_s=time.perf_counter() - started,
+                    ready_s=time.perf_counter() - _IMPORT_STARTED)
+    _READY = True
 
 @app.on_event("startup")
 async def startup_event():
-    _load_on_start()
+    # ml.prefork loads the models in the parent before forking the workers
+    if _REGISTRY is None:
+        _load_on_start()
+    _REGISTRY.start_watching(_WATCH_INTERVAL_S)
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    if _REGISTRY is not None:
+        await _REGISTRY.stop_watching()
 
 @app.get('/health', response_model=HealthResponse)
 async def health():
-    if _MODEL is None:
+    entry = _REGISTRY.get() if _REGISTRY is not None else None
+    if entry is None:
         raise HTTPException(status_code=503, detail="Model not loaded")
-    mtype = 'lstm_regression' if _IS_REGRESSION else 'classification'
-    return HealthResponse(status="ok", model_type=mtype, num_classes=(0 if _IS_REGRESSION else _META.get('num_classes',0)), seq_len=_META.get('seq_len',10) or 10)
+    if not _READY:
+        raise HTTPException(status_code=503, detail="Warming up")
+    info = entry.describe()
+    return HealthResponse(status="ok", model_type=info['model_type'], backend=entry.backend, num_classes=info['num_classes'], seq_len=info['seq_len'], checkpoint=entry.fingerprint, model=entry.name, version=entry.version, runtime=dict(_THREADS, pending=_inference_executor().pending), batching=(entry.batcher.snapshot() if entry.batcher is not None else None), cache=_CACHE.stats(), state_store=_STATES.stats(), quantization=entry.meta.get('quantization'), registry=_REGISTRY.stats(), models=_REGISTRY.describe(), startup=_STARTUP)
+
+@app.get('/models', response_model=List[ModelInfo])
+async def list_models():
+    if _REGISTRY is None:
+        raise HTTPException(status_code=503, detail="Model not loaded")
+    return _REGISTRY.describe()
+
+def _model_info_series():
+    for e in (_REGISTRY.entries() if _REGISTRY is not None else []):
+        yield (e.name, str(e.version), e.fingerprint, e.backend, e.model_type, 'int8' if e.meta.get('quantization') else ''), 1.0
+
+def _batcher_series(field: str):
+    for e in (_REGISTRY.entries() if _REGISTRY is not None else []):
+        if e.batcher is not None:
+            yield (e.name,), float(e.batcher.snapshot()[field])
+
+_METRICS.gauge('model_info', 'Loaded model identity (value is always 1)', ('model', 'version', 'checkpoint', 'backend', 'model_type', 'quantization'), collect=_model_info_series)
+_METRICS.gauge('batcher_queue_depth', 'Requests waiting in the micro-batcher', ('model',), collect=lambda: _batcher_series('queue_depth'))
+_METRICS.counter('batcher_cancelled_total', 'Queued requests whose client went away before the batch ran', ('model',), collect=lambda: _batcher_series('cancelled'))
+_METRICS.gauge('executor_pending', 'Inference jobs queued or running on the executor', collect=lambda: [((), float(_inference_executor().pending))])
+_METRICS.gauge('cache_entries', 'Prediction cache entries', collect=lambda: [((), float(_CACHE.stats()['entries']))])
+_METRICS.counter('cache_lookups_total', 'Prediction cache lookups by result', ('result',),
+                 collect=lambda: [(('hit',), float(_CACHE.hits)), (('miss',), float(_CACHE.misses))])
+_METRICS.gauge('state_store_entries', 'Student LSTM states held in memory', collect=lambda: [((), float(_STATES.stats()['entries']))])
+_METRICS.counter('state_store_lookups_total', 'Student state lookups by result', ('result',),
+                 collect=lambda: [(('memory',), float(_STATES.hits)), (('disk',), float(_STATES.disk_hits)), (('miss',), float(_STATES.misses))])
+
+@app.get('/metrics')
+async def metrics():
+    return Response(content=_METRICS.render(), media_type=CONTENT_TYPE)
+
+def _check_admin(token: Optional[str]):
+    if not _ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Admin endpoints are disabled; set ADMIN_TOKEN to enable them")
+    if not token or not hmac.compare_digest(token, _ADMIN_TOKEN):
+        raise HTTPException(status_code=401, detail="Invalid admin token")
+
+@app.post('/admin/models/{name}/reload', response_model=ModelInfo)
+@timed_endpoint
+async def reload_model(name: str, req: Optional[ReloadRequest] = None, x_admin_token: Optional[str] = Header(None)):
+    """Load a new version of ``name`` in the background and swap it in once ready."""
+    _check_admin(x_admin_token)
+    if _REGISTRY is None:
+        raise HTTPException(status_code=503, detail="Model not loaded")
+    req = req or ReloadRequest()
+    if not req.path and _REGISTRY.get(name) is None:
+        raise HTTPException(status_code=404, detail=f"Unknown model {name!r}; pass a path to register it")
+    try:
+        await _REGISTRY.reload(name, req.path, force=req.force)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Reload failed, current version kept: {e}")
+    return next(info for info in _REGISTRY.describe() if info['name'] == name)
 
 # Helper to form feature vector consistent with training
 
-def _build_feature_vector(past: List[float], difficulty: Optional[float]):
-    seq_len = _META.get('seq_len', 10) or 10
-    if len(past) != seq_len:
-        raise HTTPException(status_code=400, detail=f"past_grades length {len(past)} does not match expected seq_len {seq_len}")
-    grades = torch.tensor(past, dtype=torch.float32)
-    # Infer scaling: if first feature column looks <=1 then training likely scaled
-    scaled = False
-    feat_cols = _META.get('feature_columns', [])
-    if feat_cols:
-        # crude heuristic: if median of stored min grade in training would be <=1 we scaled
-        if all('g' in c for c in feat_cols if c.startswith('g')):
-            # can't compute stats; rely on metadata args
-            scaled = _META.get('args', {}).get('scale_grades', False)
-    if scaled:
-        grades = grades / 100.0 if grades.max() > 1.0 else grades
-    features = [grades]
-    # difficulty handling
-    if _META.get('args', {}).get('add_difficulty', False):
-        if difficulty is None:
-            raise HTTPException(status_code=400, detail="difficulty is required by this model")
-        # model trained with scaling (difficulty-1)/9
-        diff_scaled = (float(difficulty) - 1.0) / 9.0
-        features.append(torch.tensor([diff_scaled], dtype=torch.float32))
-    elif difficulty is not None:
-        # Provided but not used
-        pass
-    x = torch.cat(features)
-    return x.unsqueeze(0)  # (1, F)
+def _build_feature_vector(entry: ModelEntry, past: List[float], difficulty: Optional[float]):
+    with _STAGE.time(entry.name, 'preprocess'):
+        x, errors = classification_inputs(entry.meta, [past], [difficulty])
+    if errors[0] is not None:
+        raise HTTPException(status_code=400, detail=errors[0])
+    return x[0]  # (F,)
 
 # Regression input preparation
-def _prepare_regression_inputs(past: List[float], difficulty: Optional[float]):
-    seq_len = _META.get('seq_len', 10) or 10
-    if len(past) != seq_len:
-        raise HTTPException(status_code=400, detail=f"past_grades length {len(past)} does not match expected seq_len {seq_len}")
-    scale_grades = bool(_META.get('scale_grades', False))
-    grades = torch.tensor(past, dtype=torch.float32)
-    if scale_grades and grades.max().item() > 1.0:
-        grades = grades / 100.0
-    use_diff = bool(_META.get('use_difficulty', False))
-    if use_diff:
-        if difficulty is None:
-            raise HTTPException(status_code=400, detail="difficulty is required by this regression model")
-        diff_scaled = (float(difficulty) - 1.0) / 9.0
-        diff_t = torch.tensor([diff_scaled], dtype=torch.float32)
+def _prepare_regression_inputs(entry: ModelEntry, past: List[float], difficulty: Optional[float]):
+    with _STAGE.time(entry.name, 'preprocess'):
+        grades, diff, lengths, errors, scale_grades, use_diff = regression_inputs(entry.meta, [past], [difficulty])
+    if errors[0] is not None:
+        raise HTTPException(status_code=400, detail=errors[0])
+    # Only the real history: shorter rows are bucketed by length downstream
+    return grades[0, :lengths[0]], diff[0], scale_grades, use_diff
+
+# Batched forward passes over dense numpy inputs
+
+# On CUDA the forward stage only covers kernel launches; the wait for results lands in transfer_out
+
+def _forward_classification(entry: ModelEntry, x: np.ndarray) -> np.ndarray:
+    with torch.no_grad():
+        with _STAGE.time(entry.name, 'transfer_in'):
+            x_t = torch.from_numpy(x).to(_DEVICE)
+        with _STAGE.time(entry.name, 'forward'):
+            probs = torch.softmax(entry.model(x_t), dim=1)
+        with _STAGE.time(entry.name, 'transfer_out'):
+            return probs.cpu().numpy()
+
+def _forward_regression(entry: ModelEntry, past: np.ndarray, diff: np.ndarray, lengths: Optional[np.ndarray] = None) -> np.ndarray:
+    """(B,) predictions; ``lengths`` marks left-aligned histories shorter than ``past``'s width (packed)."""
+    if entry.backend == 'numpy':
+        with _STAGE.time(entry.name, 'forward'):
+            return entry.model(past, diff, lengths)
+    with torch.no_grad():
+        with _STAGE.time(entry.name, 'transfer_in'):
+            past_t = torch.from_numpy(past).to(_DEVICE)
+            diff_t = torch.from_numpy(diff).to(_DEVICE)
+        with _STAGE.time(entry.name, 'forward'):
+            pred = entry.model(past_t, diff_t) if lengths is None else entry.model(past_t, diff_t, torch.from_numpy(lengths))
+        with _STAGE.time(entry.name, 'transfer_out'):
+            return pred.cpu().numpy()
+
+def _forward_regression_quantiles(entry: ModelEntry, past: np.ndarray, diff: np.ndarray):
+    if entry.backend == 'numpy':
+        with _STAGE.time(entry.name, 'forward'):
+            return entry.model.forward_with_quantiles(past, diff)
+    with torch.no_grad():
+        with _STAGE.time(entry.name, 'transfer_in'):
+            past_t = torch.from_numpy(past).to(_DEVICE)
+            diff_t = torch.from_numpy(diff).to(_DEVICE)
+        with _STAGE.time(entry.name, 'forward'):
+            point, quants = entry.model.forward_with_quantiles(past_t, diff_t)
+        with _STAGE.time(entry.name, 'transfer_out'):
+            return point.cpu().numpy(), quants.cpu().numpy()
+
+def _forward_incremental(entry: ModelEntry, grades: np.ndarray, diff: np.ndarray, state: Optional[StudentState]):
+    """Advance a (1, T) grade sequence from ``state`` (zeros if None); returns (prediction, h, c)."""
+    if entry.backend == 'numpy':
+        with _STAGE.time(entry.name, 'forward'):
+            h, c = (state.h[None], state.c[None]) if state is not None else (None, None)
+            if grades.shape[1]:
+                h, c = entry.model.encode(grades, h, c)
+            pred = entry.model.head(h, diff)
+        return float(pred[0]), h[0], c[0]
+    with torch.no_grad():
+        with _STAGE.time(entry.name, 'transfer_in'):
+            grades_t = torch.from_numpy(grades).to(_DEVICE)
+            diff_t = torch.from_numpy(diff).to(_DEVICE)
+            hc = (torch.from_numpy(state.h).view(1, 1, -1).to(_DEVICE), torch.from_numpy(state.c).view(1, 1, -1).to(_DEVICE)) if state is not None else None
+        with _STAGE.time(entry.name, 'forward'):
+            if grades.shape[1]:
+                hc = entry.model.encode(grades_t, hc)
+            pred = entry.model.head(hc[0][-1], diff_t)
+        with _STAGE.time(entry.name, 'transfer_out'):
+            return float(pred.cpu()[0]), hc[0][-1, 0].cpu().numpy(), hc[1][-1, 0].cpu().numpy()
+
+def _forward_regression_bucketed(entry: ModelEntry, past: np.ndarray, diff: np.ndarray, lengths: np.ndarray) -> np.ndarray:
+    """Forward variable-length rows one length bucket at a time, each trimmed to its longest row."""
+    if not entry.supports_lengths:
+        buckets = length_buckets(lengths, 1)
+    elif len(past) < _LENGTH_BUCKET_MIN_ROWS:
+        buckets = [np.arange(len(past))]
     else:
-        diff_t = torch.tensor([0.0], dtype=torch.float32)
-    return grades.unsqueeze(0), diff_t.unsqueeze(0), scale_grades, use_diff
+        buckets = length_buckets(lengths, _LENGTH_BUCKET_WIDTH)
+    out = np.empty(len(past), dtype=np.float32)
+    for rows in buckets:
+        bucket_lengths = lengths[rows]
+        longest = int(bucket_lengths.max())
+        packed = None if (bucket_lengths == longest).all() else bucket_lengths
+        if len(rows) == len(past) and longest == past.shape[1]:
+            out[:] = _forward_regression(entry, past, diff, packed)
+        else:
+            out[rows] = _forward_regression(entry, np.ascontiguousarray(past[rows, :longest]), diff[rows], packed)
+    return out
+
+def _forward_sweep(entry: ModelEntry, windows: np.ndarray, lengths: np.ndarray, diff: np.ndarray) -> np.ndarray:
+    """(S, D) predictions for every window x difficulty pair.
+
+    Each window goes through the LSTM once; the (S*D) grid only runs the fc
+    head, so the cost barely grows with the number of difficulties. Traced
+    artifacts have no separate encoder and run the expanded grid instead.
+    """
+    s, d = len(windows), len(diff)
+    packed = None if (lengths == windows.shape[1]).all() else lengths
+    if entry.backend == 'numpy':
+        with _STAGE.time(entry.name, 'forward'):
+            h, _ = entry.model.encode(windows, lengths=packed)
+            return entry.model.head(np.repeat(h, d, axis=0), np.tile(diff, (s, 1))).reshape(s, d)
+    if not hasattr(entry.model, 'encode'):
+        grid_diff = np.tile(diff, (s, 1))
+        return _forward_regression_bucketed(entry, np.repeat(windows, d, axis=0), grid_diff, np.repeat(lengths, d)).reshape(s, d)
+    with torch.no_grad():
+        with _STAGE.time(entry.name, 'transfer_in'):
+            windows_t = torch.from_numpy(windows).to(_DEVICE)
+            diff_t = torch.from_numpy(diff).to(_DEVICE)
+        with _STAGE.time(entry.name, 'forward'):
+            h, _ = entry.model.encode(windows_t, None, None if packed is None else torch.from_numpy(packed))
+            pred = entry.model.head(h[-1].repeat_interleave(d, dim=0), diff_t.repeat(s, 1))
+        with _STAGE.time(entry.name, 'transfer_out'):
+            return pred.cpu().numpy().reshape(s, d)
+
+def _forward_ensemble(entry: ModelEntry, past: np.ndarray, diff: np.ndarray) -> np.ndarray:
+    """(K, B) predictions of every ensemble member, from one stacked forward pass."""
+    with torch.no_grad():
+        with _STAGE.time(entry.name, 'transfer_in'):
+            past_t = torch.from_numpy(past).to(_DEVICE)
+            diff_t = torch.from_numpy(diff).to(_DEVICE)
+        with _STAGE.time(entry.name, 'forward'):
+            preds = entry.model.forward_members(past_t, diff_t)
+        with _STAGE.time(entry.name, 'transfer_out'):
+            return preds.cpu().numpy()
+
+def _chunked(forward, *arrays: np.ndarray) -> np.ndarray:
+    n = len(arrays[0])
+    outs = [forward(*(a[i:i + _BATCH_CHUNK_SIZE] for a in arrays)) for i in range(0, n, _BATCH_CHUNK_SIZE)]
+    return np.concatenate(outs) if outs else np.zeros((0,), dtype=np.float32)
+
+def _cached_rows(entry: ModelEntry, kind: str, forward, arrays, ok: List[int]) -> List[Any]:
+    """Per-row results for rows ``ok`` of ``arrays``, running ``forward`` only on cache misses."""
+    keys = [_CACHE.key(kind, entry.fingerprint, *(a[i] for a in arrays)) for i in ok]
+    results = [_CACHE.get(k) for k in keys]
+    miss = [j for j, r in enumerate(results) if r is None]
+    if miss:
+        rows = [ok[j] for j in miss]
+        computed = _chunked(functools.partial(forward, entry), *(a[rows] for a in arrays)).tolist()
+        for j, value in zip(miss, computed):
+            results[j] = value
+            _CACHE.put(keys[j], value)
+    return results
+
+# Micro-batcher callbacks; each item is one request's prepared feature rows
+
+def _run_classification_batch(entry: ModelEntry, items: List[np.ndarray]) -> List[List[float]]:
+    return _forward_classification(entry, np.stack(items)).tolist()
+
+def _run_regression_batch(entry: ModelEntry, items) -> List[float]:
+    diff = np.stack([d for _, d in items])
+    lengths = np.fromiter((len(p) for p, _ in items), dtype=np.int64, count=len(items))
+    if (lengths == lengths[0]).all():
+        return _forward_regression(entry, np.stack([p for p, _ in items]), diff).tolist()
+    past = np.zeros((len(items), int(lengths.max())), dtype=np.float32)
+    for i, (p, _) in enumerate(items):
+        past[i, :len(p)] = p
+    return _forward_regression_bucketed(entry, past, diff, lengths).tolist()
 
 # Bucket label helper
 
@@ -158,39 +676,248 @@ def _bucket_label(idx: int, num_classes: int):
     high = low + 9
     return f"{low}-{high}"
 
-@app.post('/predict', response_model=PredictResponse)
-async def predict(req: PredictRequest):
-    if _MODEL is None:
+def _classification_response(entry: ModelEntry, probs: List[float]) -> PredictResponse:
+    idx = max(range(len(probs)), key=probs.__getitem__)
+    label = _bucket_label(idx, entry.meta.get('num_classes', len(probs)))
+    return PredictResponse(bucket_index=idx, bucket_label=label, probabilities=[float(p) for p in probs])
+
+def _regression_response(pred: float, scaled: bool, use_diff: bool) -> PredictRegressionResponse:
+    if scaled:
+        pred_val = float(pred * 100.0)
+    else:
+        pred_val = float(pred)
+    pred_val = max(0.0, min(100.0, pred_val))
+    return PredictRegressionResponse(predicted_grade=pred_val, rounded_grade=int(round(pred_val)), model_scaled=scaled, used_difficulty=use_diff)
+
+def _exceedance_curve(quant_grades: np.ndarray, levels: List[float], thresholds: List[float]) -> np.ndarray:
+    """P(grade >= t) from one row of predicted quantiles (grade points).
+
+    The CDF is piecewise linear through the predicted quantiles and pinned to
+    0 at grade 0 and 1 at grade 100.
+    """
+    knots = np.maximum.accumulate(np.clip(quant_grades, 0.0, 100.0))
+    xp = np.concatenate([[0.0], knots, [100.0]])
+    fp = np.concatenate([[0.0], np.asarray(levels, dtype=np.float64), [1.0]])
+    cdf = np.interp(np.asarray(thresholds, dtype=np.float64), xp, fp)
+    return np.clip(1.0 - cdf, 0.0, 1.0)
+
+def _resolve_model(model: Optional[str], regression: bool) -> ModelEntry:
+    """The registry entry serving this request (``model`` is ``name`` or ``name@version``)."""
+    if _REGISTRY is None or not _REGISTRY.names():
         raise HTTPException(status_code=503, detail="Model not loaded")
-    if _IS_REGRESSION:
+    if model:
+        try:
+            name, version = parse_model_ref(model)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        entry = _REGISTRY.get(name, version)
+        if entry is None:
+            raise HTTPException(status_code=404, detail=f"Unknown model {model!r}")
+    else:
+        entry = _REGISTRY.get()
+        if entry is None or entry.is_regression != regression:
+            entry = next((e for e in _REGISTRY.entries() if e.is_regression == regression), entry)
+    timer = current_timer()
+    if timer is not None:
+        timer.model = entry.name
+    if regression and not entry.is_regression:
+        raise HTTPException(status_code=400, detail="Loaded model is classification; use /predict endpoint")
+    if not regression and entry.is_regression:
         raise HTTPException(status_code=400, detail="Loaded model is regression; use /predict_regression endpoint")
-    _MODEL.eval()
-    with torch.no_grad():
-        x = _build_feature_vector(req.past_grades, req.difficulty).to(_DEVICE)
-        logits = _MODEL(x)
-        probs = torch.softmax(logits, dim=1).cpu().numpy()[0]
-        idx = int(probs.argmax())
-        label = _bucket_label(idx, _META.get('num_classes', len(probs)))
-        return PredictResponse(bucket_index=idx, bucket_label=label, probabilities=[float(p) for p in probs])
+    return entry
+
+def _check_batch_size(req: BatchPredictRequest):
+    if len(req.rows) > _MAX_BATCH_ROWS:
+        raise HTTPException(status_code=413, detail=f"batch of {len(req.rows)} rows exceeds limit of {_MAX_BATCH_ROWS}")
+
+@app.post('/predict', response_model=PredictResponse)
+@timed_endpoint
+async def predict(req: PredictRequest, model: Optional[str] = None):
+    entry = _resolve_model(model, regression=False)
+    x = _build_feature_vector(entry, req.past_grades, req.difficulty)
+    key = _CACHE.key('predict', entry.fingerprint, x)
+    probs = _CACHE.get(key)
+    if probs is None:
+        probs = await _submit(entry, x)
+        _CACHE.put(key, probs)
+    return _classification_response(entry, probs)
 
 @app.post('/predict_regression', response_model=PredictRegressionResponse)
-async def predict_regression(req: PredictRequest):
-    if _MODEL is None:
-        raise HTTPException(status_code=503, detail="Model not loaded")
-    if not _IS_REGRESSION:
-        raise HTTPException(status_code=400, detail="Loaded model is classification; use /predict endpoint")
-    _MODEL.eval()
-    with torch.no_grad():
-        past_t, diff_t, scaled, use_diff = _prepare_regression_inputs(req.past_grades, req.difficulty)
-        past_t = past_t.to(_DEVICE)
-        diff_t = diff_t.to(_DEVICE)
-        pred = _MODEL(past_t, diff_t if use_diff else None).cpu().squeeze(0)
-        if scaled:
-            pred_val = float(pred.item() * 100.0)
-        else:
-            pred_val = float(pred.item())
-        pred_val = max(0.0, min(100.0, pred_val))
-        return PredictRegressionResponse(predicted_grade=pred_val, rounded_grade=int(round(pred_val)), model_scaled=scaled, used_difficulty=use_diff)
+@timed_endpoint
+async def predict_regression(req: PredictRequest, model: Optional[str] = None):
+    entry = _resolve_model(model, regression=True)
+    past, diff, scaled, use_diff = _prepare_regression_inputs(entry, req.past_grades, req.difficulty)
+    key = _CACHE.key('regression', entry.fingerprint, past, diff)
+    pred = _CACHE.get(key)
+    if pred is None:
+        pred = await _submit(entry, (past, diff))
+        _CACHE.put(key, pred)
+    return _regression_response(pred, scaled, use_diff)
+
+@app.post('/predict_regression/exceedance', response_model=ExceedanceResponse)
+@timed_endpoint
+async def predict_regression_exceedance(req: ExceedanceRequest, model: Optional[str] = None):
+    entry = _resolve_model(model, regression=True)
+    levels = entry.meta.get('quantiles') or []
+    if not levels:
+        raise HTTPException(status_code=400, detail="Loaded regression model has no quantile heads; retrain with --quantiles")
+    past, diff, scaled, use_diff = _prepare_regression_inputs(entry, req.past_grades, req.difficulty)
+    key = _CACHE.key('quantiles', entry.fingerprint, past, diff)
+    cached = _CACHE.get(key)
+    if cached is None:
+        point, quants = await _run_inference(_forward_regression_quantiles, entry, past[None], diff[None])
+        cached = (point, quants)
+        _CACHE.put(key, cached)
+    point, quants = cached
+    factor = 100.0 if scaled else 1.0
+    quant_grades = quants[0].astype(np.float64) * factor
+    probs = _exceedance_curve(quant_grades, levels, req.thresholds)
+    point_val = _regression_response(float(point[0]), scaled, use_diff).predicted_grade
+    return ExceedanceResponse(
+        predicted_grade=point_val,
+        quantiles=[QuantileValue(level=float(l), grade=float(min(100.0, max(0.0, g)))) for l, g in zip(levels, quant_grades)],
+        exceedance=[ThresholdProbability(threshold=float(t), probability=float(p)) for t, p in zip(req.thresholds, probs)],
+    )
+
+@app.post('/predict_regression/incremental', response_model=IncrementalResponse)
+@timed_endpoint
+async def predict_regression_incremental(req: IncrementalRequest, model: Optional[str] = None):
+    """Append ``grades`` to a student's history and predict from the stored LSTM state.
+
+    Costs one LSTM step per new grade instead of a pass over the whole history,
+    and gives the same prediction as a full recompute over it.
+    """
+    if _WORKER_PROCESSES > 1:
+        raise HTTPException(status_code=503, detail=f"Incremental inference keeps per-student state in one process and is unavailable with {_WORKER_PROCESSES} prefork workers; run a single worker")
+    entry = _resolve_model(model, regression=True)
+    if entry.backend == 'torch' and not hasattr(entry.model, 'encode'):
+        raise HTTPException(status_code=400, detail="Incremental inference needs a single-model eager .pt or .npz regression checkpoint; TorchScript artifacts and ensembles have no separate encoder")
+    with _STAGE.time(entry.name, 'preprocess'):
+        grades, diff, error, scaled, use_diff = history_inputs(entry.meta, req.grades, req.difficulty)
+        history = None
+        if req.history is not None:
+            history, _, history_error, _, _ = history_inputs(entry.meta, req.history, req.difficulty)
+            error = error or (history_error and f"history: {history_error}")
+    if error is not None:
+        raise HTTPException(status_code=400, detail=error)
+    lock = _STUDENT_LOCKS.get(req.student)
+    if lock is None:
+        lock = _STUDENT_LOCKS[req.student] = asyncio.Lock()
+    async with lock:
+        state, source = (None, 'reset') if req.reset else _STATES.get(entry.fingerprint, req.student)
+        if req.reset:
+            history = history if history is not None else grades[:, :0]
+        elif state is None and history is None:
+            raise HTTPException(status_code=409, detail=f"No stored state for student {req.student!r}; send their earlier grades as history")
+        elif state is not None and history is not None and history.shape[1] == state.steps:
+            history = None
+        if history is not None:
+            # No usable state: encode the whole history together with the new grades
+            state, source = None, source if req.reset else 'recomputed'
+            grades = np.concatenate([history, grades], axis=1)
+        steps = (state.steps if state is not None else 0) + grades.shape[1]
+        if steps == 0:
+            raise HTTPException(status_code=400, detail="history and grades are both empty")
+        pred, h, c = await _run_inference(_forward_incremental, entry, grades, diff, state)
+        _STATES.put(entry.fingerprint, req.student, StudentState(h, c, steps))
+    out = _regression_response(pred, scaled, use_diff)
+    return IncrementalResponse(predicted_grade=out.predicted_grade, rounded_grade=out.rounded_grade, model_scaled=scaled, used_difficulty=use_diff,
+                               student=req.student, history_length=steps, state_source=source)
+
+@app.post('/predict_regression/ensemble', response_model=EnsembleResponse)
+@timed_endpoint
+async def predict_regression_ensemble(req: EnsembleRequest, model: Optional[str] = None):
+    """Ensemble mean, member spread and P(grade >= threshold) as the share of members predicting at least it.
+
+    The spread reflects disagreement between members (model uncertainty); it
+    does not include the noise of individual grades.
+    """
+    entry = _resolve_model(model, regression=True)
+    if not entry.meta.get('ensemble_size'):
+        raise HTTPException(status_code=400, detail="Loaded regression model is not an ensemble; train with --ensemble K")
+    past, diff, scaled, use_diff = _prepare_regression_inputs(entry, req.past_grades, req.difficulty)
+    key = _CACHE.key('ensemble', entry.fingerprint, past, diff)
+    members = _CACHE.get(key)
+    if members is None:
+        members = (await _run_inference(_forward_ensemble, entry, past[None], diff[None]))[:, 0]
+        _CACHE.put(key, members)
+    grades = np.clip(members.astype(np.float64) * (100.0 if scaled else 1.0), 0.0, 100.0)
+    mean = float(grades.mean())
+    return EnsembleResponse(
+        predicted_grade=mean,
+        rounded_grade=int(round(mean)),
+        std=float(grades.std()),
+        members=grades.tolist(),
+        exceedance=[ThresholdProbability(threshold=float(t), probability=float((grades >= t).mean())) for t in req.thresholds],
+        model_scaled=scaled,
+        used_difficulty=use_diff,
+    )
+
+@app.post('/predict_regression/sweep', response_model=SweepResponse)
+@timed_endpoint
+async def predict_regression_sweep(req: SweepRequest, model: Optional[str] = None):
+    """Predictions over a what-if grid (appended grades x difficulty) from one batched forward pass."""
+    entry = _resolve_model(model, regression=True)
+    if not all(math.isfinite(v) for v in (req.difficulty_min, req.difficulty_max, req.difficulty_step)):
+        raise HTTPException(status_code=400, detail="difficulty_min, difficulty_max and difficulty_step must be finite")
+    if req.difficulty_max < req.difficulty_min:
+        raise HTTPException(status_code=400, detail="difficulty_max must not be below difficulty_min")
+    # Size the grid before building it; the tolerance keeps max in the grid despite float rounding
+    n_difficulties = math.floor((req.difficulty_max - req.difficulty_min) / req.difficulty_step + 1e-9) + 1
+    points = n_difficulties * len(req.scenarios)
+    if points == 0:
+        raise HTTPException(status_code=400, detail="scenarios must not be empty")
+    if points > _MAX_SWEEP_POINTS:
+        raise HTTPException(status_code=413, detail=f"sweep of {points} points exceeds limit of {_MAX_SWEEP_POINTS}")
+    difficulties = req.difficulty_min + req.difficulty_step * np.arange(n_difficulties)
+    with _STAGE.time(entry.name, 'preprocess'):
+        windows, lengths, diff, error, scaled, use_diff = sweep_inputs(entry.meta, req.past_grades, req.scenarios, difficulties)
+    if error is not None:
+        raise HTTPException(status_code=400, detail=error)
+    key = _CACHE.key('sweep', entry.fingerprint, windows, lengths, diff)
+    preds = _CACHE.get(key)
+    if preds is None:
+        preds = await _run_inference(_forward_sweep, entry, windows, lengths, diff)
+        _CACHE.put(key, preds)
+    grades = np.clip(preds.astype(np.float64) * (100.0 if scaled else 1.0), 0.0, 100.0)
+    return SweepResponse(
+        difficulties=[float(d) for d in difficulties],
+        scenarios=[SweepScenario(appended_grades=list(sc), predicted_grades=row) for sc, row in zip(req.scenarios, grades.tolist())],
+        model_scaled=scaled,
+        used_difficulty=use_diff,
+    )
+
+@app.post('/predict/batch', response_model=BatchPredictResponse)
+@timed_endpoint
+async def predict_batch(req: BatchPredictRequest, model: Optional[str] = None):
+    entry = _resolve_model(model, regression=False)
+    _check_batch_size(req)
+    with _STAGE.time(entry.name, 'preprocess'):
+        x, errors = classification_inputs(entry.meta, [r.past_grades for r in req.rows], [r.difficulty for r in req.rows])
+    ok = [i for i, e in enumerate(errors) if e is None]
+    probs = await _run_inference(_cached_rows, entry, 'predict', _forward_classification, (x,), ok)
+    by_row = dict(zip(ok, probs))
+    results = [
+        BatchPredictItem(index=i, result=_classification_response(entry, by_row[i])) if errors[i] is None else BatchPredictItem(index=i, error=errors[i])
+        for i in range(len(req.rows))
+    ]
+    return BatchPredictResponse(results=results, num_ok=len(ok), num_failed=len(req.rows) - len(ok))
+
+@app.post('/predict_regression/batch', response_model=BatchPredictRegressionResponse)
+@timed_endpoint
+async def predict_regression_batch(req: BatchPredictRequest, model: Optional[str] = None):
+    entry = _resolve_model(model, regression=True)
+    _check_batch_size(req)
+    with _STAGE.time(entry.name, 'preprocess'):
+        past, diff, lengths, errors, scaled, use_diff = regression_inputs(entry.meta, [r.past_grades for r in req.rows], [r.difficulty for r in req.rows])
+    ok = [i for i, e in enumerate(errors) if e is None]
+    preds = await _run_inference(_cached_rows, entry, 'regression', _forward_regression_bucketed, (past, diff, lengths), ok)
+    by_row = dict(zip(ok, preds))
+    results = [
+        BatchPredictRegressionItem(index=i, result=_regression_response(by_row[i], scaled, use_diff)) if errors[i] is None else BatchPredictRegressionItem(index=i, error=errors[i])
+        for i in range(len(req.rows))
+    ]
+    return BatchPredictRegressionResponse(results=results, num_ok=len(ok), num_failed=len(req.rows) - len(ok))
 
 if __name__ == '__main__':
     # Example: uvicorn ml.serve:app --host 0.0.0.0 --port 8000
@@ -0,0 +1,196 @@
+"""Out-of-core synthetic datasets stored as fixed-size ``.npy`` shards.
+
+Layout of a shard directory::
+
+    manifest.json
+    shard_00000/grades.npy      (rows, seq_len) float32
+    shard_00000/difficulty.npy  (rows,) int8
+    shard_00000/target.npy      (rows,) float32
+    shard_00000/archetype.npy   (rows,) int8
+    ...
+
+Shards are generated in parallel, one process per shard, each with its own
+``SeedSequence`` child so the result only depends on (seed, shard_size). The
+manifest is written last, so a directory with a manifest is always complete and
+later runs can reuse it without regenerating.
+
+Usage:
+    python -m ml.shards --out data/shards --samples 20000000 --shard-size 1000000
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterator, List, Optional
+
+import numpy as np
+
+try:
+    from . import data as data_mod  # type: ignore
+except ImportError:  # pragma: no cover
+    current_dir = os.path.dirname(os.path.abspath(__file__))
+    parent_dir = os.path.dirname(current_dir)
+    if parent_dir not in sys.path:
+        sys.path.append(parent_dir)
+    import ml.data as data_mod  # type: ignore
+
+MANIFEST = 'manifest.json'
+FORMAT_VERSION = 1
+# array key from data.generate_student_arrays -> file name inside a shard
+FILES = {
+    'past_grades': 'grades.npy',
+    'difficulty': 'difficulty.npy',
+    'current_grade': 'target.npy',
+    'archetype': 'archetype.npy',
+}
+
+
+def _write_shard(out_dir: str, index: int, rows: int, seed_seq: np.random.SeedSequence, seq_len: int) -> Dict:
+    arrays = data_mod.generate_student_arrays(n_samples=rows, seed=seed_seq, seq_len=seq_len)
+    name = f'shard_{index:05d}'
+    shard_dir = os.path.join(out_dir, name)
+    os.makedirs(shard_dir, exist_ok=True)
+    for key, fname in FILES.items():
+        np.save(os.path.join(shard_dir, fname), arrays[key])
+    return {'name': name, 'rows': rows}
+
+
+def write_shards(out_dir: str, n_samples: int, shard_size: int = 1_000_000, seed: int = 42, seq_len: int = 10, workers: Optional[int] = None) -> Dict:
+    """Generate ``n_samples`` rows into ``out_dir`` and return the manifest."""
+    if n_samples <= 0 or shard_size <= 0:
+        raise ValueError('n_samples and shard_size must be positive')
+    os.makedirs(out_dir, exist_ok=True)
+    manifest_path = os.path.join(out_dir, MANIFEST)
+    if os.path.exists(manifest_path):
+        os.remove(manifest_path)
+    sizes = [min(shard_size, n_samples - lo) for lo in range(0, n_samples, shard_size)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    workers = workers or min(len(sizes), os.cpu_count() or 1)
+    started = time.perf_counter()
+    if workers <= 1:
+        shards = [_write_shard(out_dir, i, rows, s, seq_len) for i, (rows, s) in enumerate(zip(sizes, seeds))]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(_write_shard, out_dir, i, rows, s, seq_len) for i, (rows, s) in enumerate(zip(sizes, seeds))]
+            shards = [f.result() for f in futures]
+    manifest = {
+        'format_version': FORMAT_VERSION,
+        'n_samples': int(n_samples),
+        'shard_size': int(shard_size),
+        'seed': int(seed),
+        'seq_len': int(seq_len),
+        'files': FILES,
+        'shards': shards,
+        'generation_seconds': round(time.perf_counter() - started, 3),
+    }
+    tmp = manifest_path + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp, manifest_path)
+    return manifest
+
+
+def ensure_shards(root: str, n_samples: Optional[int], shard_size: int = 1_000_000, seed: int = 42, seq_len: int = 10) -> Dict:
+    """Reuse the shards in ``root`` if they match the request, generate them if there are none.
+
+    ``n_samples`` None accepts an existing directory of any size (and generates
+    1000 rows otherwise). Raises ValueError if the existing manifest was
+    generated with another ``seq_len``, ``seed`` or row count.
+    """
+    manifest = read_manifest(root)
+    if manifest is None:
+        return write_shards(root, n_samples or 1000, shard_size=shard_size, seed=seed, seq_len=seq_len)
+    wanted = {'seq_len': seq_len, 'seed': seed}
+    if n_samples:
+        wanted['n_samples'] = n_samples
+    mismatched = [f'{k} {manifest.get(k)} (requested {v})' for k, v in wanted.items() if manifest.get(k) != v]
+    if mismatched:
+        raise ValueError(f"shards in {root} were generated with {', '.join(mismatched)}; use another directory or regenerate them")
+    return manifest
+
+
+def read_manifest(root: str) -> Optional[Dict]:
+    path = os.path.join(root, MANIFEST)
+    if not os.path.isfile(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+class ShardedDataset:
+    """Memory-mapped view over a shard directory, optionally restricted to a row range.
+
+    Batches are streamed one shard slice at a time, so at most one slice is
+    resident in memory regardless of the dataset size.
+    """
+
+    def __init__(self, root: str, start: int = 0, stop: Optional[int] = None, manifest: Optional[Dict] = None):
+        self.root = root
+        self.manifest = manifest or read_manifest(root)
+        if self.manifest is None:
+            raise FileNotFoundError(f'No {MANIFEST} in {root}; generate shards first')
+        self.seq_len = self.manifest['seq_len']
+        total = sum(s['rows'] for s in self.manifest['shards'])
+        self.start = max(0, start)
+        self.stop = total if stop is None else min(total, stop)
+        self._maps: Dict[int, Dict[str, np.ndarray]] = {}
+
+    def __len__(self):
+        return max(0, self.stop - self.start)
+
+    def split(self, test_size: float):
+        """Contiguous train/validation split (rows are iid, so no shuffling is needed)."""
+        cut = self.stop - int(round(len(self) * test_size))
+        return (ShardedDataset(self.root, self.start, cut, self.manifest),
+                ShardedDataset(self.root, cut, self.stop, self.manifest))
+
+    def _shard(self, i: int) -> Dict[str, np.ndarray]:
+        if i not in self._maps:
+            shard_dir = os.path.join(self.root, self.manifest['shards'][i]['name'])
+            self._maps[i] = {key: np.load(os.path.join(shard_dir, fname), mmap_mode='r') for key, fname in self.manifest['files'].items()}
+        return self._maps[i]
+
+    def _slices(self) -> List[tuple]:
+        out, offset = [], 0
+        for i, shard in enumerate(self.manifest['shards']):
+            lo, hi = max(self.start, offset), min(self.stop, offset + shard['rows'])
+            if lo < hi:
+                out.append((i, lo - offset, hi - offset))
+            offset += shard['rows']
+        return out
+
+    def iter_batches(self, batch_size: int, shuffle: bool = False, seed: int = 0) -> Iterator[Dict[str, np.ndarray]]:
+        rng = np.random.default_rng(seed)
+        slices = self._slices()
+        if shuffle:
+            slices = [slices[j] for j in rng.permutation(len(slices))]
+        for i, lo, hi in slices:
+            shard = self._shard(i)
+            # Materialise the slice once; shuffling inside it keeps reads sequential on disk
+            block = {key: np.asarray(arr[lo:hi]) for key, arr in shard.items()}
+            order = rng.permutation(hi - lo) if shuffle else None
+            for b in range(0, hi - lo, batch_size):
+                if order is None:
+                    yield {key: arr[b:b + batch_size] for key, arr in block.items()}
+                else:
+                    idx = order[b:b + batch_size]
+                    yield {key: arr[idx] for key, arr in block.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate sharded synthetic student data')
+    parser.add_argument('--out', type=str, required=True)
+    parser.add_argument('--samples', type=int, required=True)
+    parser.add_argument('--shard-size', type=int, default=1_000_000)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--seq-len', type=int, default=10)
+    parser.add_argument('--workers', type=int, default=0, help='Processes to use (0 -> one per CPU)')
+    args = parser.parse_args()
+    manifest = write_shards(args.out, args.samples, shard_size=args.shard_size, seed=args.seed, seq_len=args.seq_len, workers=args.workers or None)
+    print(f"Wrote {len(manifest['shards'])} shards ({manifest['n_samples']} rows) to {args.out} in {manifest['generation_seconds']:.1f}s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+"""Numpy arrays published once in shared memory for a pool of worker processes.
+
+The parent generates a dataset and copies each array into a
+``multiprocessing.shared_memory`` block; workers attach to the blocks by name
+and wrap them in numpy arrays without copying, so N workers cost one copy of
+the data instead of N regenerations::
+
+    with SharedArrays({'X': X, 'y': y}) as shared:
+        pool = ProcessPoolExecutor(initializer=init, initargs=(shared.spec,))
+        ...
+
+    def init(spec):
+        global DATA, _HANDLES
+        DATA, _HANDLES = attach(spec)   # keep _HANDLES alive while DATA is used
+
+Attached arrays are read-only; take a copy before modifying one.
+"""
+from multiprocessing import shared_memory
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+# name -> (shared memory block name, shape, dtype string)
+Spec = Dict[str, Tuple[str, Tuple[int, ...], str]]
+
+
+class SharedArrays:
+    """Owns the shared memory blocks; ``close()`` (or leaving the ``with``) unlinks them."""
+
+    def __init__(self, arrays: Dict[str, np.ndarray]):
+        self._blocks: List[shared_memory.SharedMemory] = []
+        self.spec: Spec = {}
+        try:
+            for name, arr in arrays.items():
+                arr = np.ascontiguousarray(arr)
+                block = shared_memory.SharedMemory(create=True, size=max(1, arr.nbytes))
+                self._blocks.append(block)
+                np.ndarray(arr.shape, dtype=arr.dtype, buffer=block.buf)[...] = arr
+                self.spec[name] = (block.name, arr.shape, arr.dtype.str)
+        except Exception:
+            self.close()
+            raise
+
+    @property
+    def nbytes(self) -> int:
+        return sum(b.size for b in self._blocks)
+
+    def close(self):
+        for block in self._blocks:
+            block.close()
+            try:
+                block.unlink()
+            except FileNotFoundError:
+                pass
+        self._blocks = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+
+def attach(spec: Spec) -> Tuple[Dict[str, np.ndarray], List[shared_memory.SharedMemory]]:
+    """Map the arrays described by ``spec``; returns (arrays, handles to keep referenced)."""
+    arrays: Dict[str, np.ndarray] = {}
+    handles: List[shared_memory.SharedMemory] = []
+    for name, (block_name, shape, dtype) in spec.items():
+        block = shared_memory.SharedMemory(name=block_name)
+        handles.append(block)
+        arr = np.ndarray(shape, dtype=np.dtype(dtype), buffer=block.buf)
+        arr.flags.writeable = False
+        arrays[name] = arr
+    return arrays, handles
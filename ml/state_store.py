@@ -0,0 +1,138 @@
+"""Per-student LSTM state for incremental regression inference.
+
+The regressor's LSTM summarises a student's whole grade history in its final
+``(h, c)`` state. If that state is kept, appending grades costs one LSTM step
+per new grade plus the fc head, instead of re-running every timestep.
+
+``StateStore`` is an LRU of those states keyed by (checkpoint fingerprint,
+student key), bounded by entry count. With ``spill_dir`` set, evicted states
+are written to disk (one small ``.npz`` per student, under a directory per
+fingerprint) and promoted back to memory on their next use. Keying on the
+fingerprint means a reloaded model never resumes from another model's state;
+``invalidate`` drops a retired model's states in memory and on disk.
+"""
+import hashlib
+import os
+import shutil
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+import numpy as np
+
+
+class StudentState:
+    """Final LSTM state after ``steps`` grades (``h`` and ``c`` are (H,) float32)."""
+    __slots__ = ('h', 'c', 'steps')
+
+    def __init__(self, h: np.ndarray, c: np.ndarray, steps: int):
+        self.h = h
+        self.c = c
+        self.steps = steps
+
+
+class StateStore:
+    def __init__(self, max_entries: int = 100000, spill_dir: str = ''):
+        self.max_entries = int(max_entries)
+        self.spill_dir = spill_dir
+        self._data: 'OrderedDict[Tuple[str, str], StudentState]' = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.spills = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0
+
+    def _spill_path(self, fingerprint: str, student: str) -> str:
+        name = hashlib.sha1(student.encode()).hexdigest()
+        return os.path.join(self.spill_dir, fingerprint, name[:2], name + '.npz')
+
+    def _spill(self, key: Tuple[str, str], state: StudentState):
+        path = self._spill_path(*key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = path + '.tmp.npz'
+        np.savez(tmp, h=state.h, c=state.c, steps=np.int64(state.steps))
+        os.replace(tmp, path)
+        self.spills += 1
+
+    def _unspill(self, key: Tuple[str, str]) -> Optional[StudentState]:
+        path = self._spill_path(*key)
+        try:
+            with np.load(path) as f:
+                state = StudentState(np.array(f['h']), np.array(f['c']), int(f['steps']))
+        except (OSError, KeyError, ValueError):
+            return None
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        return state
+
+    def get(self, fingerprint: str, student: str) -> Tuple[Optional[StudentState], str]:
+        """(state or None, where it came from: 'memory', 'disk' or 'miss')."""
+        if not self.enabled:
+            return None, 'miss'
+        key = (fingerprint, student)
+        with self._lock:
+            state = self._data.get(key)
+            if state is not None:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return state, 'memory'
+        if self.spill_dir:
+            state = self._unspill(key)
+            if state is not None:
+                self.disk_hits += 1
+                self.put(fingerprint, student, state)
+                return state, 'disk'
+        self.misses += 1
+        return None, 'miss'
+
+    def put(self, fingerprint: str, student: str, state: StudentState):
+        if not self.enabled:
+            return
+        evicted = []
+        with self._lock:
+            self._data[(fingerprint, student)] = state
+            self._data.move_to_end((fingerprint, student))
+            while len(self._data) > self.max_entries:
+                evicted.append(self._data.popitem(last=False))
+                self.evictions += 1
+        if self.spill_dir:
+            # Disk writes happen outside the lock
+            for key, old in evicted:
+                self._spill(key, old)
+
+    def delete(self, fingerprint: str, student: str):
+        with self._lock:
+            self._data.pop((fingerprint, student), None)
+        if self.spill_dir:
+            try:
+                os.remove(self._spill_path(fingerprint, student))
+            except OSError:
+                pass
+
+    def invalidate(self, fingerprint: str):
+        """Drop every state computed by checkpoint ``fingerprint`` (after it is unloaded)."""
+        with self._lock:
+            for key in [k for k in self._data if k[0] == fingerprint]:
+                del self._data[key]
+        if self.spill_dir:
+            shutil.rmtree(os.path.join(self.spill_dir, fingerprint), ignore_errors=True)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'enabled': self.enabled,
+            'entries': len(self._data),
+            'max_entries': self.max_entries,
+            'spill_dir': self.spill_dir or None,
+            'hits': self.hits,
+            'disk_hits': self.disk_hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'spills': self.spills,
+        }
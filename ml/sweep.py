@@ -0,0 +1,306 @@
+"""Parallel hyperparameter sweep with successive halving.
+
+The dataset is generated once in the parent and published through shared
+memory (``ml.shared_data``), and trials run in a process pool, each worker
+pinned to ``cpus // workers`` torch threads. Successive halving spends little
+on poor configurations. Rung 0 trains every configuration for
+``--min-epochs``. Only the best ``1/eta`` continue, each resuming from its own
+training state for ``eta`` times more epochs, until ``--max-epochs`` is reached.
+A trial's score is its best validation epoch over all the rungs it ran.
+
+Every trial checkpoint (``trial_NNN.pt``) is a regular trainer checkpoint
+holding the best epoch's weights (loadable by ``ml.serve`` / ``ml.export``).
+Next to it, ``trial_NNN.state.pt`` holds the training state in the trainers'
+``--checkpoint-path`` format (last epoch's weights, optimizer state, early
+stopping and history) that the next rung resumes from. The leaderboard is
+written to ``<out-dir>/leaderboard.json`` and the best trial is copied to
+``--save-path``. Trial files left in ``--out-dir`` by an earlier sweep are
+deleted at the start.
+
+Each worker builds the train/validation tensors once from the shared arrays;
+trials only choose how they are sliced into batches.
+
+Usage:
+    python -m ml.sweep --trainer regression --limit 20000 --workers 4 \\
+        --param hidden_size=16,32,64 --param fc_hidden=32,64 --param lr=1e-3,3e-3 \\
+        --param batch_size=32,128 --min-epochs 3 --max-epochs 27 --save-path lstm_reg.pt
+
+    python -m ml.sweep --trainer classifier --bucket-5 --add-difficulty \\
+        --param lr=3e-4,1e-3,3e-3 --param batch_size=32,64,128 --search random --trials 6
+"""
+import argparse
+import glob
+import importlib
+import itertools
+import json
+import math
+import os
+import random
+import shutil
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Tuple
+
+import multiprocessing as mp
+
+try:
+    from . import data as data_mod  # type: ignore
+    from .runtime import cpu_quota  # type: ignore
+    from .shared_data import SharedArrays, attach  # type: ignore
+    from .training import Checkpointer  # type: ignore
+except ImportError:  # pragma: no cover
+    current_dir = os.path.dirname(os.path.abspath(__file__))
+    parent_dir = os.path.dirname(current_dir)
+    if parent_dir not in sys.path:
+        sys.path.append(parent_dir)
+    import ml.data as data_mod  # type: ignore
+    from ml.runtime import cpu_quota  # type: ignore
+    from ml.shared_data import SharedArrays, attach  # type: ignore
+    from ml.training import Checkpointer  # type: ignore
+
+# Tunable hyperparameters per trainer and their defaults
+SEARCH_SPACE = {
+    'regression': {'hidden_size': [32], 'fc_hidden': [64], 'lr': [1e-3], 'batch_size': [32]},
+    'classifier': {'lr': [1e-3], 'batch_size': [32]},
+}
+INT_PARAMS = {'hidden_size', 'fc_hidden', 'batch_size'}
+# Whether a higher validation score is better
+MAXIMIZE = {'regression': False, 'classifier': True}
+
+# Worker process state (set by _init_worker)
+_DATA: Dict = {}
+_HANDLES: List = []
+_SETTINGS: Dict = {}
+_SPLIT: Tuple = ()
+
+
+def parse_params(trainer: str, specs: List[str]) -> Dict[str, List]:
+    space = {k: list(v) for k, v in SEARCH_SPACE[trainer].items()}
+    for spec in specs:
+        name, sep, values = spec.partition('=')
+        name = name.strip().replace('-', '_')
+        if not sep or name not in space:
+            raise ValueError(f"invalid --param {spec!r}; tunable for {trainer}: {', '.join(space)}")
+        cast = int if name in INT_PARAMS else float
+        space[name] = [cast(v) for v in values.split(',') if v.strip()]
+    return space
+
+
+def make_configs(space: Dict[str, List], search: str, trials: int, seed: int) -> List[Dict]:
+    names = list(space)
+    grid = [dict(zip(names, values)) for values in itertools.product(*(space[n] for n in names))]
+    if search == 'grid' or trials <= 0 or trials >= len(grid):
+        return grid
+    return random.Random(seed).sample(grid, trials)
+
+
+def _ml_module(name: str):
+    # Trainer modules import torch; only the workers need them
+    return importlib.import_module(f'.{name}', __package__ or 'ml')
+
+
+def _init_worker(spec, settings: Dict, threads: int):
+    global _DATA, _HANDLES, _SETTINGS
+    import torch
+    torch.set_num_threads(threads)
+    _DATA, _HANDLES = attach(spec)
+    _SETTINGS = settings
+
+
+def _split() -> Tuple:
+    # Same split for every trial (fixed seed); the tensors are built once per worker
+    global _SPLIT
+    if not _SPLIT:
+        s = _SETTINGS
+        if s['trainer'] == 'regression':
+            train_loader, val_loader = _ml_module('lstm_regression').build_loaders(_DATA, seq_len=s['seq_len'], batch_size=1, test_size=s['test_size'],
+                                                                                   scale_grades=s['scale_grades'], use_difficulty=s['use_difficulty'], seed=s['seed'])
+        else:
+            train_loader, val_loader = _ml_module('Model').build_loaders(_DATA['X'], _DATA['y'], batch_size=1, test_size=s['test_size'], seed=s['seed'])
+        _SPLIT = (train_loader.tensors, val_loader.tensors)
+    return _SPLIT
+
+
+def _loaders(batch_size: int, seed: int):
+    """Loaders over the worker's split tensors; only the batch slicing differs between trials."""
+    TensorBatchLoader = _ml_module('tensor_loader').TensorBatchLoader
+    train, val = _split()
+    return TensorBatchLoader(*train, batch_size=batch_size, shuffle=True, seed=seed), TensorBatchLoader(*val, batch_size=batch_size)
+
+
+def _build(config: Dict):
+    s = _SETTINGS
+    if s['trainer'] == 'regression':
+        return _ml_module('lstm_regression').StudentPerformanceModel(seq_len=s['seq_len'], hidden_size=config['hidden_size'], fc_hidden=config['fc_hidden'], use_difficulty=s['use_difficulty'])
+    return _ml_module('Model').ConvClassifier(total_dim=len(s['feature_columns']), seq_len=s['seq_len'], num_classes=s['num_classes'])
+
+
+def _meta(config: Dict) -> Dict:
+    """Checkpoint fields other than the weights and the score."""
+    s = _SETTINGS
+    if s['trainer'] == 'regression':
+        return {
+            'model_type': 'lstm_regression',
+            'seq_len': s['seq_len'],
+            'hidden_size': config['hidden_size'],
+            'fc_hidden': config['fc_hidden'],
+            'use_difficulty': s['use_difficulty'],
+            'scale_grades': s['scale_grades'],
+            'quantiles': [],
+            'args': dict(config),
+        }
+    return {
+        'input_dim': len(s['feature_columns']),
+        'num_classes': s['num_classes'],
+        'seq_len': s['seq_len'],
+        'feature_columns': s['feature_columns'],
+        'args': dict(config),
+    }
+
+
+def _state_path(path: str) -> str:
+    """Where the resumable training state of trial checkpoint ``path`` lives."""
+    return os.path.splitext(path)[0] + '.state.pt'
+
+
+def run_trial(trial: int, config: Dict, epochs: int, path: str) -> Dict:
+    """Train ``config`` up to ``epochs`` total epochs, resuming from its training state if there is one."""
+    import torch
+    import torch.optim as optim
+    s = _SETTINGS
+    torch.manual_seed(s['seed'] + trial)
+    model = _build(config)
+    optimizer = optim.Adam(model.parameters(), lr=config['lr'])
+    resume = None
+    if os.path.exists(_state_path(path)):
+        resume = _ml_module('checkpoint').read_checkpoint(_state_path(path))
+        # Last epoch's weights, matching the saved optimizer moments; the best epoch
+        # so far travels in the early-stopping state
+        model.load_state_dict(resume['model_state'])
+    done = resume['epoch'] if resume is not None else 0
+    # Saved once, after the last epoch of this rung
+    checkpointer = Checkpointer(_state_path(path), lambda: _meta(config), every=epochs)
+    # New shuffles for the epochs a resumed trial adds
+    train_loader, val_loader = _loaders(config['batch_size'], seed=s['seed'] + 1000 * trial + done)
+    started = time.perf_counter()
+    if s['trainer'] == 'regression':
+        score, _ = _ml_module('lstm_regression').train(model, train_loader, val_loader, 'cpu', epochs=epochs, lr=config['lr'], scale_grades=s['scale_grades'],
+                                                       tolerance_acc=None, want_val_acc=False, rel_acc=None, optimizer=optimizer, verbose=False,
+                                                       checkpointer=checkpointer, resume=resume)
+    else:
+        score, _ = _ml_module('Model').train(model, train_loader, val_loader, 'cpu', epochs=epochs, lr=config['lr'], optimizer=optimizer, verbose=False,
+                                             checkpointer=checkpointer, resume=resume)
+    # train() restored the best epoch over every rung this trial ran
+    ckpt = dict(_meta(config), model_state=model.state_dict())
+    ckpt['best_val_mae' if s['trainer'] == 'regression' else 'best_val_acc'] = score
+    tmp = path + '.tmp'
+    torch.save(ckpt, tmp)
+    os.replace(tmp, path)
+    return {'trial': trial, 'epochs': epochs, 'score': score, 'train_s': time.perf_counter() - started}
+
+
+def _shared_dataset(args) -> Tuple[Dict, Dict]:
+    """Generate the data once; returns (arrays to share, settings for the workers)."""
+    raw = data_mod.fetch_raw_arrays(args.limit, seed=args.seed)
+    seq_len = raw['past_grades'].shape[1]
+    settings = dict(trainer=args.trainer, seq_len=seq_len, test_size=args.test_size, seed=args.seed, scale_grades=args.scale_grades)
+    if args.trainer == 'regression':
+        settings['use_difficulty'] = not args.no_difficulty
+        arrays = {k: raw[k] for k in ('past_grades', 'difficulty', 'current_grade')}
+    else:
+        if not (args.bucket_5 or args.ten_class):
+            raise SystemExit('Specify --ten-class or --bucket-5 for the classifier')
+        X, y = data_mod.build_features(raw, scale_grades=args.scale_grades, add_difficulty=args.add_difficulty,
+                                       ten_class=args.ten_class, bucket_5=args.bucket_5, return_type='numpy')
+        settings.update(num_classes=5 if args.bucket_5 else 10, feature_columns=data_mod.feature_columns(seq_len, args.add_difficulty))
+        arrays = {'X': X, 'y': y}
+    return arrays, settings
+
+
+def successive_halving(pool, configs: List[Dict], out_dir: str, min_epochs: int, max_epochs: int, eta: int, maximize: bool) -> List[Dict]:
+    trials = [{'trial': i, 'config': c, 'epochs': 0, 'score': None, 'rung': -1, 'train_s': 0.0,
+               'checkpoint': os.path.join(out_dir, f'trial_{i:03d}.pt')} for i, c in enumerate(configs)]
+    alive = list(trials)
+    rung = 0
+    epochs = min(min_epochs, max_epochs)
+    while alive:
+        futures = [pool.submit(run_trial, t['trial'], t['config'], epochs, t['checkpoint']) for t in alive]
+        for t, fut in zip(alive, futures):
+            res = fut.result()
+            t.update(epochs=res['epochs'], score=res['score'], rung=rung, train_s=t['train_s'] + res['train_s'])
+        alive.sort(key=lambda t: t['score'], reverse=maximize)
+        best = alive[0]
+        print(f"Rung {rung}: {len(alive)} trial(s) at {epochs} epochs | best trial {best['trial']} score {best['score']:.4f} {best['config']}")
+        if epochs >= max_epochs or len(alive) == 1:
+            break
+        alive = alive[:max(1, len(alive) // eta)]
+        rung += 1
+        epochs = min(max_epochs, epochs * eta)
+    # Trials that reached the furthest rung first, then by score within a rung
+    sign = -1.0 if maximize else 1.0
+    return sorted(trials, key=lambda t: (-t['rung'], sign * t['score']))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Parallel hyperparameter sweep with successive halving')
+    parser.add_argument('--trainer', type=str, default='regression', choices=['regression', 'classifier'])
+    parser.add_argument('--param', action='append', default=[], help='name=v1,v2,... (repeatable); regression: hidden_size, fc_hidden, lr, batch_size; classifier: lr, batch_size')
+    parser.add_argument('--search', type=str, default='grid', choices=['grid', 'random'])
+    parser.add_argument('--trials', type=int, default=0, help='Configurations sampled from the grid for --search random')
+    parser.add_argument('--min-epochs', type=int, default=3, help='Epochs per configuration in the first rung')
+    parser.add_argument('--max-epochs', type=int, default=27, help='Epochs for the configurations that survive every rung')
+    parser.add_argument('--eta', type=int, default=3, help='Keep the best 1/eta configurations per rung')
+    parser.add_argument('--workers', type=int, default=0, help='Parallel trials (0 -> one per CPU)')
+    parser.add_argument('--limit', type=int, default=0, help='Number of synthetic samples (0 -> default 1000)')
+    parser.add_argument('--test-size', type=float, default=0.2)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--scale-grades', action='store_true')
+    parser.add_argument('--no-difficulty', action='store_true', help='Regression: exclude difficulty feature')
+    parser.add_argument('--add-difficulty', action='store_true', help='Classifier: include difficulty feature')
+    parser.add_argument('--ten-class', action='store_true')
+    parser.add_argument('--bucket-5', action='store_true')
+    parser.add_argument('--out-dir', type=str, default='sweep', help='Trial checkpoints and leaderboard.json')
+    parser.add_argument('--save-path', type=str, default='', help='Copy the best checkpoint here')
+    args = parser.parse_args()
+    if args.eta < 2:
+        raise SystemExit('--eta must be >= 2')
+
+    try:
+        configs = make_configs(parse_params(args.trainer, args.param), args.search, args.trials, args.seed)
+    except ValueError as e:
+        raise SystemExit(str(e))
+    cpus = max(1, math.floor(cpu_quota()))
+    workers = max(1, min(args.workers or cpus, len(configs)))
+    threads = max(1, cpus // workers)
+    os.makedirs(args.out_dir, exist_ok=True)
+    # Trials resume only within this run; a previous sweep's files would be resumed as if they were ours
+    for stale in glob.glob(os.path.join(args.out_dir, 'trial_*.pt*')):
+        os.remove(stale)
+
+    arrays, settings = _shared_dataset(args)
+    started = time.perf_counter()
+    with SharedArrays(arrays) as shared:
+        print(f'{len(configs)} configuration(s), {workers} worker(s) x {threads} thread(s), dataset {shared.nbytes / 1e6:.1f} MB in shared memory')
+        # spawn: workers start clean instead of inheriting the parent's torch state
+        with ProcessPoolExecutor(max_workers=workers, mp_context=mp.get_context('spawn'),
+                                 initializer=_init_worker, initargs=(shared.spec, settings, threads)) as pool:
+            leaderboard = successive_halving(pool, configs, args.out_dir, args.min_epochs, args.max_epochs, args.eta, MAXIMIZE[args.trainer])
+    elapsed = time.perf_counter() - started
+
+    metric = 'val_acc' if MAXIMIZE[args.trainer] else 'val_mae'
+    print(f"{'rank':>4} {'trial':>5} {'epochs':>6} {metric:>8}  config")
+    for rank, t in enumerate(leaderboard, 1):
+        print(f"{rank:>4} {t['trial']:>5} {t['epochs']:>6} {t['score']:>8.4f}  {t['config']}")
+    with open(os.path.join(args.out_dir, 'leaderboard.json'), 'w') as f:
+        json.dump({'trainer': args.trainer, 'metric': metric, 'elapsed_s': elapsed, 'workers': workers,
+                   'threads_per_worker': threads, 'args': vars(args), 'trials': leaderboard}, f, indent=2)
+    best = leaderboard[0]
+    print(f"Best: trial {best['trial']} {metric} {best['score']:.4f} {best['config']} ({elapsed:.1f}s)")
+    if args.save_path:
+        shutil.copyfile(best['checkpoint'], args.save_path)
+        print(f'Saved best checkpoint to {args.save_path}')
+
+
+if __name__ == '__main__':
+    main()
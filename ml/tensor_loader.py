@@ -0,0 +1,65 @@
+"""Batch-level loader for datasets that already live in memory as tensors.
+
+``torch.utils.data.DataLoader`` calls ``__getitem__`` once per sample and then
+collates the pieces, which dominates the step time for models this small.
+``TensorBatchLoader`` instead draws one permutation per epoch, gathers every
+tensor with a single ``index_select`` and yields contiguous slices of the result.
+"""
+from typing import Iterator, Optional, Tuple
+
+import torch
+
+
+class TensorBatchLoader:
+    """Iterates aligned tensors in batches along dim 0.
+
+    ``reuse_buffers`` keeps the per-epoch shuffled copies allocated across epochs
+    (batches are views into them, so consume a batch before asking for the next
+    epoch). ``pin_memory`` allocates those buffers in page-locked memory so the
+    host-to-device copy can use ``non_blocking=True``; it is ignored without CUDA.
+    """
+
+    def __init__(self, *tensors: torch.Tensor, batch_size: int = 32, shuffle: bool = False, drop_last: bool = False,
+                 pin_memory: bool = False, reuse_buffers: bool = True, seed: Optional[int] = None):
+        if not tensors:
+            raise ValueError('at least one tensor is required')
+        n = tensors[0].size(0)
+        if any(t.size(0) != n for t in tensors):
+            raise ValueError('all tensors must have the same first dimension')
+        self.tensors = tuple(t.contiguous() for t in tensors)
+        self.batch_size = int(batch_size)
+        self.shuffle = shuffle
+        self.drop_last = drop_last
+        self.pin_memory = pin_memory and torch.cuda.is_available()
+        self.reuse_buffers = reuse_buffers
+        self._gen = torch.Generator()
+        if seed is not None:
+            self._gen.manual_seed(seed)
+        self._buffers: Optional[Tuple[torch.Tensor, ...]] = None
+        if self.pin_memory and not shuffle:
+            self.tensors = tuple(t.pin_memory() for t in self.tensors)
+
+    @property
+    def num_samples(self) -> int:
+        return self.tensors[0].size(0)
+
+    def __len__(self) -> int:
+        n = self.num_samples
+        return n // self.batch_size if self.drop_last else (n + self.batch_size - 1) // self.batch_size
+
+    def _epoch_tensors(self) -> Tuple[torch.Tensor, ...]:
+        if not self.shuffle:
+            return self.tensors
+        perm = torch.randperm(self.num_samples, generator=self._gen)
+        if self._buffers is None or not self.reuse_buffers:
+            self._buffers = tuple(torch.empty(t.shape, dtype=t.dtype, pin_memory=self.pin_memory) for t in self.tensors)
+        for src, dst in zip(self.tensors, self._buffers):
+            torch.index_select(src, 0, perm, out=dst)
+        return self._buffers
+
+    def __iter__(self) -> Iterator[Tuple[torch.Tensor, ...]]:
+        data = self._epoch_tensors()
+        n = self.num_samples
+        stop = n - (n % self.batch_size) if self.drop_last else n
+        for start in range(0, stop, self.batch_size):
+            yield tuple(t[start:start + self.batch_size] for t in data)
@@ -0,0 +1,105 @@
+"""Early stopping, best-weight tracking and resumable checkpoints for the trainers.
+
+``EarlyStopping`` keeps an in-memory copy of the weights from the best
+validation epoch and signals a stop after ``patience`` epochs without an
+improvement of at least ``min_delta``. ``restore`` loads those weights back so
+the saved model is the best one, not the last one.
+
+``Checkpointer`` writes a training checkpoint every ``every`` epochs. It holds
+the regular model checkpoint fields (so it also loads in ``ml.serve``) plus the
+optimizer state, the epoch, the early-stopping state and the history, which is
+everything ``train(..., resume=ckpt)`` needs to carry on where it stopped. The
+file is written to a temporary name and renamed into place, so an interrupted
+write never leaves a truncated checkpoint behind.
+"""
+import os
+from typing import Callable, Dict, List, Optional
+
+import torch
+
+
+class EarlyStopping:
+    def __init__(self, patience: int = 0, min_delta: float = 0.0, maximize: bool = False):
+        """``patience`` <= 0 never stops early but still tracks the best weights."""
+        self.patience = patience
+        self.min_delta = min_delta
+        self.maximize = maximize
+        self.best: Optional[float] = None
+        self.best_epoch = 0
+        self.best_state: Optional[Dict[str, torch.Tensor]] = None
+        self.bad_epochs = 0
+
+    def improved(self, value: float) -> bool:
+        if self.best is None:
+            return True
+        if self.maximize:
+            return value > self.best + self.min_delta
+        return value < self.best - self.min_delta
+
+    def update(self, value: float, model: torch.nn.Module, epoch: int) -> bool:
+        """Record this epoch's validation metric; returns True if it is a new best."""
+        value = float(value)
+        if self.improved(value):
+            self.best = value
+            self.best_epoch = epoch
+            self.best_state = {k: v.detach().clone() for k, v in model.state_dict().items()}
+            self.bad_epochs = 0
+            return True
+        self.bad_epochs += 1
+        return False
+
+    @property
+    def should_stop(self) -> bool:
+        return self.patience > 0 and self.bad_epochs >= self.patience
+
+    def restore(self, model: torch.nn.Module):
+        if self.best_state is not None:
+            model.load_state_dict(self.best_state)
+
+    def state_dict(self) -> Dict:
+        return {'best': self.best, 'best_epoch': self.best_epoch, 'best_state': self.best_state, 'bad_epochs': self.bad_epochs}
+
+    def load_state_dict(self, state: Dict):
+        self.best = state['best']
+        self.best_epoch = state['best_epoch']
+        self.best_state = state['best_state']
+        self.bad_epochs = state['bad_epochs']
+
+
+class Checkpointer:
+    def __init__(self, path: str, meta: Callable[[], Dict], every: int = 1):
+        """``meta`` returns the model checkpoint fields (everything but ``model_state``)."""
+        self.path = path
+        self.meta = meta
+        self.every = max(1, every)
+
+    def maybe_save(self, epoch: int, model, optimizer, stopper: EarlyStopping, history: Dict[str, List[float]], final: bool = False):
+        if final or epoch % self.every == 0:
+            self.save(epoch, model, optimizer, stopper, history)
+
+    def save(self, epoch: int, model, optimizer, stopper: EarlyStopping, history: Dict[str, List[float]]):
+        ckpt = dict(self.meta())
+        ckpt.update(
+            model_state=model.state_dict(),
+            optimizer_state=optimizer.state_dict(),
+            epoch=epoch,
+            early_stopping=stopper.state_dict(),
+            # plain floats keep the file loadable with weights_only=True
+            history={k: [float(v) for v in vals] for k, vals in history.items()},
+        )
+        tmp = self.path + '.tmp'
+        torch.save(ckpt, tmp)
+        os.replace(tmp, self.path)
+
+
+def resume_state(ckpt: Dict, optimizer, stopper: EarlyStopping, history: Dict[str, List[float]]) -> int:
+    """Load optimizer / early-stopping / history state from a training checkpoint; returns the next epoch."""
+    if 'optimizer_state' not in ckpt or 'epoch' not in ckpt:
+        raise ValueError('checkpoint has no training state (optimizer_state / epoch); it cannot be resumed')
+    optimizer.load_state_dict(ckpt['optimizer_state'])
+    if 'early_stopping' in ckpt:
+        stopper.load_state_dict(ckpt['early_stopping'])
+    for k, vals in ckpt.get('history', {}).items():
+        if k in history:
+            history[k][:] = vals
+    return ckpt['epoch'] + 1
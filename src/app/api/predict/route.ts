@@ -6,6 +6,8 @@ import clientPromise from "@/lib/mongodb";
 // Expect environment variable pointing to ML service base, e.g. http://127.0.0.1:8000
 const ML_BASE = process.env.ML_SERVICE_URL || "http://127.0.0.1:8000";
 const REG_ENDPOINT = "/predict_regression"; // currently serving regression
+// Set when the ML service runs a checkpoint trained with --variable-length: short histories are sent as-is
+const ML_VARIABLE_LENGTH = process.env.ML_VARIABLE_LENGTH === "1";
 
 interface UpstreamPrediction {
   predicted_grade: number;
@@ -17,7 +19,7 @@ interface UpstreamPrediction {
 function buildTenGrades(raw: number[]): number[] {
   if (raw.length === 0) return [];
   let selected = raw.slice(-10);
-  if (selected.length < 10) {
+  if (selected.length < 10 && !ML_VARIABLE_LENGTH) {
     const padValue = selected[0];
     const padCount = 10 - selected.length;
     selected = [...Array(padCount).fill(padValue), ...selected];